@@ -1,8 +1,5 @@
+import importlib
 from .utils import print_block, print_dict, print_rank, see_memory, load_nccl_pypi
-try:
-    from . import nccl
-except:
-    load_nccl_pypi()
 from .global_var import config, world_size, rank
 from .init import init_distributed
 
@@ -13,14 +10,47 @@ from .synchronize import synchronize, sum_loss, wait_loader, gather_result
 from .block_layer import Block, TransformerBlockList
 from .wrapper import BMTrainModelWrapper
 from .pipe_layer import PipelineTransformerBlockList
-from . import debug
-from .store import save, load
-
-from . import loss
-from . import distributed
-from . import nn
-from . import optim
-from . import inspect
-from . import lr_scheduler
 
 CheckpointBlock = Block
+
+# imported on first access, ``import bmtrain`` only loads what the core classes need
+_LAZY_MODULES = {
+    "benchmark",
+    "debug",
+    "distributed",
+    "inspect",
+    "loss",
+    "lr_scheduler",
+    "memory_tracer",
+    "metrics",
+    "nccl",
+    "nn",
+    "optim",
+    "partition_init",
+    "profiler",
+    "straggler",
+    "weight_stream",
+}
+_LAZY_ATTRS = {
+    "save": "store",
+    "load": "store",
+    "save_sharded": "sharded_store",
+    "load_sharded": "sharded_store",
+    "profile": "profiler",
+    "trace_memory": "memory_tracer",
+    "monitor_stragglers": "straggler",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        return importlib.import_module("." + name, __name__)
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module("." + _LAZY_ATTRS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | _LAZY_MODULES | set(_LAZY_ATTRS))
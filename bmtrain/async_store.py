@@ -0,0 +1,208 @@
+import os
+import queue
+import atexit
+import warnings
+import threading
+import torch
+import torch.multiprocessing as mp
+from collections import OrderedDict
+from typing import Optional
+from concurrent.futures import Future
+
+from .global_var import config
+from .mmap_store import save_mmap_state_dict, TENSOR_ALIGNMENT
+from .sharded_store import _local_entries, _build_index, _write_index, _shard_name, INDEX_NAME
+from .utils import round_up
+
+
+def _fsync(file_name):
+    fd = os.open(file_name, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _writer_main(requests, results):
+    """Entry of the writer process, writes snapshots from the shared host buffer."""
+    buffer = None
+    while True:
+        req = requests.get()
+        if req is None:
+            break
+        if req[0] == "buffer":
+            buffer = req[1]
+            continue
+        _, path, file_name, metas, compression = req
+        try:
+            os.makedirs(path, exist_ok=True)
+            state_dict = OrderedDict()
+            for key, dtype, offset, nbytes in metas:
+                state_dict[key] = buffer[offset : offset + nbytes].view(dtype)
+            tmp_name = os.path.join(path, file_name + ".tmp")
+            save_mmap_state_dict(state_dict, tmp_name, compression)
+            _fsync(tmp_name)
+            os.replace(tmp_name, os.path.join(path, file_name))
+            results.put(None)
+        except Exception as e:
+            results.put("{}: {}".format(type(e).__name__, e))
+
+
+class AsyncCheckpointer:
+    """Saves sharded checkpoints in the background.
+
+    :meth:`save` copies the partitions of this rank to a reusable pinned host buffer on a side
+    stream, and returns once the copy is done, so the training can go on updating the
+    parameters. A separate writer process, which does not compete with the training loop
+    for the GIL, serializes the snapshot in the format of :func:`bmtrain.save_sharded` and
+    fsyncs it. At most one snapshot is outstanding, :meth:`save` waits for the previous one.
+
+    The index of the checkpoint is written by rank 0 in :meth:`wait`, once the shards of all
+    ranks are written, so a checkpoint with an index is always complete. :meth:`wait` is called
+    by the next :meth:`save`, or call it on all ranks before loading the checkpoint.
+    """
+
+    def __init__(self):
+        ctx = mp.get_context("spawn")
+        self._requests = ctx.Queue()
+        self._results = ctx.Queue()
+        self._process = ctx.Process(
+            target=_writer_main, args=(self._requests, self._results), daemon=True
+        )
+        self._process.start()
+        self._buffer = None
+        self._pinned = False
+        self._stream = torch.cuda.Stream()
+        self._future = None
+        # the index of the outstanding snapshot and its directory, only on rank 0
+        self._index = None
+        atexit.register(self.close)
+
+    def _ensure_buffer(self, nbytes):
+        if self._buffer is not None and self._buffer.numel() >= nbytes:
+            return
+        self._release_buffer()
+        # shared with the writer process, and registered with CUDA for asynchronous copies
+        self._buffer = torch.empty(nbytes, dtype=torch.uint8).share_memory_()
+        self._pinned = (
+            nbytes > 0
+            and torch.cuda.cudart().cudaHostRegister(self._buffer.data_ptr(), nbytes, 0) == 0
+        )
+        self._requests.put(("buffer", self._buffer))
+
+    def _release_buffer(self):
+        if self._buffer is not None and self._pinned:
+            torch.cuda.cudart().cudaHostUnregister(self._buffer.data_ptr())
+        self._buffer = None
+        self._pinned = False
+
+    def _wait_result(self, future, process):
+        while True:
+            try:
+                err = self._results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+            # the result may have been put right before the writer exited
+            try:
+                err = self._results.get_nowait()
+                break
+            except queue.Empty:
+                future.set_exception(RuntimeError(
+                    "failed to write checkpoint: the writer process exited with code {}".format(process.exitcode)
+                ))
+                return
+        if err is None:
+            future.set_result(None)
+        else:
+            future.set_exception(RuntimeError("failed to write checkpoint: " + err))
+
+    def wait(self):
+        """Waits until the last snapshot is written by all ranks and writes its index,
+        a collective operation."""
+        from .distributed.object_ops import gather_objects, broadcast_object
+
+        if self._future is None:
+            return
+        future, self._future = self._future, None
+        index, self._index = self._index, None
+        error = future.exception()
+        written = gather_objects(error is None)
+        if written is not None and all(written):
+            _write_index(index[0], index[1])
+            _fsync(os.path.join(index[1], INDEX_NAME))
+        failed = broadcast_object(written is not None and not all(written))
+        if error is not None:
+            raise error
+        if failed:
+            raise RuntimeError("failed to write checkpoint: the shards of other ranks are not written")
+
+    def save(self, model: torch.nn.Module, path: str, compression: Optional[str] = None) -> Future:
+        """Takes a snapshot of ``model`` and writes it to ``path`` in the background.
+
+        Args:
+            model (torch.nn.Module): The model to be saved.
+            path (str): The directory of the checkpoint, created if it does not exist.
+            compression (Optional[str]): Compress the shard in chunks with this codec, see :class:`bmtrain.mmap_store.MmapStateDictWriter`.
+
+        Returns:
+            concurrent.futures.Future: done when the shard of this rank is written, the index is
+            written by the next :meth:`wait`.
+        """
+        # back-pressure: the buffer is reused, the previous snapshot must be written first
+        self.wait()
+
+        entries = _local_entries(model, config["topology"].pipe_idx == 0)
+        metas = []
+        nbytes = 0
+        for it in entries:
+            size = it["target"].numel() * it["target"].element_size()
+            metas.append((it["key"], it["target"].dtype, nbytes, size))
+            nbytes = round_up(nbytes + size, TENSOR_ALIGNMENT)
+        self._ensure_buffer(nbytes)
+
+        self._stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(self._stream):
+            for it, (_, dtype, offset, size) in zip(entries, metas):
+                if size > 0:
+                    self._buffer[offset : offset + size].view(dtype).copy_(
+                        it["target"], non_blocking=self._pinned
+                    )
+        # the parameters may change once this returns
+        self._stream.synchronize()
+
+        index = _build_index(entries)
+        if index is not None:
+            self._index = (index, path)
+        self._future = Future()
+        self._requests.put(("write", path, _shard_name(config["rank"]), metas, compression))
+        threading.Thread(
+            target=self._wait_result, args=(self._future, self._process), daemon=True
+        ).start()
+        return self._future
+
+    def close(self):
+        """Waits for the outstanding snapshot and stops the writer process.
+
+        It is not a collective operation, so the index of an outstanding snapshot is not
+        written, call :meth:`wait` on all ranks before.
+        """
+        if self._process is None:
+            return
+        if self._future is not None or self._index is not None:
+            warnings.warn(
+                "the last non-blocking checkpoint has no index and can not be loaded, "
+                "call bmtrain.async_store.get_async_checkpointer().wait() on all ranks after the last save"
+            )
+        self._requests.put(None)
+        self._process.join()
+        self._process = None
+        self._release_buffer()
+
+
+def get_async_checkpointer() -> AsyncCheckpointer:
+    """Returns the checkpointer shared by ``bmtrain.save_sharded(non_blocking=True)``."""
+    if "async_checkpointer" not in config:
+        config["async_checkpointer"] = AsyncCheckpointer()
+    return config["async_checkpointer"]
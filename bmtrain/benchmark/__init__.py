@@ -1,3 +1,5 @@
 from .all_gather import all_gather
 from .reduce_scatter import reduce_scatter
-from .send_recv import send_recv
\ No newline at end of file
+from .send_recv import send_recv
+from .checkpoint_io import checkpoint_io
+from .import_time import import_time
@@ -0,0 +1,43 @@
+import os
+import time
+import tempfile
+import torch
+from ..mmap_store import save_mmap_state_dict, MmapStateDict
+from ..utils import print_rank
+from .utils import format_size
+
+def checkpoint_io(size=1 << 30, compressions=(None, "zlib"), path=None):
+    """Effective write and read bandwidth of a checkpoint with and without compression.
+
+    The tensors are bf16 weights and fp32 moments, like the model and optimizer states.
+    """
+    state_dict = {
+        "weight": torch.randn(size // 4, dtype=torch.bfloat16),
+        "exp_avg_sq": torch.randn(size // 8, dtype=torch.float32).square_() * 1e-4,
+    }
+    nbytes = sum(v.numel() * v.element_size() for v in state_dict.values())
+    dirname = tempfile.mkdtemp(dir=path)
+    file_name = os.path.join(dirname, "checkpoint_io.bin")
+    for compression in compressions:
+        st = time.perf_counter()
+        save_mmap_state_dict(state_dict, file_name, compression)
+        fd = os.open(file_name, os.O_RDONLY)
+        os.fsync(fd)
+        os.close(fd)
+        write_time = time.perf_counter() - st
+        file_size = os.path.getsize(file_name)
+
+        st = time.perf_counter()
+        loaded = MmapStateDict(file_name)
+        for key in state_dict:
+            # touch every page of uncompressed tensors
+            loaded[key].clone()
+        read_time = time.perf_counter() - st
+
+        print_rank("Checkpoint I/O:\tcodec {}\tsize {}\tratio: {:.3f}\twrite: {:2.3f} GB/s\tread: {:2.3f} GB/s".format(
+            compression, format_size(nbytes), file_size / nbytes,
+            nbytes / 1024 / 1024 / 1024 / write_time, nbytes / 1024 / 1024 / 1024 / read_time
+        ))
+        del loaded
+        os.remove(file_name)
+    os.rmdir(dirname)
@@ -0,0 +1,45 @@
+import sys
+import subprocess
+from ..utils import print_rank
+
+
+def _measure(statement):
+    # a fresh interpreter, nothing is cached in sys.modules
+    ret = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+    )
+    modules = []
+    for line in ret.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def import_time(statement="import bmtrain", repeat=5, top=10):
+    """Time of ``statement`` in a fresh interpreter, the median of ``repeat`` runs.
+
+    The bmtrain modules with the largest own import time and the heavy subpackages that the
+    statement loads are printed, so that an eager import slipping back in is easy to spot.
+
+    Returns:
+        float: the median time in seconds.
+    """
+    runs = [_measure(statement) for _ in range(repeat)]
+    totals = sorted(sum(self_us for _, self_us, _ in modules) for modules in runs)
+    median = totals[len(totals) // 2] / 1e6
+
+    modules = runs[len(runs) // 2]
+    names = {name for name, _, _ in modules}
+    lazy = ["bmtrain.C", "bmtrain.nn", "bmtrain.optim", "bmtrain.loss", "bmtrain.inspect", "bmtrain.lr_scheduler"]
+    print_rank("Import time:\t{}\t{:.3f}s\tloaded: {}".format(
+        statement, median, ", ".join(name for name in lazy if name in names) or "-"
+    ))
+    ours = sorted(
+        (m for m in modules if m[0].split(".")[0] == "bmtrain"), key=lambda m: m[1], reverse=True
+    )
+    for name, self_us, cumulative_us in ours[:top]:
+        print_rank("\t{:<40s}\tself: {:.3f}s\tcumulative: {:.3f}s".format(name, self_us / 1e6, cumulative_us / 1e6))
+    return median
@@ -1,11 +1,13 @@
-from typing import Dict, Iterable, Iterator, Union, List
+from typing import Dict, Iterable, Iterator, Union, List, Optional
 
 from .utils import round_up, tp_split_tensor
 from .global_var import config
 import torch
 from . import nccl
 from .parameter import DistributedParameter, OpAllGather
+from .partition_init import ElementwiseInit
 from .zero_context import ZeroContext
+from .profiler import record, COMPUTE
 from . import hook_func
 import inspect
 from torch.utils.checkpoint import checkpoint
@@ -59,6 +61,8 @@ class Block(torch.nn.Module):
         initialized (bool): initialized parameter storage. Default False.
         mode (str): the mode shouled be "PIPE" when runing in pipeline mode, otherwise mode="BLOCK". Default "BLOCK"
 
+    If the inner module is built on the meta device, the storage of this rank is allocated without gathering the parameters, and it is left uninitialized until :func:`bmtrain.init_parameters` or a checkpoint fills it.
+
     Examples:
         >>> transformer_block = TransformerBlock(...)
         >>> block = Block(transformer_block)
@@ -208,14 +212,18 @@ class Block(torch.nn.Module):
             storage_st = self._storage_info[kw_name]["begin"]
             storage_end = self._storage_info[kw_name]["end"]
 
+            # parameters built on the meta device have no values to gather
+            from_meta = getattr(param, "_from_meta", False)
+
             # make parameter contiguous in storage
-            with torch.no_grad():
-                contiguous_param = OpAllGather.apply(param)
+            if not from_meta:
+                with torch.no_grad():
+                    contiguous_param = OpAllGather.apply(param)
 
             if not (param_st >= storage_end or param_end <= storage_st):
                 # copy offset in parameter storage
                 offset_st = max(storage_st - param_st, 0)
-                offset_end = min(storage_end - param_st, contiguous_param.numel())
+                offset_end = min(storage_end - param_st, param_shape.numel())
                 assert offset_st < offset_end
 
                 # copy to offset in buffer storage
@@ -237,20 +245,31 @@ class Block(torch.nn.Module):
                 self._param_info[-1]["end"] = (to_offset_end - to_offset_st,)
                 setattr(param, "_start_partition", offset_st)
                 setattr(param, "_end_partition", offset_end)
-                param.data[:] = torch.tensor([], dtype=d_dtype, device=d_device).set_(
-                    contiguous_param.storage(), offset_st, (offset_end - offset_st,)
-                )[:]
-                del contiguous_param
+                if not from_meta:
+                    param.data[:] = torch.tensor([], dtype=d_dtype, device=d_device).set_(
+                        contiguous_param.storage(), offset_st, (offset_end - offset_st,)
+                    )[:]
             else:
                 param.data = torch.tensor([], dtype=param.dtype, device=param.device)
                 setattr(param, "_start_partition", None)
                 setattr(param, "_end_partition", 0)
+            if not from_meta:
+                del contiguous_param
             # clear parameter data, but keep the dtype and device
             setattr(param, "_in_block", True)
 
         for kw in offsets.keys():
             assert offsets[kw] == self._storage_info[kw]["total"]
 
+        # let optimizers map a flat partition back to the parameters it holds
+        for kw, storage_param in self._storage_params.items():
+            setattr(
+                storage_param,
+                "_param_info",
+                [it for it in self._param_info if it["kw_name"] == kw],
+            )
+            setattr(storage_param, "_partition_begin", self._storage_info[kw]["begin"])
+
     def set_pre_module(self, pre_module):
         """Set pre module for current Block."""
         if pre_module is not None:
@@ -318,12 +337,15 @@ class Block(torch.nn.Module):
             placeholder = torch.tensor([], requires_grad=torch.is_grad_enabled())
             return hook_func.OneStepNoGradFunc.apply(self, placeholder, *arg_list)
 
-        if self._use_checkpoint:
-            out = checkpoint(
-                self._module, *arg_list, use_reentrant=not self.all_input_no_grad
-            )
-        else:
-            out = self._module(*arg_list)
+        with record(type(self._module).__name__ + ".forward", COMPUTE), hook_func.track_activations(
+            self, torch.is_grad_enabled()
+        ):
+            if self._use_checkpoint:
+                out = checkpoint(
+                    self._module, *arg_list, use_reentrant=not self.all_input_no_grad
+                )
+            else:
+                out = self._module(*arg_list)
 
         return self.post_hook(out)
 
@@ -404,10 +426,7 @@ class Block(torch.nn.Module):
                 verify_size = verify_shape.numel()
                 assert input_param.numel() == verify_size
 
-                contiguous_param = (
-                    input_param.to(it["parameter"].dtype).cuda().contiguous()
-                )
-
+                contiguous_param = input_param
                 tp_split_dim = param._tp_split_dim
                 if tp_mode and tp_split_dim >= 0:
                     contiguous_param = tp_split_tensor(contiguous_param, tp_split_dim)
@@ -423,15 +442,19 @@ class Block(torch.nn.Module):
                 # PyTorch 1.11 changed the API of storage.__getitem__
                 d_dtype = self._storage_params[kw_name].dtype
                 d_device = self._storage_params[kw_name].device
+                # only the slice in this partition is moved to the device, which keeps
+                # memory mapped checkpoints from being read as a whole
+                contiguous_param = (
+                    contiguous_param.reshape(-1)[offset_st:offset_end]
+                    .to(d_dtype)
+                    .to(d_device)
+                    .contiguous()
+                )
                 torch.tensor([], dtype=d_dtype, device=d_device).set_(
                     self._storage_params[kw_name].storage(),
                     to_offset_st,
                     (to_offset_end - to_offset_st,),
-                )[:] = torch.tensor([], dtype=d_dtype, device=d_device).set_(
-                    contiguous_param.storage(), offset_st, (offset_end - offset_st,)
-                )[
-                    :
-                ]
+                )[:] = contiguous_param
                 del contiguous_param
             elif strict:
                 missing_keys.append(key)
@@ -508,12 +531,30 @@ class Block(torch.nn.Module):
         for kw, val in ret.items():
             yield kw, val
 
-    def init_parameters(self):
+    def init_parameters(self, prefix: Optional[str] = None):
         """
         Initialize distributed parameters in this block.
+
+        Parameters with an initializer of :mod:`bmtrain.partition_init` only compute the
+        partition of this rank, keyed by ``prefix`` and their name in the block, so ``prefix``
+        is required for them. It must be the name of this block in ``model.named_modules()``
+        followed by ``"."``, as :func:`bmtrain.init_parameters` passes it, to get the same
+        values as initializing the whole model.
         """
         for it in self._param_info:
             param = it["parameter"]
+            if isinstance(param, DistributedParameter) and isinstance(
+                param._init_method, ElementwiseInit
+            ):
+                if prefix is None:
+                    raise ValueError(
+                        "the prefix of the block in the model is required to initialize {}".format(it["name"])
+                    )
+                if param._start_partition is not None:
+                    param._init_method.fill_(
+                        param.data, prefix + it["name"], param, param._start_partition
+                    )
+                continue
             if (
                 isinstance(param, DistributedParameter)
                 and param._init_method is not None
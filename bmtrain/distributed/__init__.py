@@ -1 +1,2 @@
 from .ops import all_gather, all_reduce, broadcast, recv_activations, send_activations, reduce_scatter
+from .object_ops import all_gather_objects, broadcast_object, gather_objects
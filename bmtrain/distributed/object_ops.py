@@ -0,0 +1,120 @@
+import pickle
+from typing import Any, List
+
+from ..global_var import config
+from ..nccl import commCount, commRank, NCCLCommunicator
+
+# sequence number of the object collectives of every group, the same on all of its ranks
+_seq = {}
+
+
+def register_comm(comm: NCCLCommunicator, name: str):
+    """Names the group of ``comm`` for the object collectives, the ranks of a group must use
+    the same name, and groups with different ranks different names."""
+    if "comm_names" not in config:
+        config["comm_names"] = {}
+    config["comm_names"][id(comm)] = name
+
+
+def _group_key(comm):
+    name = config.get("comm_names", {}).get(id(comm), None)
+    if name is None:
+        raise ValueError("the communicator is not registered for object collectives")
+    seq = _seq.get(name, 0)
+    _seq[name] = seq + 1
+    return "obj/{}/{}".format(name, seq)
+
+
+def _release(store, key, keys, count):
+    # the last rank that is done with the keys removes them from the store
+    if store.add(key + "/done", 1) == count:
+        for k in keys:
+            store.delete_key(k)
+        store.delete_key(key + "/done")
+
+
+def broadcast_object(obj: Any, comm: NCCLCommunicator = None, src: int = 0) -> Any:
+    """Broadcasts a picklable object from the rank ``src`` of ``comm`` through the TCP store of
+    ``init_distributed``, without touching the GPU.
+
+    Pack many small objects in one container and broadcast it once, every call is a round
+    trip to the store.
+
+    Args:
+        obj (Any): The object on ``src``, ignored on the other ranks.
+        comm (NCCLCommunicator): The group, default the global communicator.
+        src (int): The rank in ``comm`` of the source.
+
+    Returns:
+        Any: the object of ``src``.
+    """
+    if comm is None:
+        comm = config["comm"]
+    size = commCount(comm)
+    if size == 1:
+        return obj
+    store = config["store"]
+    key = _group_key(comm)
+    if commRank(comm) == src:
+        store.set(key, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+        return obj
+    ret = pickle.loads(store.get(key))
+    _release(store, key, [key], size - 1)
+    return ret
+
+
+def all_gather_objects(obj: Any, comm: NCCLCommunicator = None) -> List[Any]:
+    """Gathers a picklable object from every rank of ``comm`` through the TCP store of
+    ``init_distributed``, without touching the GPU.
+
+    The objects are gathered on the first rank of ``comm``, which broadcasts them once, so the
+    number of store requests grows linearly with the size of the group. Use
+    :func:`gather_objects` when only one rank needs the objects.
+
+    Args:
+        obj (Any): The object of this rank.
+        comm (NCCLCommunicator): The group, default the global communicator.
+
+    Returns:
+        List[Any]: the objects of all ranks, ordered by the rank in ``comm``.
+    """
+    if comm is None:
+        comm = config["comm"]
+    if commCount(comm) == 1:
+        return [obj]
+    return broadcast_object(gather_objects(obj, comm, 0), comm, 0)
+
+
+def gather_objects(obj: Any, comm: NCCLCommunicator = None, dst: int = 0) -> List[Any]:
+    """Gathers a picklable object from every rank of ``comm`` on the rank ``dst`` through the
+    TCP store of ``init_distributed``, without touching the GPU.
+
+    Unlike :func:`all_gather_objects`, only ``dst`` reads the objects, so there is no
+    broadcast of all of them back to the group.
+
+    Args:
+        obj (Any): The object of this rank.
+        comm (NCCLCommunicator): The group, default the global communicator.
+        dst (int): The rank in ``comm`` that receives the objects.
+
+    Returns:
+        List[Any]: the objects of all ranks ordered by the rank in ``comm`` on ``dst``, ``None`` on the other ranks.
+    """
+    if comm is None:
+        comm = config["comm"]
+    size = commCount(comm)
+    if size == 1:
+        return [obj]
+    store = config["store"]
+    key = _group_key(comm)
+    keys = ["{}/{}".format(key, r) for r in range(size)]
+    store.set(keys[commRank(comm)], pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    if commRank(comm) != dst:
+        return None
+    if hasattr(store, "multi_get"):
+        data = store.multi_get(keys)
+    else:
+        data = [store.get(k) for k in keys]
+    for k in keys:
+        store.delete_key(k)
+    return [pickle.loads(d) for d in data]
@@ -1,5 +1,7 @@
 import torch
 from ..global_var import config
+from ..profiler import record, COMM
+from ..straggler import comm_call
 from ..nccl import allGather as ncclAllGather, recv
 from ..nccl import allReduce as ncclAllReduce
 from ..nccl import broadcast as ncclBroadcast
@@ -19,13 +21,16 @@ DTYPE_LIST = [
     torch.bool
 ]
 def send_activations(hidden_state, next_rank, comm):
-    send_meta(hidden_state, next_rank, comm)
-    ncclSend(hidden_state.storage(), next_rank, comm)
+    # the same site as the receive, the transfer is matched by its direction
+    with record("send", COMM), comm_call("pipe.p2p", comm, pair=(commRank(comm), next_rank)):
+        send_meta(hidden_state, next_rank, comm)
+        ncclSend(hidden_state.storage(), next_rank, comm)
 
 def recv_activations(prev_rank, comm):
-    dtype, shape = recv_meta(prev_rank, comm)
-    hidden_state = torch.empty(shape, dtype=dtype, device="cuda")
-    ncclRecv(hidden_state.storage(), prev_rank, comm)
+    with record("recv", COMM), comm_call("pipe.p2p", comm, pair=(prev_rank, commRank(comm))):
+        dtype, shape = recv_meta(prev_rank, comm)
+        hidden_state = torch.empty(shape, dtype=dtype, device="cuda")
+        ncclRecv(hidden_state.storage(), prev_rank, comm)
     return hidden_state
 
 def send_meta(x, next_rank, comm):
@@ -52,7 +57,8 @@ class OpBroadcast(torch.autograd.Function):
             comm = config["comm"]
         ctx.comm = comm
         outputs = torch.empty_like(src, dtype = src.dtype, device = src.device)
-        ncclBroadcast(src.storage(), outputs.storage(), root, comm)
+        with record("broadcast", COMM), comm_call("broadcast", comm):
+            ncclBroadcast(src.storage(), outputs.storage(), root, comm)
         return outputs
 
     @staticmethod
@@ -78,11 +84,12 @@ class OpAllGather(torch.autograd.Function):
             input = input.clone()
         output = torch.empty( (world_size,) + input.size(), dtype=input.dtype, device=input.device)
         ctx.comm = comm
-        ncclAllGather(
-            input.storage(),
-            output.storage(),
-            comm
-        )
+        with record("all_gather", COMM), comm_call("all_gather", comm):
+            ncclAllGather(
+                input.storage(),
+                output.storage(),
+                comm
+            )
         return output
 
     @staticmethod
@@ -119,12 +126,13 @@ class OpReduceScatter(torch.autograd.Function):
             input = input.clone()
         output_shape = (input.shape[0] // commCount(comm), *input.shape[1:])
         output = torch.empty( output_shape, dtype=input.dtype, device=input.device )
-        ncclReduceScatter(
-            input.storage(),
-            output.storage(),
-            op,
-            comm
-        )
+        with record("reduce_scatter", COMM), comm_call("reduce_scatter", comm):
+            ncclReduceScatter(
+                input.storage(),
+                output.storage(),
+                op,
+                comm
+            )
         ctx.op = op
         if op in ["sum", "avg"]:
             pass
@@ -175,12 +183,13 @@ class OpAllReduce(torch.autograd.Function):
             input = input.clone()
         output = torch.empty( input.size(), dtype=input.dtype, device=input.device)
         
-        ncclAllReduce(
-            input.storage(),
-            output.storage(),
-            op,
-            comm
-        )
+        with record("all_reduce", COMM), comm_call("all_reduce", comm):
+            ncclAllReduce(
+                input.storage(),
+                output.storage(),
+                op,
+                comm
+            )
         ctx.op = op
         
         if op in ["sum", "avg"]:
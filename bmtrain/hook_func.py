@@ -1,6 +1,9 @@
 import torch
+import contextlib
 from .global_var import config
 from .zero_context import ZeroContext
+from .profiler import record, start_span, end_span, COMPUTE
+from .memory_tracer import get_tracer, ACTIVATIONS
 
 
 def zero_pre_forward(module, inputs):
@@ -47,10 +50,21 @@ def zero_pre_backward(module, grad_outputs):
                 module, module._layer_dict, pipe=True
             )
             module._backward_block_ctx.enter(backward_flag, True)
+    # ends in zero_post_backward, after the parameters are gathered
+    span = start_span(type(module._module).__name__ + ".backward", COMPUTE)
+    if span is not None:
+        module.__dict__.setdefault("_profile_spans", []).append(span)
 
 
 def zero_post_backward(module, grad_inputs, grad_outputs):
     """Helper function for module weather release after backward."""
+    spans = module.__dict__.get("_profile_spans")
+    if spans:
+        end_span(spans.pop())
+    tracer = get_tracer()
+    if tracer is not None:
+        micro = module._micro_idx if module._mode == "PIPE" else 0
+        tracer.free((id(module), ACTIVATIONS, micro))
     backward_flag = 2 if module._zero_level == 2 else 0
     if module._mode != "PIPE":
         if module._is_first_layer:
@@ -61,6 +75,34 @@ def zero_post_backward(module, grad_inputs, grad_outputs):
         module._micro_idx -= 1
 
 
+class _TrackActivations:
+    __slots__ = ("module", "tracer", "allocated")
+
+    def __init__(self, module, tracer):
+        self.module = module
+        self.tracer = tracer
+
+    def __enter__(self):
+        self.allocated = torch.cuda.memory_allocated()
+
+    def __exit__(self, *args):
+        # what the forward leaves allocated is kept until the backward of the module
+        nbytes = torch.cuda.memory_allocated() - self.allocated
+        micro = self.module._micro_idx if self.module._mode == "PIPE" else 0
+        self.tracer.alloc(
+            (id(self.module), ACTIVATIONS, micro), ACTIVATIONS, max(nbytes, 0), self.tracer.owner(self.module), micro
+        )
+
+
+def track_activations(module, enabled):
+    """Tags the memory retained by the forward of a Block while tracing memory, ``enabled``
+    when the forward is followed by a backward."""
+    tracer = get_tracer()
+    if tracer is None or not enabled:
+        return contextlib.nullcontext()
+    return _TrackActivations(module, tracer)
+
+
 class OneStepNoGradFunc(torch.autograd.Function):
     """
     Requires_grad = False for all inputs.
@@ -72,8 +114,9 @@ class OneStepNoGradFunc(torch.autograd.Function):
         ctx.module = module
         ctx.rng_state = torch.cuda.get_rng_state()
 
-        with torch.no_grad():
-            out = module._module(*x)
+        with torch.no_grad(), record(type(module._module).__name__ + ".forward", COMPUTE):
+            with track_activations(module, placeholder.requires_grad):
+                out = module._module(*x)
         zero_post_forward(module, None, out)
         if not isinstance(out, torch.Tensor):
             return tuple(out)
@@ -86,7 +129,8 @@ class OneStepNoGradFunc(torch.autograd.Function):
             torch.cuda.set_rng_state(ctx.rng_state)
             x = ctx.x
             with torch.enable_grad():
-                out = ctx.module._module(*x)
+                with record(type(ctx.module._module).__name__ + ".recompute", COMPUTE):
+                    out = ctx.module._module(*x)
                 torch.autograd.backward(out, grads)
         zero_post_backward(ctx.module, grads, None)
         grads = []
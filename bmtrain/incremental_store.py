@@ -0,0 +1,190 @@
+import os
+import torch
+
+from .global_var import config
+from .distributed import all_reduce
+from .sharded_store import _local_entries, _build_index, _write_index, _shard_name, _ShardReader
+import bmtrain as bmt
+
+
+def _delta_name(rank):
+    return "model_rank{:05d}.delta.pt".format(rank)
+
+
+_INT_DTYPES = {1: torch.uint8, 2: torch.int16, 4: torch.int32, 8: torch.int64}
+# chunks fingerprinted at a time, bounds the temporary memory to a few chunks
+_FINGERPRINT_BATCH = 16
+
+
+class _Fingerprint:
+    """Two random projections of the raw bits of every chunk, computed where the tensor lives,
+    so that unchanged chunks are never copied to the host."""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        gen = torch.Generator().manual_seed(0x5EED)
+        self._weights = torch.randint(-(2**62), 2**62, (2, chunk_size), dtype=torch.int64, generator=gen)
+        self._device_weights = {}
+
+    def _weights_on(self, device):
+        if device not in self._device_weights:
+            self._device_weights[device] = self._weights.to(device)
+        return self._device_weights[device]
+
+    def __call__(self, flat):
+        chunk_elems = self.chunk_size // flat.element_size()
+        words = flat.view(_INT_DTYPES[flat.element_size()])
+        weights = self._weights_on(flat.device)[:, :chunk_elems]
+        num_chunks = (flat.numel() + chunk_elems - 1) // chunk_elems
+        ret = torch.empty((num_chunks, 2), dtype=torch.int64, device=flat.device)
+        num_full = flat.numel() // chunk_elems
+        for st in range(0, num_full, _FINGERPRINT_BATCH):
+            ed = min(st + _FINGERPRINT_BATCH, num_full)
+            x = words[st * chunk_elems : ed * chunk_elems].view(ed - st, chunk_elems).long()
+            # int64 products wrap around, which is what a hash wants
+            ret[st:ed, 0] = (x * weights[0]).sum(dim=1)
+            ret[st:ed, 1] = (x * weights[1]).sum(dim=1)
+        if num_full < num_chunks:
+            x = words[num_full * chunk_elems :].long()
+            ret[num_full, 0] = (x * weights[0, : x.numel()]).sum()
+            ret[num_full, 1] = (x * weights[1, : x.numel()]).sum()
+        return ret
+
+
+class IncrementalCheckpointer:
+    """Saves sharded checkpoints that only contain what changed since the previous save.
+
+    The partitions of every rank are split into chunks of ``chunk_size`` bytes and
+    fingerprinted on the device. The first save, and every save after ``compact_every``
+    deltas, is a full base in the format of :func:`bmtrain.save_sharded`. The other saves
+    write only the chunks whose fingerprint changed, and the index records the chain of
+    earlier checkpoints they apply on, so frozen parameters are written once per base.
+
+    :func:`bmtrain.load_sharded` follows the chain, the base and the deltas of it must be kept
+    until a later base is saved. ``python -m bmtrain.reshard`` turns a delta into a standalone
+    checkpoint.
+
+    Args:
+        chunk_size (int): Size of the chunks in bytes, a multiple of 8.
+        compact_every (int): Number of deltas saved before the next full base.
+    """
+
+    def __init__(self, chunk_size: int = 1 << 20, compact_every: int = 10):
+        if chunk_size % 8 != 0:
+            raise ValueError("chunk_size must be a multiple of 8")
+        self.chunk_size = chunk_size
+        self.compact_every = compact_every
+        self._fingerprint = _Fingerprint(chunk_size)
+        self._fingerprints = {}
+        self._layout = None
+        self._chain = []
+
+    def reset(self):
+        """Makes the next save a full base."""
+        self._fingerprints = {}
+        self._layout = None
+        self._chain = []
+
+    def save(self, model: torch.nn.Module, path: str) -> bool:
+        """Saves ``model`` to the directory ``path``, as a delta of the previous save if possible.
+
+        Args:
+            model (torch.nn.Module): The model to be saved.
+            path (str): The directory of the checkpoint, created if it does not exist.
+
+        Returns:
+            bool: whether a full base was written.
+        """
+        torch.cuda.synchronize()
+        os.makedirs(path, exist_ok=True)
+        entries = _local_entries(model, config["topology"].pipe_idx == 0)
+        layout = [(it["key"], it["begin"], it["end"], str(it["target"].dtype)) for it in entries]
+        # a changed layout on any rank makes all of them start a new chain
+        full = self._layout != layout or len(self._chain) > self.compact_every
+        full = bool(all_reduce(torch.tensor([float(full)]).cuda(), "max").item() > 0)
+
+        shard = {}
+        fingerprints = {}
+        for it in entries:
+            target = it["target"]
+            fp = self._fingerprint(target.contiguous().view(-1))
+            fingerprints[it["key"]] = fp
+            if full:
+                shard[it["key"]] = target.cpu() if target.is_cuda else target.clone()
+                continue
+            changed = (fp != self._fingerprints[it["key"]]).any(dim=1).nonzero().view(-1)
+            if changed.numel() == 0:
+                continue
+            chunk_elems = self.chunk_size // target.element_size()
+            flat = target.view(-1)
+            data = torch.cat(
+                [flat[i * chunk_elems : (i + 1) * chunk_elems] for i in changed.tolist()]
+            )
+            shard[it["key"]] = (changed.cpu(), data.cpu())
+        torch.save(shard, os.path.join(path, (_shard_name if full else _delta_name)(config["rank"])))
+
+        index = _build_index(entries)
+        if index is not None:
+            if not full:
+                index["chunk_size"] = self.chunk_size
+                index["chain"] = [os.path.relpath(p, path) for p in self._chain]
+            _write_index(index, path)
+        bmt.synchronize()
+
+        self._fingerprints = fingerprints
+        self._layout = layout
+        self._chain = [os.path.abspath(path)] if full else self._chain + [os.path.abspath(path)]
+        return full
+
+
+class _DeltaShard:
+    def __init__(self, reader, rank):
+        self._reader = reader
+        self._rank = rank
+        self._key = None
+        self._value = None
+
+    def __getitem__(self, key):
+        # ranges of one tensor are read one after another, keep the last tensor only
+        if key != self._key:
+            self._value = self._reader._assemble(self._rank, key)
+            self._key = key
+        return self._value
+
+
+class _DeltaReader:
+    """Reads the shards of a delta checkpoint by applying its chain to the base."""
+
+    def __init__(self, path, index):
+        chain = [os.path.normpath(os.path.join(path, p)) for p in index["chain"]]
+        self.chunk_size = index["chunk_size"]
+        self._base = _ShardReader(chain[0], _shard_name)
+        self._deltas = [_ShardReader(p, _delta_name) for p in chain[1:] + [path]]
+        self._shards = {}
+
+    def _assemble(self, rank, key):
+        data = self._base[rank][key].clone()
+        chunk_elems = self.chunk_size // data.element_size()
+        for delta in self._deltas:
+            if key not in delta[rank]:
+                continue
+            changed, chunks = delta[rank][key]
+            pos = 0
+            for i in changed.tolist():
+                st = i * chunk_elems
+                n = min(chunk_elems, data.numel() - st)
+                data[st : st + n] = chunks[pos : pos + n]
+                pos += n
+        return data
+
+    def __getitem__(self, rank):
+        if rank not in self._shards:
+            self._shards[rank] = _DeltaShard(self, rank)
+        return self._shards[rank]
+
+
+def get_incremental_checkpointer() -> IncrementalCheckpointer:
+    """Returns the checkpointer shared by ``bmtrain.save_sharded(incremental=True)``."""
+    if "incremental_checkpointer" not in config:
+        config["incremental_checkpointer"] = IncrementalCheckpointer()
+    return config["incremental_checkpointer"]
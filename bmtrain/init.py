@@ -3,12 +3,14 @@ import torch
 import random
 import torch.distributed as dist
 import os
-from .utils import print_dict
+import time
+from .utils import print_dict, print_block
 import ctypes
 from .global_var import config
 
 from . import nccl
 from .synchronize import synchronize
+from .distributed.object_ops import register_comm, gather_objects
 
 
 def init_distributed(
@@ -42,7 +44,11 @@ def init_distributed(
 
     **Note**: If your training script is stuck here , it means some of your distributed workers are not connected to the master node.
 
+    The seconds spent in every phase of the initialization are kept in ``bmt.config["init_time"]``.
+
     """
+    init_start = time.perf_counter()
+    init_time = {}
     torch.backends.cudnn.enabled = False
 
     local_rank = int(os.environ.get("LOCAL_RANK", "0"))
@@ -61,11 +67,16 @@ def init_distributed(
         init_method, rank, world_size, timeout=timeout
     )
 
+    start = time.perf_counter()
     store, rank, world_size = next(rendezvous_iterator)
+    init_time["rendezvous"] = time.perf_counter() - start
+    start = time.perf_counter()
     store.set_timeout(timeout)
     store = dist.PrefixStore("bmtrain", store)
     torch.cuda.set_device(local_rank)
     config["initialized"] = True
+    # also used by the object collectives after initialization
+    config["store"] = store
     config["pipe_size"] = pipe_size if pipe_size > 0 else 1
     config["pipe_enabled"] = pipe_size > 0
     config["local_rank"] = local_rank
@@ -84,6 +95,9 @@ def init_distributed(
     config["tp_rank"] = config["topology"].get_group_rank("tp")
     config["tp_zero_rank"] = config["topology"].get_group_rank("tp_zero")
     config["save_param_to_cpu"] = True
+    config["seed"] = seed
+    # seconds spent in every phase of the initialization
+    config["init_time"] = init_time
     cpus_this_worker = None
 
     all_available_cpus = sorted(list(os.sched_getaffinity(0)))
@@ -109,81 +123,100 @@ def init_distributed(
     except ModuleNotFoundError:
         pass
 
+    init_time["setup"] = time.perf_counter() - start
+
+    start = time.perf_counter()
     if rank == 0:
         unique_id: bytes = nccl.getUniqueId()
         store.set("BMTRAIN_UNIQUE_ID", unique_id.hex())
 
     unique_id = bytes.fromhex(store.get("BMTRAIN_UNIQUE_ID").decode())
     config["comm"] = nccl.commInitRank(unique_id, world_size, rank)
+    register_comm(config["comm"], "world")
     topo = config["topology"]
+    init_time["comm"] = time.perf_counter() - start
 
+    start = time.perf_counter()
     if config["pipe_enabled"]:
         config["micros"] = (
             num_micro_batches if num_micro_batches else config["pipe_size"]
         )
-        if topo.stage_id == 0:
-            unique_id = nccl.getUniqueId()
-            store.set(f"PIPE_UNIQUE_ID{topo.pipe_idx}", unique_id.hex())
-        unique_id = bytes.fromhex(store.get(f"PIPE_UNIQUE_ID{topo.pipe_idx}").decode())
-        config["pipe_comm"] = nccl.commInitRank(unique_id, pipe_size, topo.stage_id)
-
-        if topo.pp_zero_id == 0:
-            unique_id = nccl.getUniqueId()
-            store.set(f"PP_ZERO_UNIQUE_ID{topo.pp_zero_idx}", unique_id.hex())
-        unique_id = bytes.fromhex(
-            store.get(f"PP_ZERO_UNIQUE_ID{topo.pp_zero_idx}").decode()
-        )
-        config["pp_zero_comm"] = nccl.commInitRank(
-            unique_id, world_size // config["pipe_size"], topo.pp_zero_id
+        config["pipe_comm"] = _sub_comm(store, "pipe", topo.pipe_idx, pipe_size, topo.stage_id)
+        config["pp_zero_comm"] = _sub_comm(
+            store, "pp_zero", topo.pp_zero_idx, world_size // config["pipe_size"], topo.pp_zero_id
         )
 
     if config["tp_size"] > 1:
-        if topo.tp_id == 0:
-            unique_id = nccl.getUniqueId()
-            store.set(f"TP_UNIQUE_ID{topo.tp_idx}", unique_id.hex())
-        unique_id = bytes.fromhex(store.get(f"TP_UNIQUE_ID{topo.tp_idx}").decode())
-        config["tp_comm"] = nccl.commInitRank(unique_id, tp_size, topo.tp_id)
-
-        if topo.tp_zero_id == 0:
-            unique_id = nccl.getUniqueId()
-            store.set(f"TP_ZERO_UNIQUE_ID{topo.tp_zero_idx}", unique_id.hex())
-        unique_id = bytes.fromhex(
-            store.get(f"TP_ZERO_UNIQUE_ID{topo.tp_zero_idx}").decode()
-        )
-        config["tp_zero_comm"] = nccl.commInitRank(
-            unique_id, world_size // config["tp_size"], topo.tp_zero_id
+        config["tp_comm"] = _sub_comm(store, "tp", topo.tp_idx, tp_size, topo.tp_id)
+        config["tp_zero_comm"] = _sub_comm(
+            store, "tp_zero", topo.tp_zero_idx, world_size // config["tp_size"], topo.tp_zero_id
         )
 
     if config["pipe_size"] > 1 and config["tp_size"] > 1:
-        if topo.pp_tp_zero_id == 0:
-            unique_id = nccl.getUniqueId()
-            store.set(f"PP_TP_ZERO_UNIQUE_ID{topo.pp_tp_zero_idx}", unique_id.hex())
-        unique_id = bytes.fromhex(
-            store.get(f"PP_TP_ZERO_UNIQUE_ID{topo.pp_tp_zero_idx}").decode()
-        )
-        config["pp_tp_zero_comm"] = nccl.commInitRank(
-            unique_id,
+        config["pp_tp_zero_comm"] = _sub_comm(
+            store,
+            "pp_tp_zero",
+            topo.pp_tp_zero_idx,
             world_size // (config["pipe_size"] * config["tp_size"]),
             topo.pp_tp_zero_id,
         )
 
     config["zero_comm"] = config["comm"]
+    init_time["sub_comms"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    infos = gather_objects(
+        (rank, local_rank, torch.cuda.current_device(), _format_cpus(cpus_this_worker))
+    )
+    synchronize()
+    init_time["report"] = time.perf_counter() - start
+    init_time["total"] = time.perf_counter() - init_start
+    if rank == 0:
+        print_dict(
+            "Initialization",
+            {
+                "world_size": world_size,
+                "local_size": local_size,
+                "master": master,
+                "sub_comms": "split" if nccl.hasCommSplit() else "init_rank",
+                "time": ", ".join("%s %.2fs" % (k, v) for k, v in init_time.items()),
+            },
+        )
+        print_block(
+            "Ranks",
+            "".join(
+                "rank %d: local_rank %d, device %d, cpus %s\n" % info for info in infos
+            ),
+        )
+
 
-    for i in range(world_size):
-        if i == rank:
-            print_dict(
-                "Initialization",
-                {
-                    "rank": rank,
-                    "local_rank": local_rank,
-                    "world_size": world_size,
-                    "local_size": local_size,
-                    "master": master,
-                    "device": torch.cuda.current_device(),
-                    "cpus": cpus_this_worker,
-                },
-            )
-        synchronize()
+def _sub_comm(store, name, group_idx, group_size, group_rank):
+    """Creates the communicator of the group ``group_idx`` of the kind ``name``.
+
+    With NCCL >= 2.18 it is split from the global communicator, without a round trip to the
+    store and a bootstrap of its own.
+    """
+    if nccl.hasCommSplit():
+        comm = nccl.commSplit(config["comm"], group_idx, group_rank)
+    else:
+        key = "{}_UNIQUE_ID{}".format(name.upper(), group_idx)
+        if group_rank == 0:
+            store.set(key, nccl.getUniqueId().hex())
+        unique_id = bytes.fromhex(store.get(key).decode())
+        comm = nccl.commInitRank(unique_id, group_size, group_rank)
+    register_comm(comm, "{}{}".format(name, group_idx))
+    return comm
+
+
+def _format_cpus(cpus):
+    """Formats a sorted list of cpus as ranges, e.g. ``0-7,16-23``."""
+    ranges = []
+    for cpu in cpus:
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "%d-%d" % (a, b) for a, b in ranges)
 
 
 class topology:
@@ -1,5 +1,6 @@
+import math
 import torch
-from ..store import broadcast_object
+from ..distributed.object_ops import all_gather_objects
 from ..pipe_layer import PipelineTransformerBlockList
 from ..block_layer import Block
 from ..parameter import DistributedParameter
@@ -7,198 +8,189 @@ from .. import nccl
 from ..global_var import config
 import fnmatch
 
-def _gather_value(value : torch.Tensor, partition_size, origin_size):
-    global_size = partition_size * config['world_size']
+# columns of the partial moments of a parameter
+_SUM, _SUMSQ, _MAX, _MIN, _GRAD_SUM, _GRAD_SUMSQ = range(6)
 
-    storage = value.storage_type()(global_size)
 
-    if value.storage().size() != partition_size:
-        tmp_buf = torch.zeros(partition_size, dtype=value.dtype, device=value.device)
-        tmp_buf[:value.numel()] = value[:]
-        nccl.allGather(
-            tmp_buf.storage(),
-            storage,
-            config['comm']
-        )
-    else:
-        nccl.allGather(
-            value.storage(),
-            storage,
-            config['comm']
-        )
+def _segment_partials(value : torch.Tensor, grad, ranges):
+    """Partial moments of the segments ``ranges`` of the flat ``value`` and ``grad``.
 
-    output_tensor = torch.tensor([], dtype=value.dtype, device="cuda")
-    output_tensor.set_(storage, 0, origin_size)
-
-    return output_tensor
-
-def inspect_pipeline_transformer_block_list(pipe_model: PipelineTransformerBlockList, param_name : str, _prefix : str = ''):
-    ret = []
-    for name, model in pipe_model._modules.items():
-        idx = int(name)
-        prefix = _prefix + name + '.'
-
-        # fast check
-        pass_fast_check = False
-        for param in model._param_info:
-            abs_name = prefix + param["name"]
-            if fnmatch.fnmatch(abs_name, param_name):
-                pass_fast_check = True
-                break
-        if not pass_fast_check:
+    Returns:
+        torch.Tensor: float64 tensor of shape (len(ranges), 6).
+    """
+    n = len(ranges)
+    device = value.device
+    ids, lengths, pos = [], [], 0
+    for i, (st, ed) in sorted(enumerate(ranges), key=lambda it: it[1][0]):
+        if ed <= st:
             continue
-
-        if idx in pipe_model.layer_ids:
-            _param_buffer = {}
-            _grad_buffer = {}
-            for kw, val in model._storage_info.items():
-                storage_type = model._storage_params[kw].storage_type()
-
-                _param_buffer[kw] = storage_type(val["partition_size"] * val['world_size'])
-                if model._storage_params[kw].grad is not None:
-                    _grad_buffer[kw] = storage_type(val["partition_size"] * val['world_size'])
-            
-            nccl.groupStart()
-            for kw, val in model._storage_info.items():
-                nccl.allGather(
-                    model._storage_params[kw].storage(),
-                    _param_buffer[kw],
-                    val["zero_comm"]
-                )
-                if model._storage_params[kw].grad is not None:
-                    nccl.allGather(
-                        model._storage_params[kw].grad.storage(),
-                        _grad_buffer[kw],
-                        val["zero_comm"]
-                    )
-
-            nccl.groupEnd()
-            for param in model._param_info:
-                abs_name = prefix + param["name"]
-                if fnmatch.fnmatch(abs_name, param_name):
-                    kw_name = param["kw_name"]
-                    dtype = _param_buffer[kw_name].dtype
-                    device = _param_buffer[kw_name].device
-                    offset = param["offset"]
-                    shape = param["shape"]
-                    p = torch.tensor([], dtype=dtype, device=device).set_(_param_buffer[kw_name], offset, shape)
-                    if kw_name in _grad_buffer:
-                        g = torch.tensor([], dtype=dtype, device=device).set_(_grad_buffer[kw_name], offset, shape)
-                        info = {
-                            "name": abs_name,
-                            "shape": tuple(shape),
-                            "std": p.std().cpu().item(),
-                            "mean": p.mean().cpu().item(),
-                            "grad_std": g.std().cpu().item(),
-                            "grad_mean": g.mean().cpu().item(),
-                            "max": p.max().cpu().item(),
-                            "min": p.min().cpu().item(),
-                        }
-                    else:
-                        info = {
-                            "name": abs_name,
-                            "shape": tuple(shape),
-                            "std": p.std().cpu().item(),
-                            "mean": p.mean().cpu().item(),
-                            "grad_std": 0.,
-                            "grad_mean": 0.,
-                            "max": p.max().cpu().item(),
-                            "min": p.min().cpu().item(),
-                        }
-                    broadcast_object(info, config["pipe_comm"], pipe_model.get_stage_by_layer_id(idx))
-                    ret.append(info)
-        else:
-            for param in model._param_info:
-                abs_name = prefix + param["name"]
-                if fnmatch.fnmatch(abs_name, param_name):
-                    info = broadcast_object({}, config["pipe_comm"], pipe_model.get_stage_by_layer_id(idx))
-                    ret.append(info)
-
-    return ret
-
-
-def inspect_block(model : Block, param_name : str, prefix : str = ''):
-    # fast check
-    pass_fast_check = False
-    for param in model._param_info:
-        abs_name = prefix + param["name"]
-        if fnmatch.fnmatch(abs_name, param_name):
-            pass_fast_check = True
-            break
-    if not pass_fast_check:
-        return []
-
-    _param_buffer = {}
-    _grad_buffer = {}
-    for kw, val in model._storage_info.items():
-        storage_type = model._storage_params[kw].storage_type()
-
-        _param_buffer[kw] = storage_type(val["partition_size"] * config['world_size'])
-        if model._storage_params[kw].grad is not None:
-            _grad_buffer[kw] = storage_type(val["partition_size"] * config['world_size'])
-    
-    nccl.groupStart()
-    for kw, val in model._storage_info.items():
-        nccl.allGather(
-            model._storage_params[kw].storage(),
-            _param_buffer[kw],
-            config["comm"]
+        if st > pos:
+            # elements of parameters that are not inspected, or padding
+            ids.append(n)
+            lengths.append(st - pos)
+        ids.append(i)
+        lengths.append(ed - st)
+        pos = ed
+    value = value[:pos]
+    ret = torch.zeros(n + 1, 6, dtype=torch.float64, device=device)
+    ret[:, _MAX] = -math.inf
+    ret[:, _MIN] = math.inf
+    if pos == 0:
+        return ret[:n]
+    seg = torch.repeat_interleave(
+        torch.tensor(ids, dtype=torch.long, device=device),
+        torch.tensor(lengths, dtype=torch.long, device=device),
+        output_size=pos,
+    )
+    x = value.double()
+    columns = [
+        torch.zeros(n + 1, dtype=torch.float64, device=device).index_add_(0, seg, x),
+        torch.zeros(n + 1, dtype=torch.float64, device=device).index_add_(0, seg, x * x),
+        ret[:, _MAX].scatter_reduce(0, seg, x, "amax"),
+        ret[:, _MIN].scatter_reduce(0, seg, x, "amin"),
+    ]
+    if grad is not None:
+        g = grad[:pos].double()
+        columns.append(torch.zeros(n + 1, dtype=torch.float64, device=device).index_add_(0, seg, g))
+        columns.append(torch.zeros(n + 1, dtype=torch.float64, device=device).index_add_(0, seg, g * g))
+    else:
+        columns.extend([ret[:, _GRAD_SUM], ret[:, _GRAD_SUMSQ]])
+    return torch.stack(columns, dim=1)[:n]
+
+
+class _Collector:
+    """Partial moments of the inspected parameters, reduced over the ranks in one collective
+    per communicator and copied to the host once."""
+
+    def __init__(self):
+        self.infos = []
+        # (comm, partials, indices in infos) of every group of parameters
+        self.groups = []
+
+    def add(self, comm, partials, infos):
+        self.groups.append((comm, partials, list(range(len(self.infos), len(self.infos) + len(infos)))))
+        self.infos.extend(infos)
+
+    def _reduce(self, comm, partials):
+        if comm is None or nccl.commCount(comm) == 1:
+            return partials
+        output = torch.empty((nccl.commCount(comm),) + partials.shape, dtype=partials.dtype, device=partials.device)
+        nccl.allGather(partials.storage(), output.storage(), comm)
+        return torch.cat([
+            output[:, :, [_SUM, _SUMSQ]].sum(dim=0),
+            output[:, :, [_MAX]].amax(dim=0),
+            output[:, :, [_MIN]].amin(dim=0),
+            output[:, :, [_GRAD_SUM, _GRAD_SUMSQ]].sum(dim=0),
+        ], dim=1)
+
+    def finish(self):
+        if len(self.infos) == 0:
+            return []
+        # concatenate the groups of the same communicator, one all-gather each
+        by_comm = {}
+        for comm, partials, indices in self.groups:
+            key = id(comm)
+            if key not in by_comm:
+                by_comm[key] = (comm, [], [])
+            by_comm[key][1].append(partials)
+            by_comm[key][2].extend(indices)
+        order, totals = [], []
+        for comm, partials, indices in by_comm.values():
+            totals.append(self._reduce(comm, torch.cat(partials, dim=0)))
+            order.extend(indices)
+        totals = torch.cat(totals, dim=0)
+        count = torch.tensor(
+            [self.infos[i]["_count"] for i in order], dtype=torch.float64, device=totals.device
         )
-        if model._storage_params[kw].grad is not None:
-            nccl.allGather(
-                model._storage_params[kw].grad.storage(),
-                _grad_buffer[kw],
-                config["comm"]
-            )
-
-    nccl.groupEnd()
-    ret = []
+
+        def std(s, sq):
+            return ((sq - s * s / count).clamp(min=0) / (count - 1).clamp(min=1)).sqrt()
+
+        stats = torch.stack([
+            totals[:, _MAX],
+            totals[:, _MIN],
+            std(totals[:, _SUM], totals[:, _SUMSQ]),
+            totals[:, _SUM] / count,
+            std(totals[:, _GRAD_SUM], totals[:, _GRAD_SUMSQ]),
+            totals[:, _GRAD_SUM] / count,
+        ], dim=1).tolist()
+
+        for i, (mx, mn, p_std, p_mean, g_std, g_mean) in zip(order, stats):
+            info = self.infos[i]
+            del info["_count"]
+            info.update({"std": p_std, "mean": p_mean, "grad_std": g_std, "grad_mean": g_mean, "max": mx, "min": mn})
+        return [
+            {k: info[k] for k in ["name", "shape", "std", "mean", "grad_std", "grad_mean", "max", "min"]}
+            for info in self.infos
+        ]
+
+
+def _collect_block(collector : _Collector, model : Block, param_name : str, prefix : str):
+    # the parameters of every storage, and their range in the partition of this rank
+    matched = {}
     for param in model._param_info:
         abs_name = prefix + param["name"]
-        if fnmatch.fnmatch(abs_name, param_name):
-            kw_name = param["kw_name"]
-            dtype = _param_buffer[kw_name].dtype
-            device = _param_buffer[kw_name].device
-            offset = param["offset"]
-            shape = param["shape"]
-            p = torch.tensor([], dtype=dtype, device=device).set_(_param_buffer[kw_name], offset, shape)
-            if kw_name in _grad_buffer:
-                g = torch.tensor([], dtype=dtype, device=device).set_(_grad_buffer[kw_name], offset, shape)
-                ret.append({
-                    "name": abs_name,
-                    "shape": tuple(shape),
-                    "std": p.std().cpu().item(),
-                    "mean": p.mean().cpu().item(),
-                    "grad_std": g.std().cpu().item(),
-                    "grad_mean": g.mean().cpu().item(),
-                    "max": p.max().cpu().item(),
-                    "min": p.min().cpu().item(),
-                })
+        if not fnmatch.fnmatch(abs_name, param_name):
+            continue
+        kw_name = param["kw_name"]
+        begin = model._storage_info[kw_name]["begin"]
+        end = model._storage_info[kw_name]["end"]
+        st = max(param["offset"], begin)
+        ed = min(param["offset"] + param["size"], end)
+        if kw_name not in matched:
+            matched[kw_name] = ([], [])
+        matched[kw_name][0].append((max(st - begin, 0), max(ed - begin, 0)))
+        matched[kw_name][1].append({"name": abs_name, "shape": tuple(param["shape"]), "_count": param["size"]})
+    for kw_name, (ranges, infos) in matched.items():
+        storage = model._storage_params[kw_name]
+        partials = _segment_partials(storage, storage.grad, ranges)
+        collector.add(model._storage_info[kw_name]["zero_comm"], partials, infos)
+
+
+def _collect(collector : _Collector, model : torch.nn.Module, param_name : str, prefix : str, pipelines : list):
+    if isinstance(model, PipelineTransformerBlockList):
+        # the layers of other stages are exchanged after the local ones are done
+        start = len(collector.infos)
+        for name, layer in model._modules.items():
+            if int(name) in model.layer_ids:
+                _collect_block(collector, layer, param_name, prefix + name + '.')
+        pipelines.append((start, len(collector.infos), prefix))
+    elif isinstance(model, Block):
+        _collect_block(collector, model, param_name, prefix)
+    else:
+        for name, param in model._parameters.items():
+            if param is None or not fnmatch.fnmatch(prefix + name, param_name):
+                continue
+            info = {"name": prefix + name, "_count": param.numel()}
+            if isinstance(param, DistributedParameter):
+                info["shape"] = tuple(param._original_shape)
+                info["_count"] = param._original_shape.numel()
+                comm = param._zero_comm
             else:
-                ret.append({
-                    "name": abs_name,
-                    "shape": tuple(shape),
-                    "std": p.std().cpu().item(),
-                    "mean": p.mean().cpu().item(),
-                    "grad_std": 0.,
-                    "grad_mean": 0.,
-                    "max": p.max().cpu().item(),
-                    "min": p.min().cpu().item(),
-                })
-    return ret
+                info["shape"] = tuple(param.size())
+                comm = None
+            value = param.data.view(-1)
+            grad = param.grad.view(-1) if param.grad is not None else None
+            collector.add(comm, _segment_partials(value, grad, [(0, value.numel())]), [info])
+        for name, module in model._modules.items():
+            _collect(collector, module, param_name, prefix + name + '.', pipelines)
+
 
 @torch.no_grad()
 def inspect_model(model : torch.nn.Module, param_name : str, prefix : str = ''):
     """Inspect the model and return the summary of the parameters.
 
+    Every rank reduces the partitions it holds, so the parameters are never gathered, and
+    the partial moments are combined with one all-gather per communicator.
+
     Args:
         model (torch.nn.Module): The model to be inspected.
         param_name (str): The name of the parameter to be inspected. The wildcard '*' can be used to match multiple parameters.
         prefix (str): The prefix of the parameter name.
-        
+
     Returns:
         list: The summary of the parameters.
-    
+
     Example:
         >>> result_linear = bmt.inspect.inspect_model(model, "*.linear*")
         >>> result_layernorm = bmt.inspect.inspect_model(model, "*.layernorm*")
@@ -208,39 +200,23 @@ def inspect_model(model : torch.nn.Module, param_name : str, prefix : str = ''):
         ...
 
     """
-    if isinstance(model, PipelineTransformerBlockList):
-        return inspect_pipeline_transformer_block_list(model, param_name, prefix)
-    elif isinstance(model, Block):
-        return inspect_block(model, param_name, prefix)
-    else:
-        ret = []
-        for name, param in model._parameters.items():
-            if fnmatch.fnmatch(prefix + name, param_name):
-                if isinstance(param, DistributedParameter):
-                    p = _gather_value(param.data, param.storage().size(), param._original_shape)
-                else:
-                    p = param
-                if p is None:
-                    continue
-                stats = {
-                    'name': prefix + name,
-                    'shape': tuple(p.size()),
-                    "std": p.std().cpu().item(),
-                    "mean": p.mean().cpu().item(),
-                    "max": p.max().cpu().item(),
-                    "min": p.min().cpu().item(),
-                }
-                if param.grad is not None:
-                    if isinstance(param, DistributedParameter):
-                        g = _gather_value(param.grad.data, param.storage().size(), param._original_shape)
-                    else:
-                        g = param.grad
-                    stats["grad_std"] = g.std().cpu().item()
-                    stats["grad_mean"] = g.mean().cpu().item()
-                else:
-                    stats["grad_std"] = 0.
-                    stats["grad_mean"] = 0.
-                ret.append(stats)
-        for name, module in model._modules.items():
-            ret.extend(inspect_model(module, param_name, prefix + name + '.'))
+    collector = _Collector()
+    # (start, end, prefix) of the results of the layers of this stage of every pipeline
+    pipelines = []
+    _collect(collector, model, param_name, prefix, pipelines)
+    ret = collector.finish()
+    if len(pipelines) == 0:
         return ret
+
+    # one exchange for all pipelines, the stages hold different layers
+    stages = all_gather_objects([ret[start:end] for start, end, _ in pipelines], config["pipe_comm"])
+    merged, pos = [], 0
+    for i, (start, end, pipe_prefix) in enumerate(pipelines):
+        merged.extend(ret[pos:start])
+        infos = [it for stage in stages for it in stage[i]]
+        # ordered by the layers, like the model
+        infos.sort(key=lambda it: int(it["name"][len(pipe_prefix):].split(".", 1)[0]))
+        merged.extend(infos)
+        pos = end
+    merged.extend(ret[pos:])
+    return merged
@@ -1,9 +1,9 @@
-from typing import Optional
+from typing import Optional, Tuple
 import torch
 from .. import debug
 from .. import nccl
 from ..global_var import config
-from ..store import broadcast_object
+from ..distributed.object_ops import all_gather_objects
 from ..distributed import broadcast
 import math
 
@@ -53,9 +53,10 @@ class InspectTensor:
                     if ed:
                         break
 
+                # one exchange for the counts of all stages
+                stage_cnt = all_gather_objects(pipe_cnt, config["pipe_comm"])
                 for stage in range(stages):
                     if stage_id == stage:
-                        broadcast_object(pipe_cnt, config["pipe_comm"], src=stage)
                         for k in range(i, j):
                             item = summary[k]
                             kw = f'{item["prefix"]}{item["name"]}'
@@ -101,7 +102,7 @@ class InspectTensor:
                             )
                             kw_cnt[kw] += 1
                     else:
-                        cnt = broadcast_object({}, config["pipe_comm"], src=stage)
+                        cnt = stage_cnt[stage]
                         for kw, val in cnt.items():
                             if kw not in kw_cnt:
                                 kw_cnt[kw] = 0
@@ -127,21 +128,23 @@ class InspectTensor:
                                 kw_cnt[kw] += 1
 
                 after_len = len(self.summary)
+                # the metadata of the tensors of all stages in one exchange
+                local_info = {}
+                for k, it in enumerate(self.summary[before_len:after_len]):
+                    if it["tensor"] is not None:
+                        local_info[k] = {
+                            "group": it["group"],
+                            "shape": it["shape"],
+                            "requires_grad": it["requires_grad"],
+                            "has_grad": it["grad"] is not None,
+                        }
+                infos = {}
+                for stage_info in all_gather_objects(local_info, config["pipe_comm"]):
+                    infos.update(stage_info)
                 with torch.enable_grad():
-                    for it in self.summary[before_len:after_len]:
+                    for k, it in enumerate(self.summary[before_len:after_len]):
                         if it["tensor"] is not None:
                             has_grad = it["grad"] is not None
-                            info = {
-                                "group": it["group"],
-                                "shape": it["shape"],
-                                "requires_grad": it["requires_grad"],
-                                "has_grad": has_grad,
-                            }
-                            broadcast_object(
-                                info,
-                                config["pipe_comm"],
-                                src=it["inside_pipe"]["stage_id"],
-                            )
                             tensor = it["tensor"]
                             tensor = broadcast(
                                 tensor,
@@ -150,11 +153,7 @@ class InspectTensor:
                             )
                             grad = it["grad"]
                         else:
-                            info = broadcast_object(
-                                {},
-                                config["pipe_comm"],
-                                src=it["inside_pipe"]["stage_id"],
-                            )
+                            info = dict(infos[k])
                             has_grad = info.pop("has_grad")
                             it.update(info)
                             tensor = torch.empty(it["shape"]).cuda().requires_grad_()
@@ -300,20 +299,253 @@ class InspectTensor:
         return None
 
 
+def _backward_running():
+    # recomputations of checkpointed Blocks run inside the backward
+    task_id = getattr(torch._C, "_current_graph_task_id", None)
+    return task_id is not None and task_id() != -1
+
+
+class StreamingInspectTensor:
+    """This object is returned by `InspectTensorManager` in the streaming mode.
+
+    The statistics of the tensors are accumulated by `record_tensor` on a side stream and the
+    tensors are dropped right away, the gradients are summarized by hooks in the backward.
+    Recordings of the same tensor in all micro-batches of a pipeline are merged, and the
+    statistics of all ranks are combined by one collective when the context exits.
+
+    """
+
+    _stream = None
+
+    def __init__(self, sampled: bool = True, hist_bins: int = 0, hist_range: Tuple[float, float] = (-10.0, 10.0)):
+        self.sampled = sampled
+        self.hist_bins = hist_bins
+        self.hist_range = hist_range
+        self.summary = []
+        self._entries = {}
+        self._occurrences = {}
+        self._nonpipe = 0
+        self._closed = False
+
+    @classmethod
+    def _side_stream(cls):
+        if cls._stream is None:
+            cls._stream = torch.cuda.Stream()
+        return cls._stream
+
+    def _entry(self, name, group, shape):
+        prefix = "" if group is None else f"{group}."
+        kw = f"{prefix}{name}"
+        pipe = debug.get("_inspect_pipe_micro", None)
+        if pipe is None:
+            occurrence = self._occurrences.get((kw, None), 0)
+            self._occurrences[(kw, None)] = occurrence + 1
+            key = (kw, None, occurrence)
+            # sorted after the pipelines that ran before it
+            pos = (self._nonpipe, 1, 0, 0, 0)
+            self._nonpipe += 1
+        else:
+            forward_id, stage_id, micro_idx = pipe
+            # the micro-batches of a pipeline share the entries of the first one
+            occurrence = self._occurrences.get((kw, pipe), 0)
+            self._occurrences[(kw, pipe)] = occurrence + 1
+            key = (kw, (forward_id, stage_id), occurrence)
+            pos = (self._nonpipe, 0, forward_id, stage_id, len(self._entries))
+        entry = self._entries.get(key)
+        if entry is None:
+            with torch.cuda.stream(self._side_stream()):
+                entry = {
+                    "name": name,
+                    "prefix": prefix,
+                    "kw": kw,
+                    "pos": pos,
+                    "shape": tuple(shape[1:]),
+                    "rows": 0,
+                    "count": 0,
+                    "grad_count": 0,
+                    # sum, sum of squares, gradient sum, gradient sum of squares
+                    "moments": torch.zeros(4, dtype=torch.float64, device="cuda"),
+                    # max, -min
+                    "extrema": torch.full((2,), -math.inf, dtype=torch.float64, device="cuda"),
+                    "hist": torch.zeros(self.hist_bins, dtype=torch.float64, device="cuda")
+                    if self.hist_bins > 0 else None,
+                }
+            self._entries[key] = entry
+        return entry
+
+    def record(self, x: torch.Tensor, name: str, group=None):
+        if self._closed or _backward_running():
+            return
+        entry = self._entry(name, group, x.shape)
+        entry["rows"] += x.shape[0] if x.dim() > 0 else 1
+        entry["count"] += x.numel()
+        if x.numel() == 0:
+            return
+        stream = self._side_stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream), torch.no_grad():
+            value = x.detach()
+            x_min, x_max = torch.aminmax(value)
+            entry["moments"][:2] += torch.stack([
+                value.sum(dtype=torch.float64),
+                torch.linalg.vector_norm(value, dtype=torch.float64).square(),
+            ])
+            torch.maximum(entry["extrema"], torch.stack([x_max, -x_min]).double(), out=entry["extrema"])
+            if entry["hist"] is not None:
+                entry["hist"] += torch.histc(
+                    value.float(), self.hist_bins, self.hist_range[0], self.hist_range[1]
+                ).double()
+        # the memory is not reused before the statistics are computed
+        value.record_stream(stream)
+
+        if x.requires_grad:
+            x.register_hook(lambda grad: self._record_grad(entry, grad))
+
+    def _record_grad(self, entry, grad):
+        if self._closed:
+            return
+        entry["grad_count"] += grad.numel()
+        stream = self._side_stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream), torch.no_grad():
+            entry["moments"][2:] += torch.stack([
+                grad.sum(dtype=torch.float64),
+                torch.linalg.vector_norm(grad, dtype=torch.float64).square(),
+            ])
+        grad.record_stream(stream)
+
+    def _finish(self):
+        self._closed = True
+        entries = list(self._entries.values())
+        self._entries = {}
+        local = []
+        if len(entries) > 0:
+            torch.cuda.current_stream().wait_stream(self._side_stream())
+            values = torch.cat(
+                [torch.cat([e["moments"], e["extrema"]]) for e in entries]
+                + [e["hist"] for e in entries if e["hist"] is not None]
+            ).tolist()
+            hists = values[6 * len(entries):]
+            for i, e in enumerate(entries):
+                local.append({
+                    "key": (e["kw"], e["pos"]),
+                    "name": e["name"],
+                    "prefix": e["prefix"],
+                    "shape": e["shape"],
+                    "rows": e["rows"],
+                    "count": e["count"],
+                    "grad_count": e["grad_count"],
+                    "values": values[6 * i: 6 * i + 6],
+                    "hist": hists[self.hist_bins * i: self.hist_bins * (i + 1)] if self.hist_bins > 0 else None,
+                })
+
+        # one exchange for all ranks, the stages of a pipeline record different tensors
+        merged = {}
+        for rank_items in all_gather_objects(local):
+            for it in rank_items:
+                if it["key"] not in merged:
+                    merged[it["key"]] = it
+                    continue
+                acc = merged[it["key"]]
+                for k in ["rows", "count", "grad_count"]:
+                    acc[k] += it[k]
+                acc["values"] = [a + b for a, b in zip(acc["values"][:4], it["values"][:4])] + [
+                    max(a, b) for a, b in zip(acc["values"][4:], it["values"][4:])
+                ]
+                if acc["hist"] is not None:
+                    acc["hist"] = [a + b for a, b in zip(acc["hist"], it["hist"])]
+
+        def moments(s, sq, n):
+            if n == 0:
+                return None, None
+            return s / n, math.sqrt(max(sq - s * s / n, 0.0) / max(n - 1, 1))
+
+        kw_cnt = {}
+        for key in sorted(merged, key=lambda k: k[1]):
+            it = merged[key]
+            kw = key[0]
+            kw_cnt[kw] = kw_cnt.get(kw, 0) + 1
+            s, sq, g_s, g_sq, x_max, x_neg_min = it["values"]
+            mean, std = moments(s, sq, it["count"])
+            grad_mean, grad_std = moments(g_s, g_sq, it["grad_count"])
+            item = {
+                "name": f'{it["prefix"]}{kw_cnt[kw] - 1}.{it["name"]}',
+                "shape": (it["rows"],) + tuple(it["shape"]),
+                "max": x_max if it["count"] > 0 else None,
+                "min": -x_neg_min if it["count"] > 0 else None,
+                "mean": mean,
+                "std": std,
+                "grad_mean": grad_mean,
+                "grad_std": grad_std,
+            }
+            if self.hist_bins > 0:
+                item["hist"] = it["hist"]
+                item["hist_range"] = tuple(self.hist_range)
+            self.summary.append(item)
+
+    def get_summary(self):
+        r"""Get the summary of the tensors recorded by `record_tensor`.
+
+        Returns:
+            A list of dicts with the keys of `InspectTensor.get_summary`, the statistics of all
+            ranks and micro-batches. With ``hist_bins > 0``, ``hist`` is the histogram of the
+            values in ``hist_range``. The list is empty if the step was not sampled.
+
+        **Note:** This method must be called outside of the `with` block.
+
+        """
+        return self.summary
+
+    def get_tensor(self, name: str, group: Optional[str] = None, index: Optional[int] = None):
+        raise RuntimeError("The tensors are not kept by inspect_tensor(streaming=True)")
+
+
 class InspectTensorManager:
-    def __init__(self) -> None:
+    # the number of streaming contexts entered, for sampling
+    _streaming_steps = 0
+
+    def __init__(
+        self,
+        streaming: bool = False,
+        sample_rate: float = 1.0,
+        hist_bins: int = 0,
+        hist_range: Tuple[float, float] = (-10.0, 10.0),
+    ) -> None:
         self._inspector = None
-
-    def __enter__(self) -> InspectTensor:
+        self.streaming = streaming
+        self.sample_rate = sample_rate
+        self.hist_bins = hist_bins
+        self.hist_range = hist_range
+
+    def _sampled(self):
+        # the same steps on every rank, without communication
+        step = InspectTensorManager._streaming_steps
+        InspectTensorManager._streaming_steps += 1
+        return int((step + 1) * self.sample_rate) > int(step * self.sample_rate)
+
+    def __enter__(self):
         self.prev_val = debug.get("_inspect_tensor", False)
-        if not self.prev_val:
-            debug.set("_inspect_tensor", True)
-            self._inspector = InspectTensor()
-            return self._inspector
-        else:
+        if self.prev_val:
             raise RuntimeError("InspectTensorManager is already in use")
-
-    def __exit__(self, *args):
+        if self.streaming:
+            self._inspector = StreamingInspectTensor(self._sampled(), self.hist_bins, self.hist_range)
+            if self._inspector.sampled:
+                debug.set("_inspect_tensor", True)
+                debug.set("_inspect_streaming", self._inspector)
+            return self._inspector
+        debug.set("_inspect_tensor", True)
+        self._inspector = InspectTensor()
+        return self._inspector
+
+    def __exit__(self, exc_type, *args):
+        if self.streaming:
+            if self._inspector.sampled:
+                debug.set("_inspect_tensor", self.prev_val)
+                debug.clear("_inspect_streaming")
+                if exc_type is None:
+                    self._inspector._finish()
+            self._inspector = None
+            return
         if not self.prev_val:
             debug.set("_inspect_tensor", self.prev_val)
             summary = debug.get("_inspect_hidden_states", [])
@@ -322,9 +554,24 @@ class InspectTensorManager:
             debug.set("_inspect_hidden_states", [])
 
 
-def inspect_tensor() -> InspectTensorManager:
+def inspect_tensor(
+    streaming: bool = False,
+    sample_rate: float = 1.0,
+    hist_bins: int = 0,
+    hist_range: Tuple[float, float] = (-10.0, 10.0),
+) -> InspectTensorManager:
     """**inspect_tensor** returns a context manager that can be used to get the intermediate results of the model computations and their gradients.
 
+    Args:
+        streaming (bool): Summarize the recorded tensors on a side stream as they are recorded
+            and drop them, instead of keeping them until `get_summary`. The statistics are
+            combined over the ranks and micro-batches by one collective when the context exits.
+        sample_rate (float): In the streaming mode, the fraction of the contexts that record,
+            the others do nothing, e.g. 0.01 records every 100th step.
+        hist_bins (int): In the streaming mode, the number of bins of the histograms of the
+            recorded values, 0 for no histograms.
+        hist_range (Tuple[float, float]): The range of the histograms.
+
     Example:
         >>> with bmt.inspect.inspect_tensor() as inspector:
         >>>     loss = model(inputs)
@@ -336,11 +583,18 @@ def inspect_tensor() -> InspectTensorManager:
         ...
 
     **Note:** loss.backward() must be called inside the context manager, otherwise the gradients will not be recorded.
-    **Note:** Calling get_summary() has significant overhead.
+    **Note:** Calling get_summary() has significant overhead, unless `streaming` is set.
+
+    Example:
+        >>> with bmt.inspect.inspect_tensor(streaming=True, sample_rate=0.01) as inspector:
+        >>>     loss = model(inputs)
+        >>>     optim_manager.backward(loss)
+        >>> if inspector.sampled:
+        >>>     bmt.print_rank(bmt.inspect.format_summary(inspector.get_summary()))
 
     """
 
-    return InspectTensorManager()
+    return InspectTensorManager(streaming, sample_rate, hist_bins, hist_range)
 
 
 def record_tensor(x: torch.Tensor, name: str, group=None):
@@ -362,6 +616,11 @@ def record_tensor(x: torch.Tensor, name: str, group=None):
         # do nothing
         return
 
+    streaming = debug.get("_inspect_streaming", None)
+    if streaming is not None:
+        streaming.record(x, name, group)
+        return
+
     if x.requires_grad:
         x.retain_grad()
     debug.append(
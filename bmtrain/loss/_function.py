@@ -1,4 +1,4 @@
-from .. import C
+from ..utils import C
 import torch
 
 CHECK_INPUT = lambda x: x.is_contiguous() and x.is_cuda
@@ -24,6 +24,82 @@ def has_inf_nan(g_half: torch.Tensor, out: torch.Tensor) -> None:
         raise ValueError(f"has_inf_nan not supported for dtype {g_half.dtype}")
 
 
+GRAD_NORM_CHUNK_SIZE = 65536
+_GRAD_NORM_TABLES = {}
+
+
+def _grad_norm_table(tensors):
+    key = tuple((t.data_ptr(), t.numel()) for t in tensors)
+    if key not in _GRAD_NORM_TABLES:
+        if len(_GRAD_NORM_TABLES) >= 64:
+            _GRAD_NORM_TABLES.clear()
+        numels = torch.tensor([t.numel() for t in tensors], dtype=torch.long)
+        num_chunks = (numels + GRAD_NORM_CHUNK_SIZE - 1) // GRAD_NORM_CHUNK_SIZE
+        chunk_tensor = torch.repeat_interleave(
+            torch.arange(len(tensors), dtype=torch.int32), num_chunks
+        )
+        first_chunk = torch.repeat_interleave(
+            torch.cumsum(num_chunks, 0) - num_chunks, num_chunks
+        )
+        chunk_offset = (
+            torch.arange(chunk_tensor.numel(), dtype=torch.long) - first_chunk
+        ) * GRAD_NORM_CHUNK_SIZE
+        device = tensors[0].device
+        _GRAD_NORM_TABLES[key] = (
+            chunk_tensor.to(device),
+            chunk_offset.to(device),
+            torch.tensor([k[0] for k in key], dtype=torch.long).to(device),
+            numels.to(device),
+        )
+    return _GRAD_NORM_TABLES[key]
+
+
+def multi_tensor_grad_norm(tensors, norm_type, out: torch.Tensor) -> None:
+    """Accumulates the norm of all ``tensors`` and their inf/nan flag into ``out`` in one pass.
+
+    ``out[0]`` receives the sum of ``|x| ** norm_type`` (the max of ``|x|`` for the inf norm)
+    and ``out[1]`` is set to 1 if any element is inf or nan. Nothing is read back to host.
+    """
+    assert out.dtype == torch.float32 and out.numel() == 2, "out must be a float tensor of 2 elements"
+    assert CHECK_INPUT(out), "out must be contiguous and on cuda"
+    norm_type = float(norm_type)
+    stream = torch.cuda.current_stream().cuda_stream
+    groups = {}
+    for t in tensors:
+        if t.numel() > 0:
+            groups.setdefault(t.dtype, []).append(t if t.is_contiguous() else t.contiguous())
+    for dtype, group in groups.items():
+        assert all(t.is_cuda for t in group), "tensors must be on cuda"
+        if dtype == torch.float16:
+            launcher = C.multi_tensor_grad_norm_fp16_launcher
+        elif dtype == torch.bfloat16:
+            if not C.is_bf16_supported():
+                raise NotImplementedError(f"bfloat16 is not supported on current GPU")
+            launcher = C.multi_tensor_grad_norm_bf16_launcher
+        elif dtype == torch.float32:
+            launcher = C.multi_tensor_grad_norm_fp32_launcher
+        else:
+            raise ValueError(f"multi_tensor_grad_norm not supported for dtype {dtype}")
+        chunk_tensor, chunk_offset, ptrs, numels = _grad_norm_table(group)
+        partial = torch.empty(chunk_tensor.numel(), dtype=torch.float32, device=out.device)
+        launcher(
+            chunk_tensor.numel(),
+            chunk_tensor.data_ptr(),
+            chunk_offset.data_ptr(),
+            ptrs.data_ptr(),
+            numels.data_ptr(),
+            GRAD_NORM_CHUNK_SIZE,
+            norm_type,
+            partial.data_ptr(),
+            out[1:].data_ptr(),
+            stream,
+        )
+        if norm_type == float("inf"):
+            torch.maximum(out[:1], partial.max().view(1), out=out[:1])
+        else:
+            out[:1] += partial.sum()
+
+
 def cross_entropy_forward(
     m: int,
     n: int,
@@ -0,0 +1,168 @@
+"""Timeline of the GPU memory owned by ZeRO buffers and activations.
+
+Examples:
+    >>> with bmt.trace_memory(model, path="memory") as tracer:
+    ...     loss = model(...)
+    ...     optim_manager.backward(loss)
+    ...     optim_manager.step()
+
+Every rank writes ``memory/memory_rank{rank}.json``, with the composition of the peak and the
+timeline of the traced step, and rank 0 prints its peak composition.
+"""
+import os
+import json
+import contextlib
+import torch
+from typing import Optional
+
+from .global_var import config
+from .utils import print_dict, ActiveInstance
+
+_tracer = ActiveInstance("trace_memory")
+
+PARAM_BUFFER = "param_buffer"
+KEPT_PARAM_BUFFER = "kept_param_buffer"
+GRAD_BUFFER = "grad_buffer"
+ACTIVATIONS = "activations"
+PIPELINE_ACTIVATIONS = "pipeline_activations"
+OTHER = "other"
+
+
+def get_tracer() -> Optional["MemoryTracer"]:
+    """The active :class:`MemoryTracer`, ``None`` when not tracing."""
+    return _tracer.value
+
+
+def _format(nbytes):
+    return "%.2f MiB" % (nbytes / 1024 / 1024)
+
+
+class MemoryTracer:
+    """Keeps the live bytes of every tagged allocation, see :func:`trace_memory`.
+
+    The tagged allocations are the gathered parameters and gradients of Blocks
+    (``param_buffer``, ``grad_buffer``), the gathered parameters ZeRO-2 keeps for the backward
+    (``kept_param_buffer``), the activations a Block retains for its backward (``activations``,
+    measured as the growth of the allocated memory over its forward) and the activations
+    received from the previous pipeline stage (``pipeline_activations``). Everything else,
+    e.g. parameter partitions, optimizer states and temporaries, is ``other``.
+
+    Args:
+        model (torch.nn.Module, optional): Used to name the Blocks by their module path.
+    """
+
+    def __init__(self, model: Optional[torch.nn.Module] = None):
+        self._names = {} if model is None else {id(m): name for name, m in model.named_modules()}
+        self._live = {}
+        self._by_category = {}
+        self.events = []
+        self.peak_allocated = -1
+        self._peak_event = -1
+        self._peak_categories = {}
+        self._peak_owners = {}
+        self.pipe_micro = 0
+
+    def owner(self, module) -> str:
+        """The name of ``module`` in the traced model."""
+        return self._names.get(id(module), type(module).__name__)
+
+    def alloc(self, key, category: str, nbytes: int, owner: str = "", micro: int = 0):
+        """Tags ``nbytes`` live under ``key``, an existing allocation of ``key`` is freed."""
+        if key in self._live:
+            self.free(key)
+        self._live[key] = (category, owner, micro, nbytes)
+        self._by_category[category] = self._by_category.get(category, 0) + nbytes
+        self._event(category, owner, micro, nbytes)
+
+    def free(self, key):
+        """Frees the allocation of ``key``, if any."""
+        it = self._live.pop(key, None)
+        if it is None:
+            return
+        category, owner, micro, nbytes = it
+        self._by_category[category] -= nbytes
+        self._event(category, owner, micro, -nbytes)
+
+    def move(self, key, new_key, category: str):
+        """Retags the allocation of ``key`` as ``category`` under ``new_key``."""
+        it = self._live.get(key, None)
+        if it is None:
+            return
+        self.free(key)
+        self.alloc(new_key, category, it[3], it[1], it[2])
+
+    def _event(self, category, owner, micro, delta):
+        allocated = torch.cuda.memory_allocated()
+        self.events.append((category, owner, micro, delta, allocated))
+        if allocated > self.peak_allocated:
+            self.peak_allocated = allocated
+            self._peak_event = len(self.events) - 1
+            self._peak_categories = dict(self._by_category)
+            owners = {}
+            for _, name, _, nbytes in self._live.values():
+                owners[name] = owners.get(name, 0) + nbytes
+            self._peak_owners = owners
+
+    def peak(self) -> dict:
+        """Bytes of every category at the highest allocated memory seen at a tagged event."""
+        ret = {k: v for k, v in sorted(self._peak_categories.items()) if v > 0}
+        ret[OTHER] = max(self.peak_allocated - sum(ret.values()), 0)
+        return ret
+
+    def export(self, path: str):
+        """Writes ``memory_rank{rank}.json`` to the directory ``path``.
+
+        The file is line oriented and free of timestamps, so two configurations can be diffed.
+        """
+        os.makedirs(path, exist_ok=True)
+        categories = sorted({e[0] for e in self.events})
+        owners = sorted({e[1] for e in self.events})
+        lines = [
+            "{",
+            '"rank": %d,' % config["rank"],
+            '"peak_allocated": %d,' % max(self.peak_allocated, 0),
+            '"max_allocated": %d,' % torch.cuda.max_memory_allocated(),
+            '"peak_event": %d,' % self._peak_event,
+            '"peak": %s,' % json.dumps(self.peak(), sort_keys=True),
+            '"peak_owners": %s,' % json.dumps({k: v for k, v in sorted(self._peak_owners.items()) if v > 0}),
+            '"categories": %s,' % json.dumps(categories),
+            '"owners": %s,' % json.dumps(owners),
+            '"timeline_columns": ["category", "owner", "micro", "delta", "allocated"],',
+            '"timeline": [',
+        ]
+        index_c = {c: i for i, c in enumerate(categories)}
+        index_o = {o: i for i, o in enumerate(owners)}
+        timeline = [
+            json.dumps([index_c[c], index_o[o], micro, delta, allocated])
+            for c, o, micro, delta, allocated in self.events
+        ]
+        lines.append(",\n".join(timeline))
+        lines.append("]")
+        lines.append("}")
+        with open(os.path.join(path, "memory_rank{:05d}.json".format(config["rank"])), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def report(self):
+        """Prints the peak composition of this rank."""
+        content = {k: _format(v) for k, v in self.peak().items()}
+        content["peak"] = _format(max(self.peak_allocated, 0))
+        content["max_allocated"] = _format(torch.cuda.max_memory_allocated())
+        print_dict("Memory peak of rank %d" % config["rank"], content)
+
+
+@contextlib.contextmanager
+def trace_memory(model: Optional[torch.nn.Module] = None, path: Optional[str] = None):
+    """Traces the tagged GPU memory of the steps run in the context, see :class:`MemoryTracer`.
+
+    Args:
+        model (torch.nn.Module, optional): Used to name the Blocks by their module path.
+        path (str, optional): Directory the trace of every rank is exported to when the
+            context exits, rank 0 also prints its peak composition.
+    """
+    tracer = MemoryTracer(model)
+    with _tracer.activate(tracer):
+        yield tracer
+    if path is not None:
+        tracer.export(path)
+        if config["rank"] == 0:
+            tracer.report()
@@ -0,0 +1,283 @@
+"""Throughput, model FLOPs utilization and resource metrics of training steps.
+
+Examples:
+    >>> with bmt.metrics.MetricsExporter(
+    ...     "metrics", model, tokens_per_step=batch_size * seq_len, seq_len=seq_len,
+    ...     attn_dim=num_heads * dim_head // bmt.config["tp_size"], optim_manager=optim_manager,
+    ... ) as metrics:
+    ...     for step in range(1000):
+    ...         loss = model(...)
+    ...         optim_manager.backward(loss)
+    ...         optim_manager.step()
+    ...         metrics.step(loss, lr=lr_scheduler.current_lr)
+
+Every rank appends one JSON record per step to ``metrics/metrics_rank{rank}.jsonl``, or keeps
+the latest values in the Prometheus text file ``metrics/metrics_rank{rank}.prom``.
+"""
+import os
+import json
+import math
+import time
+import queue
+import threading
+import torch
+from typing import Optional, Union
+
+from . import nccl
+from .global_var import config
+from .block_layer import Block
+from .pipe_layer import PipelineTransformerBlockList
+
+# dense 16-bit peak of the tensor cores, by device name
+_PEAK_TFLOPS = [
+    ("H100", 989.0),
+    ("H800", 989.0),
+    ("A100", 312.0),
+    ("A800", 312.0),
+    ("A30", 165.0),
+    ("A10", 125.0),
+    ("V100", 125.0),
+    ("4090", 165.0),
+    ("3090", 71.0),
+]
+
+
+def device_peak_tflops(device=None) -> Optional[float]:
+    """The dense 16-bit peak TFLOPs of ``device``, ``None`` for unknown devices."""
+    name = torch.cuda.get_device_name(device)
+    for key, value in _PEAK_TFLOPS:
+        if key in name:
+            return value
+    return None
+
+
+def _blocks(model):
+    if isinstance(model, Block):
+        yield model
+    elif isinstance(model, PipelineTransformerBlockList):
+        # only the layers of this stage run here
+        for name, layer in model._modules.items():
+            if int(name) in model.layer_ids:
+                yield from _blocks(layer)
+    else:
+        for module in model._modules.values():
+            if module is not None:
+                yield from _blocks(module)
+
+
+def model_flops(
+    model: torch.nn.Module, tokens: int, seq_len: Optional[int] = None, attn_dim: Optional[int] = None
+) -> int:
+    """The FLOPs of the forward and backward of the Blocks of ``model`` on this rank.
+
+    Every 2-D parameter of a Block is taken as the weight of a linear layer, which costs
+    ``2 * tokens * numel`` in the forward. With ``seq_len`` and ``attn_dim``, every Block also
+    counts as an attention layer, which costs ``4 * tokens * seq_len * attn_dim`` for the
+    scores and the weighted sum. The backward costs twice the forward, recomputations of
+    checkpointed Blocks are not counted, as for the model FLOPs utilization.
+
+    Args:
+        model (torch.nn.Module): The model.
+        tokens (int): The tokens a step of this rank processes.
+        seq_len (int, optional): The length of the attended sequences.
+        attn_dim (int, optional): The width of the attention of this rank, the number of heads
+            times the head dimension, divided by the tensor parallel size.
+    """
+    forward = 0
+    for block in _blocks(model):
+        forward += 2 * tokens * sum(math.prod(p["shape"]) for p in block._param_info if len(p["shape"]) == 2)
+        if seq_len is not None and attn_dim is not None:
+            forward += 4 * tokens * seq_len * attn_dim
+    return 3 * forward
+
+
+class _Step:
+    __slots__ = ("step", "steps", "start", "end", "loss", "loss_scale", "scale_decreases", "comm", "memory", "extra")
+
+
+class MetricsExporter:
+    """Records the metrics of training steps and exports them from a background thread.
+
+    A step records a CUDA event and copies the loss to pinned memory without waiting, the
+    background thread waits for the event, derives the time of the step from the events and
+    writes the record, so the training loop is never synchronized with the device.
+
+    A record has the time of the step in seconds, the tokens per second of this rank and of
+    all data parallel replicas, the TFLOPs and model FLOPs utilization of this rank (see
+    :func:`model_flops`), the loss, the loss scale and how many times it was lowered after an
+    overflow, the bytes communicated by NCCL in the step, the allocated and peak allocated
+    memory, and the keyword arguments of :meth:`step`.
+
+    Args:
+        path (str): The directory of the exported files.
+        model (torch.nn.Module, optional): The model, the FLOPs of a step are derived from it.
+        tokens_per_step (int, optional): The tokens a step of this rank processes.
+        seq_len (int, optional): The length of the attended sequences, see :func:`model_flops`.
+        attn_dim (int, optional): The attention width of this rank, see :func:`model_flops`.
+        flops_per_step (int, optional): The FLOPs of a step, instead of deriving them from ``model``.
+        peak_tflops (float, optional): The peak TFLOPs of a device, default to :func:`device_peak_tflops`.
+        optim_manager (OptimManager, optional): The loss scale is read from it.
+        format (str): ``"jsonl"`` to append a line per record, ``"prometheus"`` to rewrite a
+            text file with the values of the latest record.
+        every (int): Export every ``every``-th step, with the time averaged over the steps since the last record.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model: Optional[torch.nn.Module] = None,
+        tokens_per_step: Optional[int] = None,
+        seq_len: Optional[int] = None,
+        attn_dim: Optional[int] = None,
+        flops_per_step: Optional[int] = None,
+        peak_tflops: Optional[float] = None,
+        optim_manager=None,
+        format: str = "jsonl",
+        every: int = 1,
+    ):
+        if format not in ("jsonl", "prometheus"):
+            raise ValueError("Unknown metrics format: {}".format(format))
+        if flops_per_step is None and model is not None and tokens_per_step is not None:
+            flops_per_step = model_flops(model, tokens_per_step, seq_len, attn_dim)
+        self.flops_per_step = flops_per_step
+        self.tokens_per_step = tokens_per_step
+        self.peak_tflops = peak_tflops if peak_tflops is not None else device_peak_tflops()
+        self.optim_manager = optim_manager
+        self.format = format
+        self.every = every
+        self.dp_size = config["world_size"] // (config.get("tp_size", 1) * config.get("pipe_size", 1))
+
+        os.makedirs(path, exist_ok=True)
+        ext = "jsonl" if format == "jsonl" else "prom"
+        self.file = os.path.join(path, "metrics_rank{:05d}.{}".format(config["rank"], ext))
+
+        self.step_idx = 0
+        self._last = torch.cuda.Event(enable_timing=True)
+        self._last.record()
+        self._last_scale = self._loss_scale()
+        self._last_comm = sum(nccl.bytesCommunicated().values())
+        self._scale_events = 0
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _loss_scale(self):
+        if self.optim_manager is None or not self.optim_manager.loss_scale_enabled:
+            return None
+        return float(self.optim_manager.loss_scale)
+
+    def step(self, loss: Union[torch.Tensor, float, None] = None, **extra):
+        """Marks the end of a training step, it does not wait for the device.
+
+        Args:
+            loss (torch.Tensor or float, optional): The loss of the step.
+            **extra: Other values of the step, e.g. the learning rate, exported as they are.
+        """
+        if self._error is not None:
+            raise RuntimeError("The metrics writer failed") from self._error
+        self.step_idx += 1
+
+        scale = self._loss_scale()
+        if scale is not None and self._last_scale is not None and scale < self._last_scale:
+            self._scale_events += 1
+
+        if self.step_idx % self.every != 0:
+            self._last_scale = scale
+            return
+
+        it = _Step()
+        it.step = self.step_idx
+        it.steps = self.every
+        if isinstance(loss, torch.Tensor):
+            it.loss = torch.empty(1, dtype=torch.float32, pin_memory=True)
+            it.loss.copy_(loss.detach().reshape(1).float(), non_blocking=True)
+        else:
+            it.loss = loss
+        it.start = self._last
+        it.end = torch.cuda.Event(enable_timing=True)
+        it.end.record()
+        self._last = it.end
+
+        comm = sum(nccl.bytesCommunicated().values())
+        it.comm = comm - self._last_comm
+        self._last_comm = comm
+        it.loss_scale = scale
+        it.scale_decreases = self._scale_events
+        self._scale_events = 0
+        self._last_scale = scale
+        it.memory = (torch.cuda.memory_allocated(), torch.cuda.max_memory_allocated())
+        it.extra = extra
+        self._queue.put(it)
+
+    def _record(self, it: _Step) -> dict:
+        it.end.synchronize()
+        step_time = it.start.elapsed_time(it.end) / 1e3 / it.steps
+        record = {
+            "step": it.step,
+            "timestamp": time.time(),
+            "step_time": step_time,
+        }
+        if self.tokens_per_step is not None and step_time > 0:
+            record["tokens_per_sec"] = self.tokens_per_step / step_time
+            record["global_tokens_per_sec"] = record["tokens_per_sec"] * self.dp_size
+        if self.flops_per_step is not None and step_time > 0:
+            record["tflops"] = self.flops_per_step / step_time / 1e12
+            if self.peak_tflops is not None:
+                record["mfu"] = record["tflops"] / self.peak_tflops
+        if it.loss is not None:
+            record["loss"] = it.loss.item() if isinstance(it.loss, torch.Tensor) else float(it.loss)
+        if it.loss_scale is not None:
+            record["loss_scale"] = it.loss_scale
+            record["loss_scale_decreases"] = it.scale_decreases
+        record["comm_bytes"] = it.comm / it.steps
+        record["memory_allocated"], record["max_memory_allocated"] = it.memory
+        record.update(it.extra)
+        return record
+
+    def _write(self, record: dict):
+        if self.format == "jsonl":
+            with open(self.file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            return
+        lines = []
+        for key, value in record.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = "bmtrain_" + key
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append('{}{{rank="{}"}} {}'.format(name, config["rank"], value))
+        # replaced at once, so a scraper never reads a partial file
+        tmp = self.file + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.file)
+
+    def _writer(self):
+        torch.cuda.set_device(config["local_rank"])
+        while True:
+            it = self._queue.get()
+            if it is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._write(self._record(it))
+            except Exception as e:
+                self._error = e
+
+    def close(self):
+        """Waits for the records of all steps to be written."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise RuntimeError("The metrics writer failed") from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,269 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import torch
+from typing import Dict, Mapping, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MAGIC = b"BMTMMAP1"
+# the tensor data starts at the first page boundary, and every tensor at a cache line
+DATA_ALIGNMENT = 4096
+TENSOR_ALIGNMENT = 64
+
+
+def _align(x, d):
+    return (x + d - 1) // d * d
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).split(".")[-1]
+
+
+# size of the compressed chunks before compression
+COMPRESSION_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _get_codec(name):
+    """Returns the ``(compress, decompress)`` functions of a codec, all of them release the GIL."""
+    if name == "zlib":
+        return (lambda x: zlib.compress(x, 1)), zlib.decompress
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package")
+        return (
+            lambda x: zstandard.ZstdCompressor(level=1).compress(x),
+            lambda x: zstandard.ZstdDecompressor().decompress(x),
+        )
+    if name == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError("lz4 compression requires the lz4 package")
+        return lz4.frame.compress, lz4.frame.decompress
+    raise ValueError("unknown compression {}".format(name))
+
+
+_io_pool = None
+
+
+def _get_io_pool():
+    """A thread pool with one worker per CPU of this rank, ``init_distributed`` gives every rank
+    of a node its own slice of the CPUs."""
+    global _io_pool
+    if _io_pool is None:
+        if hasattr(os, "sched_getaffinity"):
+            num_cpus = len(os.sched_getaffinity(0))
+        else:
+            num_cpus = os.cpu_count() or 1
+        _io_pool = ThreadPoolExecutor(max_workers=max(num_cpus, 1))
+    return _io_pool
+
+
+def _compress_chunk(compress, chunk, element_size):
+    # byte shuffle: the i-th bytes of all elements are grouped together, the exponent
+    # bytes of floats are similar to each other and compress well
+    if element_size > 1:
+        chunk = chunk.view(-1, element_size).t().contiguous().view(-1)
+    data = compress(chunk.numpy())
+    return data, zlib.crc32(data)
+
+
+def _decompress_chunk(decompress, data, crc, out, element_size, key):
+    if crc is not None and zlib.crc32(data) != crc:
+        raise RuntimeError("checksum mismatch in a compressed chunk of {}".format(key))
+    chunk = torch.frombuffer(bytearray(decompress(data)), dtype=torch.uint8)
+    if element_size > 1:
+        chunk = chunk.view(element_size, -1).t()
+        out.view(-1, element_size).copy_(chunk)
+    else:
+        out.copy_(chunk)
+
+
+def is_mmap_file(file_name: str) -> bool:
+    """Whether ``file_name`` was written by :func:`save_mmap_state_dict`."""
+    if not os.path.isfile(file_name):
+        return False
+    with open(file_name, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class MmapStateDictWriter:
+    """Writes tensors one by one in the layout read by :class:`MmapStateDict`.
+
+    The raw bytes of every tensor are written as soon as it is added, and the header of
+    offsets is written behind them when the writer is closed, so the tensors do not need
+    to be held in memory together.
+
+    With ``compression``, every tensor is split into chunks that are byte shuffled,
+    compressed and checksummed by a thread pool sized to the CPUs of this rank. Compressed
+    tensors are decompressed as a whole when they are read.
+
+    Args:
+        file_name (str): The file name of the checkpoint.
+        compression (str, optional): ``"zlib"``, ``"zstd"`` or ``"lz4"``. The latter two need the ``zstandard`` or ``lz4`` package.
+    """
+
+    def __init__(self, file_name: str, compression: Optional[str] = None):
+        self._codec = _get_codec(compression) if compression is not None else None
+        self._compression = compression
+        self._file = open(file_name, "wb")
+        self._file.write(MAGIC)
+        # offset and length of the header, filled in by close()
+        self._file.write(struct.pack("<QQ", 0, 0))
+        self._tensors = OrderedDict()
+        self._offset = 0
+
+    def write(self, key: str, value: torch.Tensor):
+        value = value.detach()
+        nbytes = value.numel() * value.element_size()
+        self._tensors[key] = {
+            "dtype": _dtype_name(value.dtype),
+            "shape": list(value.shape),
+            "offset": self._offset,
+            "nbytes": nbytes,
+        }
+        if nbytes > 0 and self._codec is not None:
+            nbytes = self._write_compressed(self._tensors[key], value)
+        elif nbytes > 0:
+            self._file.seek(DATA_ALIGNMENT + self._offset)
+            value = value.cpu().contiguous()
+            self._file.write(value.view(-1).view(torch.uint8).numpy())
+        self._offset = _align(self._offset + nbytes, TENSOR_ALIGNMENT)
+
+    def _write_compressed(self, info, value):
+        element_size = value.element_size()
+        data = value.cpu().contiguous().view(-1).view(torch.uint8)
+        chunk_size = COMPRESSION_CHUNK_SIZE // element_size * element_size
+        chunks = _get_io_pool().map(
+            lambda st: _compress_chunk(self._codec[0], data[st : st + chunk_size], element_size),
+            range(0, data.numel(), chunk_size),
+        )
+        self._file.seek(DATA_ALIGNMENT + self._offset)
+        info["compression"] = self._compression
+        info["chunk_size"] = chunk_size
+        info["chunks"] = []
+        stored = 0
+        for chunk, crc in chunks:
+            self._file.write(chunk)
+            info["chunks"].append([len(chunk), crc])
+            stored += len(chunk)
+        return stored
+
+    def close(self, metadata=None):
+        header = json.dumps(
+            {
+                "tensors": self._tensors,
+                "metadata": dict(metadata) if metadata is not None else None,
+            }
+        ).encode("utf-8")
+        header_offset = DATA_ALIGNMENT + self._offset
+        self._file.seek(header_offset)
+        self._file.write(header)
+        self._file.truncate(header_offset + len(header))
+        self._file.seek(len(MAGIC))
+        self._file.write(struct.pack("<QQ", header_offset, len(header)))
+        self._file.close()
+
+
+def save_mmap_state_dict(
+    state_dict: Dict[str, torch.Tensor], file_name: str, compression: Optional[str] = None
+):
+    """Writes ``state_dict`` as the raw bytes of the tensors followed by a header of offsets.
+
+    The file can be memory mapped by :class:`MmapStateDict`, so that every rank reads only
+    the slices it needs. See :class:`MmapStateDictWriter` for ``compression``.
+    """
+    writer = MmapStateDictWriter(file_name, compression)
+    for key, value in state_dict.items():
+        writer.write(key, value)
+    writer.close(getattr(state_dict, "_metadata", None))
+
+
+class MmapStateDict(Mapping):
+    """A read-only state dict over a file written by :func:`save_mmap_state_dict`.
+
+    The tensors are views of a private mapping of the file, nothing is read from disk until
+    the tensors are touched, and ranks on the same node share the cached pages.
+
+    Args:
+        file_name (str): The file name of the checkpoint.
+        read_ahead (bool): Hint the kernel to read ahead of the accessed pages. Disable it if every rank only needs a small slice of each tensor.
+        verify (bool): Check the checksums of compressed chunks.
+    """
+
+    def __init__(self, file_name: str, read_ahead: bool = True, verify: bool = True):
+        with open(file_name, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a memory mapped checkpoint".format(file_name))
+            header_offset, header_len = struct.unpack("<QQ", f.read(16))
+            f.seek(header_offset)
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            # ACCESS_COPY gives writable tensors without touching the file
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if hasattr(self._mmap, "madvise"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL if read_ahead else mmap.MADV_RANDOM)
+        self._data_start = DATA_ALIGNMENT
+        self._verify = verify
+        # the last decompressed tensor, slices of one tensor are often read one after another
+        self._last_compressed = (None, None)
+        self._tensors = header["tensors"]
+        if header["metadata"] is not None:
+            self._metadata = OrderedDict(header["metadata"])
+
+    def __getitem__(self, key: str) -> torch.Tensor:
+        info = self._tensors[key]
+        dtype = getattr(torch, info["dtype"])
+        if info["nbytes"] == 0:
+            return torch.empty(info["shape"], dtype=dtype)
+        if "compression" in info:
+            if self._last_compressed[0] != key:
+                self._last_compressed = (key, self._read_compressed(key, info, dtype))
+            return self._last_compressed[1].view(dtype).view(info["shape"])
+        data = torch.frombuffer(
+            self._mmap,
+            dtype=torch.uint8,
+            count=info["nbytes"],
+            offset=self._data_start + info["offset"],
+        )
+        return data.view(dtype).view(info["shape"])
+
+    def _read_compressed(self, key, info, dtype):
+        decompress = _get_codec(info["compression"])[1]
+        element_size = torch.empty(0, dtype=dtype).element_size()
+        out = torch.empty(info["nbytes"], dtype=torch.uint8)
+        view = memoryview(self._mmap)
+        jobs = []
+        pos = self._data_start + info["offset"]
+        for i, (length, crc) in enumerate(info["chunks"]):
+            st = i * info["chunk_size"]
+            jobs.append(
+                (view[pos : pos + length], crc if self._verify else None, out[st : st + info["chunk_size"]])
+            )
+            pos += length
+        # consume the results to raise the errors of the workers
+        list(
+            _get_io_pool().map(
+                lambda job: _decompress_chunk(decompress, *job, element_size, key), jobs
+            )
+        )
+        return out
+
+    def copy(self):
+        return self
+
+    def __len__(self):
+        return len(self._tensors)
+
+    def __contains__(self, key):
+        return key in self._tensors
+
+    def keys(self):
+        return self._tensors.keys()
+
+    def __iter__(self):
+        return iter(self._tensors)
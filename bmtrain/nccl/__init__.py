@@ -1,7 +1,7 @@
 
 from typing_extensions import Literal
 import torch
-from .. import C
+from ..utils import C
 from .enums import *
 
 class NCCLCommunicator:
@@ -24,6 +24,28 @@ class NCCLCommunicator:
     def _destroy_ptr(self):
         self.__ptr = -1
 
+# bytes handed to every kind of operation by this process, see `bytesCommunicated`
+_bytes = {
+    "all_reduce": 0,
+    "all_gather": 0,
+    "reduce_scatter": 0,
+    "broadcast": 0,
+    "reduce": 0,
+    "send": 0,
+    "recv": 0,
+}
+
+def _count(kind : str, buffer : torch.storage._StorageBase):
+    _bytes[kind] += buffer.size() * buffer.element_size()
+
+def bytesCommunicated():
+    """
+    Returns the bytes of the buffers of the NCCL operations launched by this process, by kind of operation.
+
+    The size of the output buffer is counted for allGather, the size of the input buffer for the others.
+    """
+    return dict(_bytes)
+
 # utils
 
 def dtype2nccl(dtype : torch.dtype) -> int:
@@ -78,6 +100,22 @@ def commInitRank(unique_id : bytes, world_size : int, rank : int) -> NCCLCommuni
     assert rank >= 0 and rank < world_size, "rank must be between 0 and world_size-1"
     return NCCLCommunicator(C.ncclCommInitRank(unique_id, world_size, rank))
 
+def hasCommSplit() -> bool:
+    """
+    Whether the NCCL library BMTrain is built with supports ``ncclCommSplit`` (NCCL >= 2.18).
+
+    """
+    return C.ncclHasCommSplit()
+
+def commSplit(comm : NCCLCommunicator, color : int, key : int) -> NCCLCommunicator:
+    """
+    NCCL API: `ncclCommSplit <https://docs.nvidia.com/deeplearning/nccl/user-guide/docs/api/comms.html#ncclcommsplit>`_
+
+    A collective operation on ``comm``, the ranks with the same ``color`` get a new communicator, ranked by ``key``.
+
+    """
+    return NCCLCommunicator(C.ncclCommSplit(comm.ptr, color, key))
+
 def commDestroy(comm : NCCLCommunicator):
     """
     NCCL API: `ncclCommDestroy <https://docs.nvidia.com/deeplearning/nccl/user-guide/docs/api/comms.html#ncclcommdestroy>`_
@@ -129,6 +167,7 @@ def allReduce(
     operator = op2nccl(op)
 
     assert src.size() == dst.size(), "Buffer size not aligned"
+    _count("all_reduce", src)
     C.ncclAllReduce(
         sendbuff,
         recvbuff,
@@ -153,6 +192,7 @@ def send(src : torch.storage._StorageBase,
     sendbuff = src.data_ptr()
     count = src.size()
     datatype = dtype2nccl(src.dtype)
+    _count("send", src)
     C.ncclSend(
         sendbuff,
         count,
@@ -168,6 +208,7 @@ def recv(dst : torch.storage._StorageBase,
     recvbuff = dst.data_ptr()
     count = dst.size()
     datatype = dtype2nccl(dst.dtype)
+    _count("recv", dst)
     C.ncclRecv(
         recvbuff,
         count,
@@ -206,6 +247,7 @@ def broadcast(
     datatype = dtype2nccl(src.dtype)
 
     assert dst.size() == src.size(), "Buffer size not aligned"
+    _count("broadcast", src)
     C.ncclBroadcast(
         sendbuff, 
         recvbuff, 
@@ -247,6 +289,7 @@ def reduce(
     operator = op2nccl(op)
 
     assert dst.size() == src.size(), "Buffer size not aligned"
+    _count("reduce", src)
     C.ncclReduce(sendbuff, recvbuff, count, datatype, operator, root, comm.ptr, torch.cuda.current_stream().cuda_stream)
 
 def allGather(
@@ -274,6 +317,7 @@ def allGather(
     sendcount = src.size()
     datatype = dtype2nccl(src.dtype)
     assert dst.size() % sendcount == 0, "Buffer size not aligned"
+    _count("all_gather", dst)
     C.ncclAllGather(
         sendbuff, 
         recvbuff, 
@@ -313,6 +357,7 @@ def reduceScatter(
     operator = op2nccl(op)
 
     assert src.size() % recvcount == 0, "Buffer size not aligned"
+    _count("reduce_scatter", src)
     C.ncclReduceScatter(
         sendbuff,
         recvbuff,
@@ -41,7 +41,7 @@ class ColumnParallelLinear(bmt.DistributedModule):
         self.out_features_per_partition = out_features // tp_size
         self.weight = bmt.DistributedParameter(
             torch.empty(
-                self.out_features_per_partition, in_features, dtype=dtype, device="cuda"
+                self.out_features_per_partition, in_features, dtype=dtype, device="meta"
             ),
             init_method=torch.nn.init.xavier_normal_,
             tp_split_dim=0,
@@ -50,7 +50,7 @@ class ColumnParallelLinear(bmt.DistributedModule):
         if bias:
             self.bias = bmt.DistributedParameter(
                 torch.empty(
-                    self.out_features_per_partition, dtype=dtype, device="cuda"
+                    self.out_features_per_partition, dtype=dtype, device="meta"
                 ),
                 init_method=torch.nn.init.zeros_,
                 tp_split_dim=0,
@@ -36,12 +36,12 @@ class Linear(bmt.DistributedModule):
         self.in_features = in_features
         self.out_features = out_features
         self.weight = bmt.DistributedParameter(
-            torch.empty(out_features, in_features, dtype=dtype, device="cuda"),
+            torch.empty(out_features, in_features, dtype=dtype, device="meta"),
             init_method=torch.nn.init.xavier_normal_,
         )
         if bias:
             self.bias = bmt.DistributedParameter(
-                torch.empty(out_features, dtype=dtype, device="cuda"),
+                torch.empty(out_features, dtype=dtype, device="meta"),
                 init_method=torch.nn.init.zeros_,
             )
         else:
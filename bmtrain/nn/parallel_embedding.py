@@ -37,7 +37,7 @@ class VPEmbedding(bmt.DistributedModule):
         self.start_index = bmt.config["tp_rank"] * self.vocab_size_per_partition
         self.end_index = (bmt.config["tp_rank"] + 1) * self.vocab_size_per_partition
         self.weight = bmt.DistributedParameter(
-            torch.empty(self.vocab_size_per_partition, embedding_size, dtype=dtype),
+            torch.empty(self.vocab_size_per_partition, embedding_size, dtype=dtype, device="meta"),
             init_method=bmt.ParameterInitializer(
                 torch.nn.init.normal_, mean=init_mean, std=init_std
             ),
@@ -3,6 +3,7 @@ import torch.nn.functional as F
 from bmtrain.global_var import config
 from ..distributed import all_gather, all_reduce
 from .. import nccl
+from ..straggler import comm_call
 import bmtrain as bmt
 from enum import Enum
 
@@ -90,9 +91,10 @@ def async_reduce_scatter_linear_func(input, weight, bias, async_chunks=2):
             shape = list(out.shape)
             shape[0] = shape[0] // config["tp_size"]
             outputs[i] = torch.empty(shape, dtype=out.dtype, device=out.device)
-            nccl.reduceScatter(
-                out.storage(), outputs[i].storage(), "sum", config["tp_comm"]
-            )
+            with comm_call("tp_linear.reduce_scatter", config["tp_comm"]):
+                nccl.reduceScatter(
+                    out.storage(), outputs[i].storage(), "sum", config["tp_comm"]
+                )
 
     current_stream.wait_stream(comm_stream)
     out = torch.cat(outputs, dim=0)
@@ -254,7 +256,8 @@ class OpParallelLinear(torch.autograd.Function):
             return out
 
         if reduce_output_type == ReduceType.ALL_REDUCE:
-            nccl.allReduce(out.storage(), out.storage(), "sum", config["tp_comm"])
+            with comm_call("tp_linear.all_reduce", config["tp_comm"]):
+                nccl.allReduce(out.storage(), out.storage(), "sum", config["tp_comm"])
             return out
         else:
             assert False, "no support reduce type{}".format(reduce_output_type)
@@ -308,22 +311,24 @@ class OpParallelLinear(torch.autograd.Function):
                     config["tp_comm_stream"].wait_stream(current_stream)
                     grad_input.record_stream(config["tp_comm_stream"])
                     grad_all_input.record_stream(config["tp_comm_stream"])
-                    nccl.reduceScatter(
-                        grad_all_input.storage(),
-                        grad_input.storage(),
-                        "sum",
-                        config["tp_comm"],
-                    )
+                    with comm_call("tp_linear.reduce_scatter", config["tp_comm"]):
+                        nccl.reduceScatter(
+                            grad_all_input.storage(),
+                            grad_input.storage(),
+                            "sum",
+                            config["tp_comm"],
+                        )
             elif ctx.reduce_output_type is None:
                 with torch.cuda.stream(config["tp_comm_stream"]):
                     config["tp_comm_stream"].wait_stream(current_stream)
                     grad_input.record_stream(config["tp_comm_stream"])
-                    nccl.allReduce(
-                        grad_all_input.storage(),
-                        grad_all_input.storage(),
-                        "sum",
-                        config["tp_comm"],
-                    )
+                    with comm_call("tp_linear.all_reduce", config["tp_comm"]):
+                        nccl.allReduce(
+                            grad_all_input.storage(),
+                            grad_all_input.storage(),
+                            "sum",
+                            config["tp_comm"],
+                        )
                     grad_input = grad_all_input
             else:
                 grad_input = grad_all_input
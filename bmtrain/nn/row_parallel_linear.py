@@ -44,7 +44,7 @@ class RowParallelLinear(bmt.DistributedModule):
                 self.out_features,
                 self.in_features_per_partition,
                 dtype=dtype,
-                device="cuda",
+                device="meta",
             ),
             init_method=torch.nn.init.xavier_normal_,
             tp_split_dim=1,
@@ -52,7 +52,7 @@ class RowParallelLinear(bmt.DistributedModule):
         )
         if bias:
             self.bias = bmt.DistributedParameter(
-                torch.empty(self.out_features, dtype=dtype, device="cuda"),
+                torch.empty(self.out_features, dtype=dtype, device="meta"),
                 init_method=torch.nn.init.zeros_,
                 tp_split_dim=-1,
                 tp_mode=True,
@@ -1,3 +1,4 @@
 from .adam import AdamOptimizer
 from .adam_offload import AdamOffloadOptimizer
+from .adafactor import AdafactorOptimizer
 from .optim_manager import OptimManager
\ No newline at end of file
@@ -1,8 +1,8 @@
 import torch
-from ..distributed import all_reduce, all_gather
+from ..distributed import all_gather
 
 
-def state_dict_gather(state_dict):
+def state_dict_gather(state_dict, names=("exp_avg", "exp_avg_sq", "_param_fp32")):
     param_key = [
         p for param_group in state_dict["param_groups"] for p in param_group["params"]
     ]
@@ -13,28 +13,44 @@ def state_dict_gather(state_dict):
     for k in param_key:
         if k not in state_dict["state"]:
             state_dict["state"][k] = {
-                "exp_avg": torch.tensor([], device="cuda", dtype=torch.float32),
-                "exp_avg_sq": torch.tensor([], device="cuda", dtype=torch.float32),
-                "_param_fp32": torch.tensor([], device="cuda", dtype=torch.float32),
-                "step": step,
+                name: torch.tensor([], device="cuda", dtype=torch.float32)
+                for name in names
             }
+            state_dict["state"][k]["step"] = step
         v = state_dict["state"][k]
-        for name, dtype in [
-            ("exp_avg", torch.float32),
-            ("exp_avg_sq", torch.float32),
-            ("_param_fp32", torch.float32),
-        ]:
+        for name in names:
             if name in v:
                 with torch.no_grad():
                     numel = torch.tensor(
-                        v[name].numel(), device="cuda", dtype=torch.long
-                    )
-                    max_numel = all_reduce(numel, op="max")
-                    v_p = torch.nn.functional.pad(
-                        v[name], (0, max_numel - numel), value=-1e15
+                        [v[name].numel()], device="cuda", dtype=torch.long
                     )
+                    # exchange the sizes first, no sentinel value is needed to drop the padding
+                    numels = all_gather(numel).view(-1).tolist()
+                    max_numel = max(numels)
                     if max_numel > 0:
-                        whole_state = all_gather(v_p.cuda()).flatten()
-                        whole_state = whole_state[whole_state != -1e15]
+                        v_p = torch.nn.functional.pad(
+                            v[name].view(-1).float().cuda(), (0, max_numel - numel.item())
+                        )
+                        gathered = all_gather(v_p)
+                        whole_state = torch.cat(
+                            [gathered[i, :n] for i, n in enumerate(numels)]
+                        )
+                    else:
+                        whole_state = torch.tensor([], dtype=torch.float32)
                     v[name] = whole_state.contiguous().cpu()
     return state_dict
+
+
+def partition_range(p):
+    """Returns the ``(begin, end)`` range that the local partition ``p`` covers in the whole
+    parameter (or the whole Block storage), ``None`` if the partition is empty.
+
+    Normal tensors are not partitioned and cover themselves on every rank.
+    """
+    if hasattr(p, "_param_info"):
+        return p._partition_begin, p._partition_begin + p.numel()
+    if hasattr(p, "_start_partition"):
+        if p._start_partition is None:
+            return None
+        return p._start_partition, p._start_partition + p.numel()
+    return 0, p.numel()
@@ -1,4 +1,5 @@
-from .. import C
+from typing import Optional
+from ..utils import C
 import torch
 
 CHECK_INPUT = lambda x: x.is_contiguous() and x.is_cuda
@@ -100,6 +101,67 @@ def adam_cpu(
     )
 
 
+def _skip_ptr(skip: Optional[torch.Tensor]) -> int:
+    if skip is None:
+        return 0
+    assert CHECK_INPUT(skip), "skip must be contiguous and on cuda"
+    assert skip.dtype == torch.float32 and skip.numel() == 1, "skip must be a float32 scalar"
+    return skip.data_ptr()
+
+
+def adam_fp32(
+    param_fp32: torch.Tensor,
+    g_fp32: torch.Tensor,
+    m_fp32: torch.Tensor,
+    v_fp32: torch.Tensor,
+    beta1: float,
+    beta2: float,
+    eps: float,
+    lr: float,
+    scale: float,
+    weight_decay: float,
+    step: int,
+    skip: Optional[torch.Tensor] = None,
+) -> None:
+    assert CHECK_INPUT(param_fp32), "param_fp32 must be contiguous and on cuda"
+    assert CHECK_INPUT(g_fp32), "g_fp32 must be contiguous and on cuda"
+    assert CHECK_INPUT(m_fp32), "m_fp32 must be contiguous and on cuda"
+    assert CHECK_INPUT(v_fp32), "v_fp32 must be contiguous and on cuda"
+    assert param_fp32.dtype == torch.float32, "param_fp32 must be float32 tensor"
+    assert g_fp32.dtype == torch.float32, "g_fp32 must be float32 tensor"
+    assert m_fp32.dtype == torch.float32, "m_fp32 must be float32 tensor"
+    assert v_fp32.dtype == torch.float32, "v_fp32 must be float32 tensor"
+    assert (
+        param_fp32.numel() == g_fp32.numel()
+    ), "param_fp32 and g_fp32 must have the same number of elements"
+    assert (
+        param_fp32.numel() == m_fp32.numel()
+    ), "param_fp32 and m_fp32 must have the same number of elements"
+    assert (
+        param_fp32.numel() == v_fp32.numel()
+    ), "param_fp32 and v_fp32 must have the same number of elements"
+    bias_correction1 = 1 - beta1**step
+    bias_correction2 = 1 - beta2**step
+    stream = torch.cuda.current_stream().cuda_stream
+    C.adam_fp32_launcher(
+        param_fp32.numel(),
+        param_fp32.data_ptr(),
+        g_fp32.data_ptr(),
+        m_fp32.data_ptr(),
+        v_fp32.data_ptr(),
+        beta1,
+        beta2,
+        eps,
+        lr,
+        scale,
+        weight_decay,
+        bias_correction1,
+        bias_correction2,
+        _skip_ptr(skip),
+        stream,
+    )
+
+
 def adam_fp16(
     param_fp32: torch.Tensor,
     param_fp16: torch.Tensor,
@@ -113,6 +175,7 @@ def adam_fp16(
     scale: float,
     weight_decay: float,
     step: int,
+    skip: Optional[torch.Tensor] = None,
 ) -> None:
     assert CHECK_INPUT(param_fp32), "param_fp32 must be contiguous and on cuda"
     assert CHECK_INPUT(param_fp16), "param_fp16 must be contiguous and on cuda"
@@ -154,6 +217,7 @@ def adam_fp16(
         weight_decay,
         bias_correction1,
         bias_correction2,
+        _skip_ptr(skip),
         stream,
     )
 
@@ -171,6 +235,7 @@ def adam_bf16(
     scale: float,
     weight_decay: float,
     step: int,
+    skip: Optional[torch.Tensor] = None,
 ) -> None:
     assert CHECK_INPUT(param_fp32), "param_fp32 must be contiguous and on cuda"
     assert CHECK_INPUT(param_bf16), "param_bf16 must be contiguous and on cuda"
@@ -214,5 +279,259 @@ def adam_bf16(
         weight_decay,
         bias_correction1,
         bias_correction2,
+        _skip_ptr(skip),
         stream,
     )
+
+
+# elements of one quantization block, must be the same as the C kernels
+QUANT_BLOCK_SIZE = 1024
+
+_QMAP_CACHE = {}
+
+
+def create_dynamic_map(signed: bool = True) -> torch.Tensor:
+    """Create the 256 value dynamic quantization map used by 8-bit optimizer states.
+
+    Values are spread over 7 decades with more resolution close to zero, so that the
+    map covers both small and large moments after they are normalized by the block absmax.
+    """
+    data = []
+    for i in range(7):
+        items = 2**i if signed else 2 ** (i + 1)
+        boundaries = torch.linspace(0.1, 1, items + 1)
+        means = ((boundaries[:-1] + boundaries[1:]) / 2.0) * (10 ** (i - 6))
+        data += means.tolist()
+        if signed:
+            data += (-means).tolist()
+    data.append(0.0)
+    data.append(1.0)
+    assert len(data) == 256
+    data.sort()
+    return torch.tensor(data, dtype=torch.float32)
+
+
+def get_qmap(signed: bool, device) -> torch.Tensor:
+    device = torch.device(device)
+    key = (signed, device)
+    if key not in _QMAP_CACHE:
+        qmap = create_dynamic_map(signed).to(device)
+        _QMAP_CACHE[key] = qmap
+    return _QMAP_CACHE[key]
+
+
+def quantize_blockwise(x: torch.Tensor, signed: bool):
+    """Quantize a float tensor to 8-bit codes with one absmax scale per block.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: uint8 codes with the shape of ``x`` and fp32 absmax of each block.
+    """
+    qmap = get_qmap(signed, x.device)
+    flat = x.detach().float().reshape(-1)
+    n = flat.numel()
+    num_blocks = (n + QUANT_BLOCK_SIZE - 1) // QUANT_BLOCK_SIZE
+    padded = torch.zeros(
+        num_blocks * QUANT_BLOCK_SIZE, dtype=torch.float32, device=x.device
+    )
+    padded[:n] = flat
+    padded = padded.view(num_blocks, QUANT_BLOCK_SIZE)
+    absmax = padded.abs().max(dim=1)[0] if num_blocks > 0 else padded.new_zeros(0)
+    normed = padded / absmax.clamp(min=torch.finfo(torch.float32).tiny)[:, None]
+    midpoints = (qmap[1:] + qmap[:-1]) / 2
+    codes = torch.bucketize(normed, midpoints, right=True).to(torch.uint8)
+    return codes.view(-1)[:n].view(x.size()).contiguous(), absmax.contiguous()
+
+
+def dequantize_blockwise(
+    codes: torch.Tensor, absmax: torch.Tensor, signed: bool
+) -> torch.Tensor:
+    """Inverse of :func:`quantize_blockwise`, returns a fp32 tensor with the shape of ``codes``."""
+    qmap = get_qmap(signed, codes.device)
+    n = codes.numel()
+    values = qmap[codes.reshape(-1).long()]
+    scales = absmax.to(codes.device).repeat_interleave(QUANT_BLOCK_SIZE)[:n]
+    return (values * scales).view(codes.size())
+
+
+def init_quantized_state(state: dict, size: torch.Size, device) -> None:
+    """Initialize zero 8-bit ``exp_avg`` and ``exp_avg_sq`` with their block absmax in ``state``."""
+    num_blocks = (size.numel() + QUANT_BLOCK_SIZE - 1) // QUANT_BLOCK_SIZE
+    for name in ["exp_avg", "exp_avg_sq"]:
+        state[name] = torch.zeros(size, dtype=torch.uint8, device=device)
+        state[name + "_absmax"] = torch.zeros(
+            num_blocks, dtype=torch.float32, device=device
+        )
+
+
+def convert_quantized_state(state: dict, quantized: bool, device) -> None:
+    """Convert the loaded moments in ``state`` to the 8-bit or full precision format in place.
+
+    Moments are also moved to ``device``, others keys are left untouched.
+    """
+    for name, signed in [("exp_avg", True), ("exp_avg_sq", False)]:
+        if name not in state:
+            continue
+        value = state[name].to(device)
+        if value.dtype == torch.uint8:
+            absmax = state.pop(name + "_absmax").to(device)
+            if quantized:
+                state[name + "_absmax"] = absmax
+            else:
+                value = dequantize_blockwise(value, absmax, signed)
+        elif quantized:
+            value, state[name + "_absmax"] = quantize_blockwise(value, signed)
+        state[name] = value
+
+
+def adam_8bit(
+    param_fp32: torch.Tensor,
+    param_h: torch.Tensor,
+    g_h: torch.Tensor,
+    m_uint8: torch.Tensor,
+    v_uint8: torch.Tensor,
+    m_absmax: torch.Tensor,
+    v_absmax: torch.Tensor,
+    beta1: float,
+    beta2: float,
+    eps: float,
+    lr: float,
+    scale: float,
+    weight_decay: float,
+    step: int,
+    skip: Optional[torch.Tensor] = None,
+) -> None:
+    assert CHECK_INPUT(param_fp32), "param_fp32 must be contiguous and on cuda"
+    assert CHECK_INPUT(param_h), "param_h must be contiguous and on cuda"
+    assert CHECK_INPUT(g_h), "g_h must be contiguous and on cuda"
+    assert CHECK_INPUT(m_uint8), "m_uint8 must be contiguous and on cuda"
+    assert CHECK_INPUT(v_uint8), "v_uint8 must be contiguous and on cuda"
+    assert CHECK_INPUT(m_absmax), "m_absmax must be contiguous and on cuda"
+    assert CHECK_INPUT(v_absmax), "v_absmax must be contiguous and on cuda"
+    assert param_fp32.dtype == torch.float32, "param_fp32 must be float32 tensor"
+    assert (
+        param_h.dtype == torch.float16 or param_h.dtype == torch.bfloat16
+    ), "param_h must be float16/bfloat16 tensor"
+    assert g_h.dtype == param_h.dtype, "g_h must have the same dtype as param_h"
+    assert m_uint8.dtype == torch.uint8, "m_uint8 must be uint8 tensor"
+    assert v_uint8.dtype == torch.uint8, "v_uint8 must be uint8 tensor"
+    assert m_absmax.dtype == torch.float32, "m_absmax must be float32 tensor"
+    assert v_absmax.dtype == torch.float32, "v_absmax must be float32 tensor"
+    assert (
+        param_fp32.numel() == param_h.numel()
+    ), "param_fp32 and param_h must have the same number of elements"
+    assert (
+        param_fp32.numel() == g_h.numel()
+    ), "param_fp32 and g_h must have the same number of elements"
+    assert (
+        param_fp32.numel() == m_uint8.numel()
+    ), "param_fp32 and m_uint8 must have the same number of elements"
+    assert (
+        param_fp32.numel() == v_uint8.numel()
+    ), "param_fp32 and v_uint8 must have the same number of elements"
+    num_blocks = (param_fp32.numel() + QUANT_BLOCK_SIZE - 1) // QUANT_BLOCK_SIZE
+    assert m_absmax.numel() == num_blocks, "m_absmax must have one value per block"
+    assert v_absmax.numel() == num_blocks, "v_absmax must have one value per block"
+    bias_correction1 = 1 - beta1**step
+    bias_correction2 = 1 - beta2**step
+    stream = torch.cuda.current_stream().cuda_stream
+    if param_h.dtype == torch.float16:
+        launcher = C.adam_8bit_fp16_launcher
+    else:
+        if not C.is_bf16_supported():
+            raise NotImplementedError(f"bfloat16 is not supported on current GPU")
+        launcher = C.adam_8bit_bf16_launcher
+    launcher(
+        param_fp32.numel(),
+        param_fp32.data_ptr(),
+        param_h.data_ptr(),
+        g_h.data_ptr(),
+        m_uint8.data_ptr(),
+        v_uint8.data_ptr(),
+        m_absmax.data_ptr(),
+        v_absmax.data_ptr(),
+        get_qmap(True, param_fp32.device).data_ptr(),
+        get_qmap(False, param_fp32.device).data_ptr(),
+        beta1,
+        beta2,
+        eps,
+        lr,
+        scale,
+        weight_decay,
+        bias_correction1,
+        bias_correction2,
+        _skip_ptr(skip),
+        stream,
+    )
+
+
+def adam_cpu_8bit(
+    param_fp32: torch.Tensor,
+    param_h: torch.Tensor,
+    g_h: torch.Tensor,
+    m_uint8: torch.Tensor,
+    v_uint8: torch.Tensor,
+    m_absmax: torch.Tensor,
+    v_absmax: torch.Tensor,
+    beta1: float,
+    beta2: float,
+    eps: float,
+    lr: float,
+    scale: float,
+    weight_decay: float,
+    step: int,
+) -> None:
+    for name, t in [
+        ("param_fp32", param_fp32),
+        ("param_h", param_h),
+        ("g_h", g_h),
+        ("m_uint8", m_uint8),
+        ("v_uint8", v_uint8),
+        ("m_absmax", m_absmax),
+        ("v_absmax", v_absmax),
+    ]:
+        assert t.is_contiguous(), f"{name} must be contiguous"
+        assert t.device == torch.device("cpu"), f"{name} must be a cpu tensor"
+    assert param_fp32.dtype == torch.float32, "param_fp32 must be float32 tensor"
+    assert (
+        param_h.dtype == torch.float16 or param_h.dtype == torch.bfloat16
+    ), "param_h must be float16/bfloat16 tensor"
+    assert g_h.dtype == param_h.dtype, "g_h must have the same dtype as param_h"
+    assert m_uint8.dtype == torch.uint8, "m_uint8 must be uint8 tensor"
+    assert v_uint8.dtype == torch.uint8, "v_uint8 must be uint8 tensor"
+    assert m_absmax.dtype == torch.float32, "m_absmax must be float32 tensor"
+    assert v_absmax.dtype == torch.float32, "v_absmax must be float32 tensor"
+    assert (
+        param_fp32.numel() == param_h.numel() == g_h.numel()
+    ), "param_fp32, param_h and g_h must have the same number of elements"
+    assert (
+        param_fp32.numel() == m_uint8.numel() == v_uint8.numel()
+    ), "param_fp32, m_uint8 and v_uint8 must have the same number of elements"
+    num_blocks = (param_fp32.numel() + QUANT_BLOCK_SIZE - 1) // QUANT_BLOCK_SIZE
+    assert m_absmax.numel() == num_blocks, "m_absmax must have one value per block"
+    assert v_absmax.numel() == num_blocks, "v_absmax must have one value per block"
+    bias_correction1 = 1 - beta1**step
+    bias_correction2 = 1 - beta2**step
+    if param_h.dtype == torch.float16:
+        launcher = C.adam_cpu_8bit_fp16_launcher
+    else:
+        launcher = C.adam_cpu_8bit_bf16_launcher
+    launcher(
+        param_fp32.numel(),
+        param_fp32.data_ptr(),
+        param_h.data_ptr(),
+        g_h.data_ptr(),
+        m_uint8.data_ptr(),
+        v_uint8.data_ptr(),
+        m_absmax.data_ptr(),
+        v_absmax.data_ptr(),
+        get_qmap(True, "cpu").data_ptr(),
+        get_qmap(False, "cpu").data_ptr(),
+        beta1,
+        beta2,
+        eps,
+        lr,
+        scale,
+        weight_decay,
+        bias_correction1,
+        bias_correction2,
+    )
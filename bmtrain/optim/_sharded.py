@@ -0,0 +1,226 @@
+import os
+import json
+import torch
+from ..global_var import config
+from ..distributed.object_ops import gather_objects
+from ..sharded_store import _ShardReader
+from ..synchronize import synchronize
+from . import _function as F
+from ._distributed import partition_range
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _shard_name(rank):
+    return "optim_rank{:05d}.pt".format(rank)
+
+
+def _indexed_params(optimizer):
+    """Params of ``optimizer`` in the order used as keys by ``state_dict``."""
+    ret = []
+    seen = set()
+    for group in optimizer.param_groups:
+        for p in group["params"]:
+            if id(p) not in seen:
+                seen.add(id(p))
+                ret.append(p)
+    return ret
+
+
+def _is_tp(p):
+    if hasattr(p, "_param_info"):
+        return any(it["parameter"]._tp_mode for it in p._param_info)
+    return getattr(p, "_tp_mode", False)
+
+
+def _local_layout(optimizers):
+    """``[begin, end, tp_id]`` of every parameter of every optimizer on this rank.
+
+    ``tp_id`` is -1 for parameters that are not split by tensor parallel, partitions
+    are only matched between ranks that hold the same piece of the model.
+    """
+    tp_id = config["topology"].tp_id
+    ret = []
+    for optimizer in optimizers:
+        layout = []
+        for p in _indexed_params(optimizer):
+            rng = partition_range(p)
+            if rng is None:
+                layout.append(None)
+            else:
+                layout.append([rng[0], rng[1], tp_id if _is_tp(p) else -1])
+        ret.append(layout)
+    return ret
+
+
+def _dense_states(optimizer):
+    """Per-element second moments of optimizers that keep them factored."""
+    if not hasattr(optimizer, "_dense_exp_avg_sq"):
+        return None
+    ret = {}
+    for i, p in enumerate(_indexed_params(optimizer)):
+        if p in optimizer.state and len(optimizer.state[p]) > 0:
+            ret[i] = optimizer._dense_exp_avg_sq(p, optimizer.state[p]).cpu()
+    return ret
+
+
+def save_sharded_state(manager, path: str):
+    """Saves the states of ``manager`` to ``path`` with one file per rank.
+
+    Every rank writes its own partitions in parallel, and rank 0 writes a small manifest
+    with the partition boundaries of all ranks, which lets :func:`load_sharded_state`
+    reshard the states when the ZeRO world size changes.
+    """
+    manager._sync_scale_stats()
+    os.makedirs(path, exist_ok=True)
+    shard = {
+        "optimizers": [opt.state_dict() for opt in manager.optimizers],
+        "dense_exp_avg_sq": [_dense_states(opt) for opt in manager.optimizers],
+        "lr_schedulers": [
+            lrs.state_dict() if lrs else None for lrs in manager.lr_schedulers
+        ],
+        "loss_scale": manager.loss_scale,
+        "loss_scale_enabled": manager.loss_scale_enabled,
+    }
+    torch.save(shard, os.path.join(path, _shard_name(config["rank"])))
+
+    layouts = gather_objects(
+        {
+            "stage": config["topology"].stage_id,
+            "optimizers": _local_layout(manager.optimizers),
+        }
+    )
+    if config["rank"] == 0:
+        manifest = {
+            "world_size": config["world_size"],
+            "tp_size": config["tp_size"],
+            "pipe_size": config["pipe_size"],
+            "ranks": layouts,
+        }
+        with open(os.path.join(path, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f)
+    synchronize()
+
+
+def _elementwise(shard, opt_idx, param_idx):
+    """Returns the state of a parameter of an old rank with one value per element."""
+    state = shard["optimizers"][opt_idx]["state"].get(param_idx, None)
+    if state is None:
+        return None
+    state = dict(state)
+    if "exp_avg_absmax" in state:
+        F.convert_quantized_state(state, False, "cpu")
+    dense = shard["dense_exp_avg_sq"][opt_idx]
+    if dense is not None:
+        state.pop("exp_avg_sq_row", None)
+        state.pop("exp_avg_sq_col", None)
+        state["exp_avg_sq"] = dense[param_idx]
+    return state
+
+
+def _reshard_param(reader, sources, opt_idx, param_idx, begin, end, size):
+    pieces = []
+    cursor = begin
+    for rank, (src_begin, src_end) in sorted(sources, key=lambda x: x[1][0]):
+        # replicated parameters appear on many ranks, only take what is not covered yet
+        lo, hi = max(cursor, src_begin), min(end, src_end)
+        if lo < hi:
+            pieces.append((rank, lo - src_begin, hi - src_begin, src_end - src_begin))
+            cursor = hi
+    if cursor != end:
+        raise ValueError(
+            "sharded checkpoint does not cover elements [{}, {}) of parameter {}".format(
+                cursor, end, param_idx
+            )
+        )
+
+    ret = {}
+    for rank, st, ed, numel in pieces:
+        state = _elementwise(reader[rank], opt_idx, param_idx)
+        if state is None:
+            return None
+        for k, v in state.items():
+            if isinstance(v, torch.Tensor) and v.dim() > 0 and v.numel() == numel:
+                ret.setdefault(k, []).append(v.view(-1)[st:ed])
+            elif k not in ret:
+                ret[k] = v
+    for k, v in ret.items():
+        if isinstance(v, list):
+            ret[k] = torch.cat(v).view(size)
+    return ret
+
+
+def load_sharded_state(manager, path: str):
+    """Loads the states saved by :func:`save_sharded_state` into ``manager``.
+
+    If the partitions of all ranks are unchanged, every rank reads only its own file.
+    Otherwise every rank reads the pieces of the old shards that overlap its partitions.
+    """
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if (
+        manifest["tp_size"] != config["tp_size"]
+        or manifest["pipe_size"] != config["pipe_size"]
+    ):
+        raise ValueError(
+            "sharded checkpoint was saved with tp_size={} and pipe_size={}, only the ZeRO world size can be changed".format(
+                manifest["tp_size"], manifest["pipe_size"]
+            )
+        )
+    stage = config["topology"].stage_id
+    old_ranks = [
+        (rank, it)
+        for rank, it in enumerate(manifest["ranks"])
+        if it["stage"] == stage
+    ]
+    if len(old_ranks[0][1]["optimizers"]) != len(manager.optimizers):
+        raise ValueError(
+            "sharded checkpoint has {} optimizers, but {} are added".format(
+                len(old_ranks[0][1]["optimizers"]), len(manager.optimizers)
+            )
+        )
+
+    reader = _ShardReader(path, _shard_name)
+    layout = _local_layout(manager.optimizers)
+    rank = config["rank"]
+    same_layout = (
+        manifest["world_size"] == config["world_size"]
+        and manifest["ranks"][rank]["optimizers"] == layout
+    )
+    # param_groups, lr schedulers and the loss scale are the same on every rank of a stage
+    base = reader[rank if same_layout else old_ranks[0][0]]
+
+    for i, optimizer in enumerate(manager.optimizers):
+        if same_layout:
+            optimizer.load_state_dict(base["optimizers"][i])
+            continue
+        state = {}
+        for j, (p, rng) in enumerate(zip(_indexed_params(optimizer), layout[i])):
+            if rng is None:
+                continue
+            begin, end, tp_id = rng
+            sources = []
+            for old_rank, it in old_ranks:
+                old = it["optimizers"][i][j]
+                if old is not None and old[2] == tp_id and old[0] < end and begin < old[1]:
+                    sources.append((old_rank, (old[0], old[1])))
+            v = _reshard_param(reader, sources, i, j, begin, end, p.size())
+            if v is not None:
+                state[j] = v
+        optimizer.load_state_dict(
+            {
+                "state": state,
+                "param_groups": base["optimizers"][i]["param_groups"],
+                "is_whole": False,
+            }
+        )
+
+    for lrs, lrs_st in zip(manager.lr_schedulers, base["lr_schedulers"]):
+        if lrs is not None:
+            lrs.load_state_dict(lrs_st)
+    manager.loss_scale = base["loss_scale"]
+    manager.loss_scale_enabled = base["loss_scale_enabled"]
+    if manager.device_loss_scale:
+        manager._scale_event = None
+        manager._scale_device.fill_(manager.loss_scale)
+        manager._growth_device.zero_()
@@ -0,0 +1,447 @@
+import torch
+import math
+from copy import deepcopy
+from itertools import chain
+from collections import defaultdict
+from ._distributed import state_dict_gather, partition_range
+
+
+def _partition_segments(p):
+    """Yields ``(shape, param_begin, param_end, local_begin)`` for every original parameter
+    overlapping the local partition ``p``.
+
+    ``p`` may be the flat storage of a Block (see ``Block._param_info``), a partitioned
+    ``DistributedParameter`` or a normal tensor.
+    """
+    if p.numel() == 0:
+        return
+    if hasattr(p, "_param_info"):
+        begin = p._partition_begin
+        end = begin + p.numel()
+        for it in p._param_info:
+            st = max(it["offset"], begin)
+            ed = min(it["offset"] + it["size"], end)
+            if st < ed:
+                yield it["shape"], st - it["offset"], ed - it["offset"], st - begin
+    elif getattr(p, "_start_partition", None) is not None:
+        yield p._original_shape, p._start_partition, p._start_partition + p.numel(), 0
+    else:
+        yield p.shape, 0, p.numel(), 0
+
+
+class AdafactorOptimizer(torch.optim.Optimizer):
+    """
+    Adafactor optimizer support fp16 and bf16.
+
+    The second moment of every matrix-shaped parameter is kept as a row and a column factor.
+    Parameters are recovered from ZeRO partitions, so the factors only cover the rows held
+    by the local rank, and update clipping uses the RMS of the local slice.
+
+    Args:
+        beta1 (float): coefficient of the first moment. ``None`` disables the first moment. Default None.
+        eps (float): regularization constant added to the squared gradient. Default 1e-30.
+        clip_threshold (float): threshold of the root mean square of the final update. Default 1.0.
+        decay_rate (float): coefficient used to compute the running average of the squared gradient. Default -0.8.
+        min_dim_size_to_factor (int): parameters with a smaller row or column count keep a full second moment. Default 128.
+    """
+
+    _bmtrain_optimizer = True
+
+    def __init__(
+        self,
+        params,
+        lr=1e-3,
+        beta1=None,
+        eps=1e-30,
+        clip_threshold=1.0,
+        decay_rate=-0.8,
+        weight_decay=0,
+        hold_steps=0,
+        min_dim_size_to_factor=128,
+    ):
+        if not 0.0 <= lr:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if beta1 is not None and not 0.0 <= beta1 < 1.0:
+            raise ValueError("Invalid beta1 value: {}".format(beta1))
+        if not 0.0 <= eps:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 < clip_threshold:
+            raise ValueError("Invalid clip_threshold value: {}".format(clip_threshold))
+        if not decay_rate <= 0.0:
+            raise ValueError("Invalid decay_rate value: {}".format(decay_rate))
+        if not 0.0 <= weight_decay:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+
+        defaults = dict(
+            lr=lr,
+            beta1=beta1,
+            eps=eps,
+            clip_threshold=clip_threshold,
+            decay_rate=decay_rate,
+            weight_decay=weight_decay,
+        )
+        super().__init__(params, defaults)
+
+        self._hold_steps = hold_steps
+        self._min_dim_size_to_factor = min_dim_size_to_factor
+        self._layouts = {}
+
+    def _get_layout(self, p):
+        """Splits the partition ``p`` into segments of original parameters and assigns each
+        of them a slice of the flat factored states."""
+        if p in self._layouts:
+            return self._layouts[p]
+        layout = []
+        num_rows, num_cols, num_dense = 0, 0, 0
+        for shape, param_st, param_end, local_st in _partition_segments(p):
+            shape = torch.Size(shape)
+            numel = param_end - param_st
+            seg = {"local": local_st, "numel": numel, "factored": False}
+            if (
+                len(shape) >= 2
+                and shape[-1] >= self._min_dim_size_to_factor
+                and shape.numel() // shape[-1] >= self._min_dim_size_to_factor
+            ):
+                cols = shape[-1]
+                row_st = param_st // cols
+                rows = (param_end + cols - 1) // cols - row_st
+                lead = param_st - row_st * cols
+                # the first and the last row may be split with other ranks
+                mask = torch.zeros(rows * cols, dtype=torch.float32, device=p.device)
+                mask[lead : lead + numel] = 1
+                mask = mask.view(rows, cols)
+                seg.update(
+                    factored=True,
+                    rows=rows,
+                    cols=cols,
+                    lead=lead,
+                    row_offset=num_rows,
+                    col_offset=num_cols,
+                    row_count=mask.sum(1).clamp_(min=1),
+                    col_count=mask.sum(0).clamp_(min=1),
+                )
+                num_rows += rows
+                num_cols += cols
+            else:
+                seg["dense_offset"] = num_dense
+                num_dense += numel
+            layout.append(seg)
+        self._layouts[p] = (layout, num_rows, num_cols, num_dense)
+        return self._layouts[p]
+
+    @staticmethod
+    def _pad_rows(seg, x):
+        """Places the flat slice ``x`` of a factored segment into its (rows, cols) matrix."""
+        buf = torch.zeros(seg["rows"] * seg["cols"], dtype=x.dtype, device=x.device)
+        buf[seg["lead"] : seg["lead"] + seg["numel"]] = x
+        return buf.view(seg["rows"], seg["cols"])
+
+    def _init_state(self, p, state):
+        _, num_rows, num_cols, num_dense = self._get_layout(p)
+        state["exp_avg_sq_row"] = torch.zeros(
+            num_rows, dtype=torch.float32, device=p.device
+        )
+        state["exp_avg_sq_col"] = torch.zeros(
+            num_cols, dtype=torch.float32, device=p.device
+        )
+        state["exp_avg_sq"] = torch.zeros(num_dense, dtype=torch.float32, device=p.device)
+
+    def _on_justify_scale(self, old_scale, new_scale):
+        # gradients are unscaled before they reach the states, nothing to rescale
+        pass
+
+    @torch.no_grad()
+    def step(self, closure=None, scale=1):
+        """Performs a single optimization step.
+        Arguments:
+            closure (callable, optional): A closure that reevaluates the model
+                and returns the loss.
+        """
+
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1 = group["beta1"]
+            for p in group["params"]:
+                if p.grad is None or not p.requires_grad:
+                    continue
+                if p.grad.is_sparse:
+                    raise RuntimeError("Adafactor does not support sparse gradients")
+                if p.dtype not in [torch.float32, torch.half, torch.bfloat16]:
+                    raise RuntimeError(
+                        "Adafactor only supports fp32, fp16 and bf16 gradients"
+                    )
+
+                state = self.state[p]
+                # Lazy state initialization
+                if len(state) == 0:
+                    state["step"] = 0
+                    self._init_state(p, state)
+                    if beta1 is not None:
+                        state["exp_avg"] = torch.zeros(
+                            p.size(), dtype=torch.float32, device=p.device
+                        )
+                    if p.dtype != torch.float32:
+                        state["_param_fp32"] = torch.empty(
+                            p.size(), dtype=torch.float32, device=p.device
+                        )
+                        state["_param_fp32"].copy_(p)
+
+                state["step"] += 1
+                beta2t = 1.0 - math.pow(state["step"], group["decay_rate"])
+                lr = 0.0 if state["step"] <= self._hold_steps else group["lr"]
+
+                grad = p.grad.view(-1).float() / scale
+                update = torch.zeros_like(grad)
+                layout, _, _, _ = self._get_layout(p)
+                for seg in layout:
+                    st, ed = seg["local"], seg["local"] + seg["numel"]
+                    g = grad[st:ed]
+                    g_sq = g * g + group["eps"]
+                    if seg["factored"]:
+                        row = state["exp_avg_sq_row"][
+                            seg["row_offset"] : seg["row_offset"] + seg["rows"]
+                        ]
+                        col = state["exp_avg_sq_col"][
+                            seg["col_offset"] : seg["col_offset"] + seg["cols"]
+                        ]
+                        g_sq = self._pad_rows(seg, g_sq)
+                        row.mul_(beta2t).add_(
+                            g_sq.sum(1) / seg["row_count"], alpha=1.0 - beta2t
+                        )
+                        col.mul_(beta2t).add_(
+                            g_sq.sum(0) / seg["col_count"], alpha=1.0 - beta2t
+                        )
+                        r_factor = (row / row.mean()).rsqrt()
+                        c_factor = col.rsqrt()
+                        u = torch.outer(r_factor, c_factor).view(-1)[
+                            seg["lead"] : seg["lead"] + seg["numel"]
+                        ]
+                        u = u * g
+                    else:
+                        v = state["exp_avg_sq"][
+                            seg["dense_offset"] : seg["dense_offset"] + seg["numel"]
+                        ]
+                        v.mul_(beta2t).add_(g_sq, alpha=1.0 - beta2t)
+                        u = v.rsqrt() * g
+                    # update clipping, stays on device
+                    rms = u.norm() / math.sqrt(seg["numel"])
+                    u.div_((rms / group["clip_threshold"]).clamp_(min=1.0))
+                    update[st:ed] = u
+
+                if beta1 is not None:
+                    state["exp_avg"].view(-1).mul_(beta1).add_(update, alpha=1.0 - beta1)
+                    update = state["exp_avg"].view(-1)
+
+                param = state["_param_fp32"] if p.dtype != torch.float32 else p
+                if group["weight_decay"] != 0:
+                    param.mul_(1.0 - lr * group["weight_decay"])
+                param.view(-1).add_(update, alpha=-lr)
+                if p.dtype != torch.float32:
+                    p.copy_(param)
+
+        return loss
+
+    def _dense_exp_avg_sq(self, p, state):
+        """Expands the factored second moment of ``p`` to one value per element."""
+        layout, _, _, _ = self._get_layout(p)
+        ret = torch.zeros(p.numel(), dtype=torch.float32, device=p.device)
+        for seg in layout:
+            st, ed = seg["local"], seg["local"] + seg["numel"]
+            if seg["factored"]:
+                row = state["exp_avg_sq_row"][
+                    seg["row_offset"] : seg["row_offset"] + seg["rows"]
+                ]
+                col = state["exp_avg_sq_col"][
+                    seg["col_offset"] : seg["col_offset"] + seg["cols"]
+                ]
+                ret[st:ed] = (torch.outer(row, col) / row.mean()).view(-1)[
+                    seg["lead"] : seg["lead"] + seg["numel"]
+                ]
+            else:
+                ret[st:ed] = state["exp_avg_sq"][
+                    seg["dense_offset"] : seg["dense_offset"] + seg["numel"]
+                ]
+        return ret
+
+    def _factor_exp_avg_sq(self, p, state):
+        """Replaces a per-element ``exp_avg_sq`` of ``p`` with its factored form.
+
+        The result is exact for a second moment that was expanded by ``_dense_exp_avg_sq``
+        from whole rows, and a rank-1 projection otherwise.
+        """
+        dense = state.pop("exp_avg_sq").to(p.device).float().view(-1)
+        self._init_state(p, state)
+        layout, _, _, _ = self._get_layout(p)
+        for seg in layout:
+            v = dense[seg["local"] : seg["local"] + seg["numel"]]
+            if seg["factored"]:
+                v = self._pad_rows(seg, v)
+                state["exp_avg_sq_row"][
+                    seg["row_offset"] : seg["row_offset"] + seg["rows"]
+                ] = (v.sum(1) / seg["row_count"])
+                state["exp_avg_sq_col"][
+                    seg["col_offset"] : seg["col_offset"] + seg["cols"]
+                ] = (v.sum(0) / seg["col_count"])
+            else:
+                state["exp_avg_sq"][
+                    seg["dense_offset"] : seg["dense_offset"] + seg["numel"]
+                ] = v
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        r"""Loads the optimizer state.
+
+        Args:
+            state_dict (dict): optimizer state. Should be an object returned
+                from a call to :meth:`state_dict`.
+        """
+        # deepcopy, to be consistent with module API
+        state_dict = deepcopy(state_dict)
+        # Validate the state_dict
+        groups = self.param_groups
+        saved_groups = state_dict["param_groups"]
+
+        if len(groups) != len(saved_groups):
+            raise ValueError(
+                "loaded state dict has a different number of " "parameter groups"
+            )
+        param_lens = (len(g["params"]) for g in groups)
+        saved_lens = (len(g["params"]) for g in saved_groups)
+        if any(p_len != s_len for p_len, s_len in zip(param_lens, saved_lens)):
+            raise ValueError(
+                "loaded state dict contains a parameter group "
+                "that doesn't match the size of optimizer's group"
+            )
+
+        # Update the state
+        id_map = {
+            old_id: p
+            for old_id, p in zip(
+                chain.from_iterable((g["params"] for g in saved_groups)),
+                chain.from_iterable((g["params"] for g in groups)),
+            )
+        }
+
+        state = defaultdict(dict)
+        is_whole = False if "is_whole" not in state_dict else state_dict["is_whole"]
+        for k, v in state_dict["state"].items():
+            if k in id_map:
+                param = id_map[k]
+                if is_whole:
+                    partition = partition_range(param)
+                    if partition is None:
+                        continue
+                    for key in ["_param_fp32", "exp_avg_sq", "exp_avg"]:
+                        if key in v:
+                            v[key] = v[key][partition[0] : partition[1]]
+
+                if "exp_avg_sq_row" not in v:
+                    self._factor_exp_avg_sq(param, v)
+
+                if param.dtype != torch.float32 and "_param_fp32" not in v:
+                    v["_param_fp32"] = torch.empty(
+                        param.size(), dtype=torch.float32, device=param.device
+                    )
+                    v["_param_fp32"].copy_(param)
+                elif param.dtype == torch.float32 and "_param_fp32" in v:
+                    # gathered checkpoints carry fp32 parameters as well
+                    v.pop("_param_fp32")
+
+                for name in [
+                    "exp_avg",
+                    "exp_avg_sq",
+                    "exp_avg_sq_row",
+                    "exp_avg_sq_col",
+                    "_param_fp32",
+                ]:
+                    if name in v:
+                        v[name] = v[name].to(param.device).to(torch.float32)
+                for name in ["exp_avg", "_param_fp32"]:
+                    if name in v:
+                        v[name] = v[name].view(param.size())
+
+                state[param] = v
+            else:
+                state[k] = v
+
+        # Update parameter groups, setting their 'params' value
+        def update_group(group, new_group):
+            new_group["params"] = group["params"]
+            return new_group
+
+        param_groups = [update_group(g, ng) for g, ng in zip(groups, saved_groups)]
+        self.__setstate__({"state": state, "param_groups": param_groups})
+
+    def state_dict(self, gather=False) -> dict:
+        r"""Returns the state of the optimizer as a :class:`dict`.
+
+        With ``gather=True`` the factored second moments are expanded to one value per
+        element, so that the partitions of all ranks can be concatenated.
+        """
+
+        # Save order indices instead of Tensors
+        param_mappings = {}
+        start_index = 0
+
+        def pack_group(group):
+            nonlocal start_index
+            packed = {k: v for k, v in group.items() if k != "params"}
+            param_mappings.update(
+                {
+                    id(p): i
+                    for i, p in enumerate(group["params"], start_index)
+                    if id(p) not in param_mappings
+                }
+            )
+            packed["params"] = [param_mappings[id(p)] for p in group["params"]]
+            start_index += len(packed["params"])
+            return packed
+
+        use_exp_avg = any(g["beta1"] is not None for g in self.param_groups)
+
+        def cut_states(p, state):
+            if not gather:
+                return dict(state)
+            ret = {
+                "step": state["step"],
+                "exp_avg_sq": self._dense_exp_avg_sq(p, state),
+                "_param_fp32": (
+                    state["_param_fp32"] if "_param_fp32" in state else p.detach()
+                ).view(-1).float(),
+            }
+            if use_exp_avg:
+                ret["exp_avg"] = (
+                    state["exp_avg"].view(-1)
+                    if "exp_avg" in state
+                    else torch.zeros(p.numel(), dtype=torch.float32, device=p.device)
+                )
+            return ret
+
+        param_groups = [pack_group(g) for g in self.param_groups]
+        # Remap state to use order indices as keys
+        packed_state = {
+            (param_mappings[id(k)] if isinstance(k, torch.Tensor) else k): cut_states(
+                k, v
+            )
+            for k, v in self.state.items()
+        }
+        states = {
+            "state": packed_state,
+            "param_groups": param_groups,
+        }
+        if gather:
+            names = ["exp_avg_sq", "_param_fp32"] + (["exp_avg"] if use_exp_avg else [])
+            states = state_dict_gather(states, names)
+            states["is_whole"] = True
+        else:
+            states["is_whole"] = False
+
+        return states
+
+    # zero the gradients in place by default, as the other optimizers do, torch >= 2.0 sets
+    # them to None, which step() skips
+    def zero_grad(self, set_to_none: bool = False):
+        super().zero_grad(set_to_none=set_to_none)
@@ -2,7 +2,7 @@ import torch
 from ..global_var import config
 from . import _function as F
 import torch.optim._functional
-from .. import C
+from ..utils import C
 from .. import nccl
 import inspect
 from ..utils import check_torch_version
@@ -14,9 +14,14 @@ from collections import defaultdict
 class AdamOptimizer(torch.optim.Optimizer):
     """
     Adam optimizer support fp16 and bf16.
+
+    Args:
+        quantized_state (bool): store ``exp_avg`` and ``exp_avg_sq`` of fp16/bf16 parameters in 8 bits with a dynamic quantization map and one fp32 scale per 1024 elements. Default False.
+        min_quantized_size (int): parameters with fewer elements keep full precision states. Default 4096.
     """
 
     _bmtrain_optimizer = True
+    _device_skip = True
 
     def __init__(
         self,
@@ -26,6 +31,8 @@ class AdamOptimizer(torch.optim.Optimizer):
         eps=1e-8,
         weight_decay=0,
         hold_steps=0,
+        quantized_state=False,
+        min_quantized_size=4096,
     ):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
@@ -42,6 +49,16 @@ class AdamOptimizer(torch.optim.Optimizer):
         super().__init__(params, defaults)
 
         self._hold_steps = hold_steps
+        self._quantized_state = quantized_state
+        self._min_quantized_size = min_quantized_size
+        self._stepped_states = []
+
+    def _use_quantized_state(self, p):
+        return (
+            self._quantized_state
+            and p.dtype != torch.float32
+            and p.numel() >= self._min_quantized_size
+        )
 
     def _on_justify_scale(self, old_scale, new_scale):
         delta = new_scale / old_scale
@@ -50,16 +67,27 @@ class AdamOptimizer(torch.optim.Optimizer):
                 if p in self.state:
                     state = self.state[p]
                     if len(state) > 0:
-                        if p.dtype == torch.float16:
+                        # quantized states are kept unscaled
+                        if (
+                            p.dtype == torch.float16
+                            and state["exp_avg"].dtype != torch.uint8
+                        ):
                             state["exp_avg"] *= delta
                             state["exp_avg_sq"] *= delta
 
+    def _on_skipped_step(self):
+        # the last step was skipped on device, take back its step counts
+        for state in self._stepped_states:
+            state["step"] -= 1
+        self._stepped_states = []
+
     @torch.no_grad()
-    def step(self, closure=None, scale=1):
+    def step(self, closure=None, scale=1, skip=None):
         """Performs a single optimization step.
         Arguments:
             closure (callable, optional): A closure that reevaluates the model
                 and returns the loss.
+            skip (torch.Tensor, optional): a float32 flag on device, the step is a no-op if it is set.
         The remaining arguments are deprecated, and are only retained (for the moment) for error-checking purposes.
         """
 
@@ -68,6 +96,8 @@ class AdamOptimizer(torch.optim.Optimizer):
             with torch.enable_grad():
                 loss = closure()
 
+        self._stepped_states = []
+
         # update parameters
         for group in self.param_groups:
             for p in group["params"]:
@@ -85,19 +115,22 @@ class AdamOptimizer(torch.optim.Optimizer):
                     # Lazy state initialization
                     if len(state) == 0:
                         state["step"] = 0
-                        # Exponential moving average of gradient values
-                        if p.dtype == torch.float16:
-                            state["exp_avg"] = torch.zeros(
-                                p.size(), dtype=torch.float16, device=p.device
-                            )  # on device
+                        if self._use_quantized_state(p):
+                            F.init_quantized_state(state, p.size(), p.device)
                         else:
-                            state["exp_avg"] = torch.zeros(
+                            # Exponential moving average of gradient values
+                            if p.dtype == torch.float16:
+                                state["exp_avg"] = torch.zeros(
+                                    p.size(), dtype=torch.float16, device=p.device
+                                )  # on device
+                            else:
+                                state["exp_avg"] = torch.zeros(
+                                    p.size(), dtype=torch.float32, device=p.device
+                                )  # on device
+                            # Exponential moving average of squared gradient values
+                            state["exp_avg_sq"] = torch.zeros(
                                 p.size(), dtype=torch.float32, device=p.device
                             )  # on device
-                        # Exponential moving average of squared gradient values
-                        state["exp_avg_sq"] = torch.zeros(
-                            p.size(), dtype=torch.float32, device=p.device
-                        )  # on device
 
                         if p.dtype != torch.float32:
                             state["_param_fp32"] = torch.empty(
@@ -111,7 +144,26 @@ class AdamOptimizer(torch.optim.Optimizer):
                     else:
                         grad = p.grad
 
-                    if p.dtype == torch.float32:
+                    if skip is not None:
+                        self._stepped_states.append(state)
+
+                    if p.dtype == torch.float32 and skip is not None:
+                        state["step"] += 1
+                        F.adam_fp32(
+                            p,  # fp32
+                            grad.contiguous(),  # fp32
+                            state["exp_avg"],  # fp32: m
+                            state["exp_avg_sq"],  # fp32: v
+                            group["betas"][0],
+                            group["betas"][1],
+                            group["eps"],
+                            0.0 if state["step"] <= self._hold_steps else group["lr"],
+                            scale,
+                            group["weight_decay"],
+                            state["step"],
+                            skip,
+                        )
+                    elif p.dtype == torch.float32:
                         other_kwargs = {}
                         if (
                             "maximize"
@@ -140,6 +192,25 @@ class AdamOptimizer(torch.optim.Optimizer):
                             **other_kwargs
                         )
                         state["step"] += 1
+                    elif state["exp_avg"].dtype == torch.uint8:
+                        state["step"] += 1
+                        F.adam_8bit(
+                            state["_param_fp32"],  # fp32
+                            p,  # fp16 / bf16
+                            grad,  # fp16 / bf16
+                            state["exp_avg"],  # uint8: m
+                            state["exp_avg_sq"],  # uint8: v
+                            state["exp_avg_absmax"],  # fp32
+                            state["exp_avg_sq_absmax"],  # fp32
+                            group["betas"][0],
+                            group["betas"][1],
+                            group["eps"],
+                            0.0 if state["step"] < self._hold_steps else group["lr"],
+                            scale,
+                            group["weight_decay"],
+                            state["step"],
+                            skip,
+                        )
                     else:
                         f = F.adam_fp16 if p.dtype == torch.float16 else F.adam_bf16
                         state["step"] += 1
@@ -156,6 +227,7 @@ class AdamOptimizer(torch.optim.Optimizer):
                             scale,
                             group["weight_decay"],
                             state["step"],
+                            skip,
                         )
 
         return loss
@@ -220,6 +292,9 @@ class AdamOptimizer(torch.optim.Optimizer):
                     )
                     v["_param_fp32"].copy_(param)
 
+                F.convert_quantized_state(
+                    v, self._use_quantized_state(param), param.device
+                )
                 for name, dtype in [
                     (
                         "exp_avg",
@@ -232,7 +307,7 @@ class AdamOptimizer(torch.optim.Optimizer):
                     ("exp_avg_sq", torch.float32),
                     ("_param_fp32", torch.float32),
                 ]:
-                    if name in v:
+                    if name in v and v[name].dtype != torch.uint8:
                         v[name] = v[name].to(param.device).to(dtype)
 
                 state[param] = v
@@ -13,9 +13,14 @@ from ._distributed import state_dict_gather
 class AdamOffloadOptimizer(torch.optim.Optimizer):
     """
     Adam optimizer using optimizer offload.
+
+    Args:
+        quantized_state (bool): store ``exp_avg`` and ``exp_avg_sq`` of fp16/bf16 parameters on host in 8 bits with a dynamic quantization map and one fp32 scale per 1024 elements. Default False.
+        min_quantized_size (int): parameters with fewer elements keep full precision states. Default 4096.
     """
 
     _bmtrain_optimizer = True
+    _device_skip = True
 
     def __init__(
         self,
@@ -26,6 +31,8 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
         weight_decay=0,
         hold_steps=0,
         record_delta=False,
+        quantized_state=False,
+        min_quantized_size=4096,
     ):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
@@ -37,12 +44,17 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
             raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
         if not 0.0 <= weight_decay:
             raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if record_delta and quantized_state:
+            raise ValueError("record_delta is not supported with quantized_state")
         self.avg_delta = 0
         self.var_delta = 0
         defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
         super().__init__(params, defaults)
         self._hold_steps = hold_steps
+        self._quantized_state = quantized_state
+        self._min_quantized_size = min_quantized_size
         self._events = {}
+        self._skip_host = None
         self.record_delta = record_delta
         if self.record_delta:
             for group in self.param_groups:
@@ -57,12 +69,20 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
                         ),
                     )
 
+    def _use_quantized_state(self, p):
+        return (
+            self._quantized_state
+            and p.dtype != torch.float32
+            and p.numel() >= self._min_quantized_size
+        )
+
     @torch.no_grad()
-    def step(self, closure=None, scale=1):
+    def step(self, closure=None, scale=1, skip=None):
         """Performs a single optimization step.
         Arguments:
             closure (callable, optional): A closure that reevaluates the model
                 and returns the loss.
+            skip (torch.Tensor, optional): a float32 flag on device, the step is a no-op if it is set.
         The remaining arguments are deprecated, and are only retained (for the moment) for error-checking purposes.
         """
 
@@ -90,14 +110,17 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
                     # Lazy state initialization
                     if len(state) == 0:
                         state["step"] = 0
-                        # Exponential moving average of gradient values
-                        state["exp_avg"] = torch.zeros(
-                            p.size(), dtype=torch.float32, device="cpu"
-                        )  # on host
-                        # Exponential moving average of squared gradient values
-                        state["exp_avg_sq"] = torch.zeros(
-                            p.size(), dtype=torch.float32, device="cpu"
-                        )  # on host
+                        if self._use_quantized_state(p):
+                            F.init_quantized_state(state, p.size(), "cpu")  # on host
+                        else:
+                            # Exponential moving average of gradient values
+                            state["exp_avg"] = torch.zeros(
+                                p.size(), dtype=torch.float32, device="cpu"
+                            )  # on host
+                            # Exponential moving average of squared gradient values
+                            state["exp_avg_sq"] = torch.zeros(
+                                p.size(), dtype=torch.float32, device="cpu"
+                            )  # on host
 
                         if p.dtype == torch.float32:
                             state["_param_fp32"] = torch.empty(
@@ -139,6 +162,12 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
                         )
                     )
 
+        if skip is not None:
+            # the flag travels with the gradients, reading it costs no extra sync
+            if self._skip_host is None:
+                self._skip_host = torch.zeros(1, dtype=torch.float32, pin_memory=True)
+            self._skip_host.copy_(skip, non_blocking=True)
+
         # transfer parameters to host asynchronously
         for param, state, event, _, _, _, _, _ in update_params:
             if param.dtype == torch.float32:
@@ -152,6 +181,8 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
         for param, state, event, beta1, beta2, eps, lr, weight_decay in update_params:
             # wait for transfer to host
             event.synchronize()
+            if skip is not None and self._skip_host.item() > 0:
+                return loss
 
             # update parameters
             if param.dtype == torch.float32:
@@ -194,6 +225,26 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
                     grad = -state["_grad_fp16"]
                 else:
                     grad = state["_grad_fp16"]
+                if state["exp_avg"].dtype == torch.uint8:
+                    F.adam_cpu_8bit(
+                        state["_param_fp32"].view(-1),
+                        state["_param_fp16"].view(-1),
+                        grad.view(-1),
+                        state["exp_avg"].view(-1),
+                        state["exp_avg_sq"].view(-1),
+                        state["exp_avg_absmax"],
+                        state["exp_avg_sq_absmax"],
+                        beta1,
+                        beta2,
+                        eps,
+                        0.0 if state["step"] < self._hold_steps else lr,
+                        scale,
+                        weight_decay,
+                        state["step"],
+                    )
+                    # transfer parameters back to device asynchronously
+                    param.copy_(state["_param_fp16"], non_blocking=True)
+                    continue
                 F.adam_cpu(
                     state["_param_fp32"].view(-1),
                     state["_param_fp16"].view(-1),
@@ -288,12 +339,13 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
                         )
                         v["_param_fp32"].copy_(param)
 
+                F.convert_quantized_state(v, self._use_quantized_state(param), "cpu")
                 for name, dtype in [
                     ("exp_avg", torch.float32),
                     ("exp_avg_sq", torch.float32),
                     ("_param_fp32", torch.float32),
                 ]:
-                    if name in v:
+                    if name in v and v[name].dtype != torch.uint8:
                         v[name] = v[name].to("cpu").to(dtype)
 
                 state[param] = v
@@ -356,12 +408,19 @@ class AdamOffloadOptimizer(torch.optim.Optimizer):
             return packed
 
         def cut_states(state):
-            return {
+            ret = {
                 "step": state["step"],
                 "exp_avg": state["exp_avg"],
                 "exp_avg_sq": state["exp_avg_sq"],
                 "_param_fp32": state["_param_fp32"],
             }
+            if state["exp_avg"].dtype == torch.uint8:
+                ret["exp_avg_absmax"] = state["exp_avg_absmax"]
+                ret["exp_avg_sq_absmax"] = state["exp_avg_sq_absmax"]
+                if gather:
+                    # block scales do not survive concatenating partitions
+                    F.convert_quantized_state(ret, False, "cpu")
+            return ret
 
         param_groups = [pack_group(g) for g in self.param_groups]
         # Remap state to use order indices as keys
@@ -1,23 +1,40 @@
 from typing import Optional, Union, List, Dict, Tuple
 import torch
-from ..loss._function import has_inf_nan
+from ..loss._function import multi_tensor_grad_norm
 from ..utils import print_rank
 from ..lr_scheduler.warmup import WarmupLRScheduler
 from .. import nccl
 from ..global_var import config
+from ._sharded import save_sharded_state, load_sharded_state
+from ..profiler import record, OPTIMIZER
 
-def check_overflow(param_groups):
-    # check overflow
-    has_inf_or_nan = torch.zeros(1, dtype=torch.uint8, device="cuda")[0]
-    for group in param_groups:
-        for p in group['params']:
-            if p.grad is not None:
-                if p.dtype != torch.float:
-                    has_inf_nan(p.grad, has_inf_or_nan)
+def _grad_norm_info(param_groups, norm_type):
+    grads = [p.grad for group in param_groups for p in group['params'] if p.grad is not None]
+    # [norm, flag] share one buffer so that a single collective reduces both
+    info = torch.zeros(2, dtype=torch.float32, device="cuda")
+    multi_tensor_grad_norm(grads, norm_type, info)
     if "comm" in config:
-        nccl.allReduce(has_inf_or_nan.storage(), has_inf_or_nan.storage(), "max", config["comm"])
+        op = "max" if norm_type == float("inf") else "sum"
+        nccl.allReduce(info.storage(), info.storage(), op, config["comm"])
+    return info
+
+def grad_norm_and_overflow(param_groups, norm_type=2):
+    """Computes the gradient norm and the inf/nan flag of all ``param_groups`` with one fused
+    pass and one packed all-reduce.
 
-    if has_inf_or_nan > 0:
+    Returns:
+        (float, bool): the total norm, still scaled by the loss scale, and whether any gradient overflowed.
+    """
+    norm_type = float(norm_type)
+    total_norm, has_inf_or_nan = _grad_norm_info(param_groups, norm_type).tolist()
+    if norm_type != float("inf"):
+        total_norm = total_norm ** (1. / norm_type)
+    return total_norm, has_inf_or_nan > 0
+
+def check_overflow(param_groups):
+    # check overflow
+    _, has_inf_or_nan = grad_norm_and_overflow(param_groups)
+    if has_inf_or_nan:
         raise OverflowError("Gradient overflow")
 
 def grad_rescale(param_groups, scale):
@@ -33,6 +50,7 @@ class OptimManager:
         loss_scale (float): The initial loss scale. Default to None for not using loss scaling.
         loss_scale_factor (float): The loss scale factor.
         loss_scale_steps (int): The loss scale steps.
+        device_loss_scale (bool): Keep the loss scale, its growth counter and the overflow flag on the device. Optimizers that support it skip overflowed steps by themselves, and the host learns the outcome one step later, so no step waits for the GPU. Default to False.
 
     Examples:
         >>> optim_manager = bmt.optim.OptimManager(loss_scale=1024)
@@ -53,6 +71,7 @@ class OptimManager:
         min_loss_scale = 1,
         max_loss_scale = float("inf"),
         grad_scale : Optional[int] = None,
+        device_loss_scale : bool = False,
     ):
         if loss_scale is not None:
             self.loss_scale = loss_scale
@@ -72,6 +91,20 @@ class OptimManager:
         self.optimizers = []
         self.lr_schedulers = []
 
+        # param groups whose overflow was already checked by clip_grad_norm in this step
+        self._checked_groups = set()
+        self._checked_overflow = False
+
+        self.device_loss_scale = device_loss_scale and self.loss_scale_enabled
+        if self.device_loss_scale:
+            self._scale_device = torch.tensor([self.loss_scale], dtype=torch.float32, device="cuda")
+            self._growth_device = torch.zeros(1, dtype=torch.float32, device="cuda")
+            self._skip_device = torch.zeros(1, dtype=torch.float32, device="cuda")
+            self._checked_flag = torch.zeros(1, dtype=torch.float32, device="cuda")
+            # [skipped, next scale, growth counter] of the last step, read with a lag of one step
+            self._scale_stats = torch.zeros(3, dtype=torch.float32, pin_memory=True)
+            self._scale_event = None
+
     def add_optimizer(
         self,
         optimizer: torch.optim.Optimizer,
@@ -89,6 +122,8 @@ class OptimManager:
 
     def scale_loss(self, loss : torch.Tensor) -> torch.Tensor:
 
+        if self.device_loss_scale:
+            return loss * (self._scale_device[0] / self.grad_scale) # loss scale
         return loss * ( self.loss_scale / self.grad_scale ) # loss scale
 
     def backward(self, loss : torch.Tensor):
@@ -110,6 +145,10 @@ class OptimManager:
         """
         for optimizer in self.optimizers:
             optimizer.zero_grad(set_to_none=False)
+        self._checked_groups.clear()
+        self._checked_overflow = False
+        if self.device_loss_scale:
+            self._checked_flag.zero_()
 
     def step(self):
         """
@@ -120,14 +159,16 @@ class OptimManager:
 
         This function can also handle gradient overflow by reducing the loss scale when it occurs.
         """
+        if self.device_loss_scale:
+            self._device_step()
+            return
         if self.loss_scale_enabled:
-            has_overflow = False
-            for optimizer in self.optimizers:
-                try:
-                    check_overflow(optimizer.param_groups)
-                except OverflowError:
-                    has_overflow = True
-                    break
+            has_overflow = self._checked_overflow
+            unchecked_groups = self._unchecked_groups()
+            if not has_overflow and len(unchecked_groups) > 0:
+                _, has_overflow = grad_norm_and_overflow(unchecked_groups)
+            self._checked_groups.clear()
+            self._checked_overflow = False
             if has_overflow:
                 print_rank("Gradient overflow, change scale from %lf to %lf" % (self.loss_scale, self.loss_scale / self.loss_scale_factor))
                 with torch.no_grad():
@@ -136,12 +177,13 @@ class OptimManager:
                     self.zero_grad()
                 return
         for optimizer, lr_scheduler in zip(self.optimizers, self.lr_schedulers):
-            if hasattr(optimizer, "_bmtrain_optimizer") and optimizer._bmtrain_optimizer:
-                optimizer.step(scale=self.loss_scale)
-            else:
-                if self.loss_scale_enabled:
-                    grad_rescale(optimizer.param_groups, self.loss_scale)
-                optimizer.step()
+            with record(type(optimizer).__name__ + ".step", OPTIMIZER):
+                if hasattr(optimizer, "_bmtrain_optimizer") and optimizer._bmtrain_optimizer:
+                    optimizer.step(scale=self.loss_scale)
+                else:
+                    if self.loss_scale_enabled:
+                        grad_rescale(optimizer.param_groups, self.loss_scale)
+                    optimizer.step()
 
             if lr_scheduler is not None:
                 lr_scheduler.step()
@@ -155,6 +197,85 @@ class OptimManager:
         current_stream = torch.cuda.current_stream()
         config['load_stream'].wait_stream(current_stream)
 
+    def _unchecked_groups(self):
+        return [
+            group
+            for optimizer in self.optimizers
+            for group in optimizer.param_groups
+            if id(group) not in self._checked_groups
+        ]
+
+    def _device_step(self):
+        # apply the outcome of the previous step, its statistics are ready by now
+        self._sync_scale_stats()
+
+        skip = self._skip_device
+        skip.copy_(self._checked_flag)
+        unchecked_groups = self._unchecked_groups()
+        if len(unchecked_groups) > 0:
+            info = _grad_norm_info(unchecked_groups, 2.0)
+            torch.maximum(skip, info[1:], out=skip)
+        self._checked_groups.clear()
+        self._checked_flag.zero_()
+
+        for optimizer, lr_scheduler in zip(self.optimizers, self.lr_schedulers):
+            with record(type(optimizer).__name__ + ".step", OPTIMIZER):
+                if getattr(optimizer, "_device_skip", False):
+                    optimizer.step(scale=self.loss_scale, skip=skip)
+                elif skip.item() == 0:
+                    # this optimizer can not skip by itself, fall back to a host read
+                    if hasattr(optimizer, "_bmtrain_optimizer") and optimizer._bmtrain_optimizer:
+                        optimizer.step(scale=self.loss_scale)
+                    else:
+                        grad_rescale(optimizer.param_groups, self.loss_scale)
+                        optimizer.step()
+
+            if lr_scheduler is not None:
+                lr_scheduler.step()
+
+        with torch.no_grad():
+            overflow = skip > 0
+            scale = self._scale_device
+            growth = torch.where(overflow, self._growth_device, self._growth_device + 1)
+            shrink = overflow & (scale > self.min_loss_scale)
+            grow = (~overflow) & (growth >= self.loss_scale_steps) & (scale < self.max_loss_scale)
+            new_scale = torch.where(
+                shrink,
+                scale / self.loss_scale_factor,
+                torch.where(grow, scale * self.loss_scale_factor, scale),
+            )
+            growth = torch.where(shrink | grow, torch.zeros_like(growth), growth)
+            self._scale_device.copy_(new_scale)
+            self._growth_device.copy_(growth)
+            self._scale_stats.copy_(torch.cat([skip, new_scale, growth]), non_blocking=True)
+        self._scale_event = torch.cuda.Event()
+        self._scale_event.record()
+
+        current_stream = torch.cuda.current_stream()
+        config['load_stream'].wait_stream(current_stream)
+
+    def _sync_scale_stats(self):
+        """Applies the loss scale decision of the last device step on host."""
+        if not self.device_loss_scale or self._scale_event is None:
+            return
+        self._scale_event.synchronize()
+        self._scale_event = None
+        skipped, new_scale, growth = self._scale_stats.tolist()
+        if skipped > 0:
+            print_rank("Gradient overflow, change scale from %lf to %lf" % (self.loss_scale, new_scale))
+            for optimizer, lr_scheduler in zip(self.optimizers, self.lr_schedulers):
+                if hasattr(optimizer, "_on_skipped_step"):
+                    optimizer._on_skipped_step()
+                if lr_scheduler is not None:
+                    lr_scheduler.step(lr_scheduler.num_iter - 1)
+        if new_scale != self.loss_scale:
+            with torch.no_grad():
+                for optimizer in self.optimizers:
+                    if hasattr(optimizer, "_on_justify_scale"):
+                        optimizer._on_justify_scale(self.loss_scale, new_scale)
+        self.loss_scale = new_scale
+        self.steps_since_last_scale = int(growth)
+
     def clip_grad_norm(self, param_groups, max_norm, norm_type=2, eps=1e-6):
         """Clips gradient norm of an iterable of parameters.
 
@@ -169,35 +290,45 @@ class OptimManager:
         Returns:
             Total norm of the parameters (viewed as a single vector).
         """
+        with record("clip_grad_norm", OPTIMIZER):
+            return self._clip_grad_norm(param_groups, max_norm, norm_type, eps)
+
+    def _clip_grad_norm(self, param_groups, max_norm, norm_type, eps):
+        if self.device_loss_scale:
+            return self._device_clip_grad_norm(param_groups, max_norm, norm_type, eps)
         scale = self.loss_scale
-        grads = []
-        parameters = [p for group in param_groups for p in group['params']]
-        for p in parameters:
-            if p.grad is not None:
-                grads.append(p.grad.data)
-            else:
-                grads.append(torch.zeros_like(p.data))
-
-        if norm_type == 'inf':
-            total_norm_cuda = max(g.data.abs().max() for g in grads).detach()
-            nccl.allReduce(total_norm_cuda.storage(), total_norm_cuda.storage(), "max", config["comm"])
-            total_norm = total_norm_cuda
-        else:
-            norm_type = float(norm_type)
-            total_norm_cuda = torch.cuda.FloatTensor([0])
-            for index, g in enumerate(grads):
-                param_norm = g.data.float().norm(norm_type)
-                total_norm_cuda += param_norm ** norm_type
-            nccl.allReduce(total_norm_cuda.storage(), total_norm_cuda.storage(), "sum", config["comm"])
-            total_norm = total_norm_cuda[0] ** (1. / norm_type)
-        # total_norm = total_norm / scale
-        # clip_coef = float(max_norm) / (total_norm + eps)
-        clip_coef = float(max_norm * scale) / (total_norm + eps)
-        if clip_coef < 1:
-            for p in parameters:
+        # the overflow check of these groups comes for free, step() reuses it
+        total_norm, has_inf_or_nan = grad_norm_and_overflow(param_groups, norm_type)
+        self._checked_groups.update(id(group) for group in param_groups)
+        self._checked_overflow = self._checked_overflow or has_inf_or_nan
+
+        if not has_inf_or_nan:
+            # total_norm = total_norm / scale
+            # clip_coef = float(max_norm) / (total_norm + eps)
+            clip_coef = float(max_norm * scale) / (total_norm + eps)
+            if clip_coef < 1:
+                for group in param_groups:
+                    for p in group['params']:
+                        if p.grad is not None:
+                            p.grad.data.mul_(clip_coef)
+        return torch.tensor(total_norm / scale, device="cuda")
+
+    @torch.no_grad()
+    def _device_clip_grad_norm(self, param_groups, max_norm, norm_type, eps):
+        norm_type = float(norm_type)
+        info = _grad_norm_info(param_groups, norm_type)
+        self._checked_groups.update(id(group) for group in param_groups)
+        torch.maximum(self._checked_flag, info[1:], out=self._checked_flag)
+
+        total_norm = info[:1] if norm_type == float("inf") else info[:1] ** (1. / norm_type)
+        clip_coef = (max_norm * self._scale_device / (total_norm + eps)).clamp_(max=1.0)
+        # overflowed steps are skipped, keep the gradients as they are
+        clip_coef = torch.where(info[1:] > 0, torch.ones_like(clip_coef), clip_coef)
+        for group in param_groups:
+            for p in group['params']:
                 if p.grad is not None:
                     p.grad.data.mul_(clip_coef)
-        return total_norm / scale
+        return (total_norm / self._scale_device)[0]
 
     @torch.no_grad()
     def _justify_scale(self, scale):
@@ -208,6 +339,7 @@ class OptimManager:
         self.steps_since_last_scale = 0
 
     def state_dict(self, gather_opt=False) -> dict:
+        self._sync_scale_stats()
         return {
             "optimizers": [opt.state_dict(gather_opt) for opt in self.optimizers],
             "lr_schedulers": [lrs.state_dict() if lrs else None for lrs in self.lr_schedulers],
@@ -215,6 +347,26 @@ class OptimManager:
             "loss_scale_enabled": self.loss_scale_enabled,
         }
 
+    def save_sharded(self, path: str) -> None:
+        """Save the optimizer states to the directory ``path`` without gathering them.
+
+        Every rank writes its own partitions to a separate file, together with a small manifest of the partition boundaries.
+
+        Args:
+            path (str): directory of the checkpoint, created if it does not exist.
+        """
+        save_sharded_state(self, path)
+
+    def load_sharded(self, path: str) -> None:
+        """Load the optimizer states saved by :meth:`save_sharded`.
+
+        The states are resharded if the ZeRO world size changed since they were saved, tensor and pipeline parallel sizes must not change.
+
+        Args:
+            path (str): directory of the checkpoint.
+        """
+        load_sharded_state(self, path)
+
     def load_state_dict(self, state_dict: dict) -> None:
         assert len(self.optimizers) == len(state_dict["optimizers"])
         assert len(self.lr_schedulers) == len(state_dict["lr_schedulers"])
@@ -224,3 +376,7 @@ class OptimManager:
             lrs.load_state_dict(lrs_st)
         self.loss_scale = state_dict["loss_scale"]
         self.loss_scale_enabled = state_dict["loss_scale_enabled"]
+        if self.device_loss_scale:
+            self._scale_event = None
+            self._scale_device.fill_(self.loss_scale)
+            self._growth_device.zero_()
@@ -2,21 +2,30 @@ from typing import Generator, Iterable, List, Tuple
 import torch
 from .block_layer import Block
 from .parameter import DistributedParameter
+from .partition_init import ElementwiseInit
 from .global_var import config
 
 
-def init_distributed_parameter(params: Iterable[torch.nn.Parameter]):
+def init_distributed_parameter(params: Iterable[torch.nn.Parameter], names: List[str] = None):
     """Init param of params which is instance of DistributedParameter using param._init_method.
 
     Args:
         params (Iterable[torch.nn.Parameter]): parameter tensors.
+        names (List[str], optional): names of the parameters in the model, the keys of the
+            initializers of :mod:`bmtrain.partition_init`, required for them.
 
     """
-    for param in params:
+    for i, param in enumerate(params):
         if not isinstance(param, DistributedParameter):
             continue
         if param._init_method is None:
             continue
+        if isinstance(param._init_method, ElementwiseInit):
+            # only the partition of this rank is computed
+            if names is None:
+                raise ValueError("the names of the parameters are required by partition_init initializers")
+            param._init_method.fill_(param.data, names[i], param, param._start_partition)
+            continue
         with torch.no_grad():
             partition_size = param.storage().size()
             global_size = partition_size * config["tp_zero_size"] * config["tp_size"]
@@ -52,13 +61,21 @@ def init_distributed_parameter(params: Iterable[torch.nn.Parameter]):
             # param.storage().copy_(tmp_storage[partition_size * config['rank'] : partition_size * (config['rank'] + 1)])
 
 
-def iterate_parameters(model: torch.nn.Module):
+def iterate_named_parameters(model: torch.nn.Module, prefix: str = ""):
     """
-    Itterate over the parameters of the model.
+    Itterate over the names and parameters of the model.
     """
     for kw, val in model._parameters.items():
         if hasattr(val, "_in_block") and val._in_block:
             return []
+        yield prefix + kw, val
+
+
+def iterate_parameters(model: torch.nn.Module):
+    """
+    Itterate over the parameters of the model.
+    """
+    for _, val in iterate_named_parameters(model):
         yield val
 
 
@@ -69,10 +86,14 @@ def init_parameters(model: torch.nn.Module):
 
     modules = model.named_modules()
     for module_prefix, module in modules:
+        prefix = module_prefix + "." if module_prefix else ""
         if isinstance(module, Block):
-            module.init_parameters()
+            module.init_parameters(prefix)
         else:
-            init_distributed_parameter(iterate_parameters(module))
+            named = list(iterate_named_parameters(module, prefix))
+            init_distributed_parameter(
+                [val for _, val in named], [name for name, _ in named]
+            )
 
     current_stream = torch.cuda.current_stream()
     config["load_stream"].wait_stream(current_stream)
@@ -20,6 +20,8 @@ class DistributedParameter(torch.nn.Parameter):
 
     **Note**: DistributedParameter must be on the CUDA device. It will transfer the data to device automatically when `__init__` called.
 
+    **Note**: If `data` is on the meta device, e.g. the module is built under ``with torch.device("meta")``, only the partition of this rank is allocated and left uninitialized, and a :class:`Block` takes it over without gathering it. Initialize it with :func:`bmtrain.init_parameters` or load a checkpoint.
+
     """
 
     _original_shape: torch.Size
@@ -67,7 +69,8 @@ class DistributedParameter(torch.nn.Parameter):
         cuda_tensor_size = max(end_of_partition - start_of_partition, 0)
 
         cuda_tensor.set_(cuda_storage, 0, (cuda_tensor_size,))
-        cuda_tensor.copy_(data.view(-1)[start_of_partition:end_of_partition])
+        if not data.is_meta:
+            cuda_tensor.copy_(data.view(-1)[start_of_partition:end_of_partition])
         ret = torch.Tensor._make_subclass(cls, cuda_tensor, requires_grad)
 
         setattr(ret, "_original_shape", original_shape)
@@ -75,6 +78,8 @@ class DistributedParameter(torch.nn.Parameter):
         setattr(ret, "_end_partition", end_of_partition)
         setattr(ret, "_init_method", init_method)
         setattr(ret, "_in_block", False)
+        # no values to keep, Block does not need to gather it
+        setattr(ret, "_from_meta", data.is_meta)
         setattr(ret, "_group", group if not tp_mode else "tp")
 
         setattr(ret, "_tp_mode", tp_mode)
@@ -0,0 +1,168 @@
+"""Element-wise initializers that every rank evaluates on its own partition only.
+
+Every element is a function of ``(seed, parameter name, element index)`` computed with a
+counter-based hash instead of a sequential random generator, so the initialized model is
+bit-identical with any number of ranks, ZeRO or tensor parallel layout, and no rank builds
+the full parameter.
+
+Examples:
+    >>> self.weight = bmt.DistributedParameter(
+    ...     torch.empty(out_features, in_features, device="meta"),
+    ...     init_method=bmt.partition_init.NormalInit(std=0.02),
+    ... )
+"""
+import math
+import hashlib
+import torch
+
+from .global_var import config
+
+_MASK = 0xFFFFFFFF
+# elements generated at a time, bounds the int64 temporaries
+_CHUNK = 1 << 22
+
+
+def _mix(x):
+    # a 32-bit integer finalizer, the products wrap around in int64 and only the low bits are kept
+    x = x ^ (x >> 16)
+    x = (x * 0x7FEB352D) & _MASK
+    x = x ^ (x >> 15)
+    x = (x * 0x846CA68B) & _MASK
+    return x ^ (x >> 16)
+
+
+def _key(seed, name):
+    digest = hashlib.blake2b("{}:{}".format(seed, name).encode("utf-8"), digest_size=12).digest()
+    return [int.from_bytes(digest[i : i + 4], "little") for i in (0, 4, 8)]
+
+
+def _random_bits(index, key, stream):
+    """32 random bits of every element index, ``stream`` selects independent sequences."""
+    x = _mix((index & _MASK) ^ key[0])
+    x = _mix(x ^ (index >> 32) ^ key[1])
+    return _mix(x ^ ((key[2] + stream * 0x9E3779B9) & _MASK))
+
+
+def _uniform(index, key, stream):
+    # 24 bits are exact in float32, the result is in (0, 1)
+    return ((_random_bits(index, key, stream) >> 8).float() + 0.5) / (1 << 24)
+
+
+def _global_index(param, st, ed, device):
+    """Indices in the full parameter of the elements ``[st, ed)`` of the flat local one."""
+    index = torch.arange(st, ed, dtype=torch.int64, device=device)
+    if getattr(param, "_tp_mode", False) and param._tp_split_dim >= 0 and config["tp_size"] > 1:
+        shape = param._original_shape
+        local = 1
+        for x in shape[param._tp_split_dim :]:
+            local *= x
+        # the rows of the split dim of this rank are at tp_id within every outer row
+        index = (index // local) * local * config["tp_size"] + config["topology"].tp_id * local + index % local
+    return index
+
+
+class ElementwiseInit:
+    """Base of the initializers of this module.
+
+    It can be used as the ``init_method`` of a :class:`bmtrain.DistributedParameter`, then
+    :func:`bmtrain.init_parameters` only computes the partition of every rank. Called on a
+    tensor, it fills the whole tensor like the initializers of ``torch.nn.init``.
+
+    Args:
+        seed (int, optional): The seed, default the one of ``init_distributed``.
+    """
+
+    def __init__(self, seed=None):
+        self.seed = seed
+
+    def generate(self, index: torch.Tensor, key) -> torch.Tensor:
+        """Returns the float32 values of the elements at ``index``."""
+        raise NotImplementedError
+
+    def fill_(self, out: torch.Tensor, name: str, param=None, start: int = 0):
+        """Fills the flat ``out`` with the elements ``[start, start + out.numel())`` of the local
+        (tensor parallel split) parameter ``param`` named ``name``."""
+        seed = self.seed if self.seed is not None else config.get("seed", 0)
+        key = _key(seed, name)
+        with torch.no_grad():
+            for st in range(0, out.numel(), _CHUNK):
+                ed = min(st + _CHUNK, out.numel())
+                if param is None:
+                    index = torch.arange(start + st, start + ed, dtype=torch.int64, device=out.device)
+                else:
+                    index = _global_index(param, start + st, start + ed, out.device)
+                out[st:ed] = self.generate(index, key)
+        return out
+
+    def __call__(self, tensor: torch.Tensor):
+        flat = tensor.view(-1) if tensor.is_contiguous() else torch.empty(tensor.numel(), dtype=tensor.dtype, device=tensor.device)
+        self.fill_(flat, "")
+        if flat.data_ptr() != tensor.data_ptr():
+            with torch.no_grad():
+                tensor.copy_(flat.view(tensor.shape))
+        return tensor
+
+
+class NormalInit(ElementwiseInit):
+    """Normal distribution, by the Box-Muller transform of two uniform streams.
+
+    Args:
+        mean (float): The mean.
+        std (float): The standard deviation.
+        seed (int, optional): The seed, default the one of ``init_distributed``.
+    """
+
+    def __init__(self, mean: float = 0.0, std: float = 1.0, seed=None):
+        super().__init__(seed)
+        self.mean = mean
+        self.std = std
+
+    def generate(self, index, key):
+        u1 = _uniform(index, key, 0)
+        u2 = _uniform(index, key, 1)
+        z = torch.sqrt(-2.0 * torch.log(u1)) * torch.cos((2.0 * math.pi) * u2)
+        return z * self.std + self.mean
+
+
+class UniformInit(ElementwiseInit):
+    """Uniform distribution on ``(a, b)``.
+
+    Args:
+        a (float): The lower bound.
+        b (float): The upper bound.
+        seed (int, optional): The seed, default the one of ``init_distributed``.
+    """
+
+    def __init__(self, a: float = 0.0, b: float = 1.0, seed=None):
+        super().__init__(seed)
+        self.a = a
+        self.b = b
+
+    def generate(self, index, key):
+        return _uniform(index, key, 0) * (self.b - self.a) + self.a
+
+
+class ConstantInit(ElementwiseInit):
+    """Fills every element with ``value``.
+
+    Args:
+        value (float): The value.
+    """
+
+    def __init__(self, value: float = 0.0):
+        super().__init__()
+        self.value = value
+
+    def generate(self, index, key):
+        return torch.full(index.shape, self.value, dtype=torch.float32, device=index.device)
+
+
+def zeros_init() -> ConstantInit:
+    """Fills the parameter with zeros."""
+    return ConstantInit(0.0)
+
+
+def scaled_normal_init(std: float, num_layers: int, mean: float = 0.0, seed=None) -> NormalInit:
+    """Normal distribution with the standard deviation scaled by ``1 / sqrt(2 * num_layers)``,
+    used for the output projections of residual blocks."""
+    return NormalInit(mean, std / math.sqrt(2.0 * num_layers), seed)
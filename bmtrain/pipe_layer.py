@@ -12,6 +12,7 @@ from .zero_context import (
         ZeroContext
 )
 from . import debug
+from .memory_tracer import get_tracer, PIPELINE_ACTIVATIONS
 from .block_layer import Block, round_up, _get_param_kw, _block_wrapper
 
 class PipePreFunction(torch.autograd.Function):
@@ -132,11 +133,19 @@ class StagePreFunction(torch.autograd.Function):
         if not ctx.is_first_stage:
             input = recv_activations(stage_id - 1, config['pipe_comm'])
             input.requires_grad_()
+            tracer = get_tracer()
+            if tracer is not None:
+                tracer.alloc((id(ctx), PIPELINE_ACTIVATIONS), PIPELINE_ACTIVATIONS, input.numel() * input.element_size(),
+                             "stage{}".format(stage_id), tracer.pipe_micro % config['micros'])
+                tracer.pipe_micro += 1
             return input 
         return input
         
     @staticmethod
     def backward(ctx, grad_outputs):
+        tracer = get_tracer()
+        if tracer is not None:
+            tracer.free((id(ctx), PIPELINE_ACTIVATIONS))
         if not ctx.is_first_stage:
             send_data = grad_outputs[0] if isinstance(grad_outputs, tuple) else grad_outputs 
             current_stream = torch.cuda.current_stream()
@@ -239,11 +248,19 @@ class PipelineTransformerBlockList(torch.nn.Module):
         outputs = []
         hidden_states = []
 
+        inspecting = debug.get("_inspect_tensor", False)
+        if inspecting:
+            # streaming inspect_tensor merges the tensors of the micro-batches
+            forward_id = debug.get("_inspect_pipe_forward", 0) + 1
+            debug.set("_inspect_pipe_forward", forward_id)
+
         for micro_idx, (hidden_state, arg) in enumerate(zip(hidden_state_list, args_list)):
             micro_hidden_states = []
 
             hidden_state = StagePreFunction.apply(hidden_state, self.stage_id)
 
+            if inspecting:
+                debug.set("_inspect_pipe_micro", (forward_id, self.stage_id, micro_idx))
             for idx,layer_id in enumerate(self.layer_ids):
                 self._modules[str(layer_id)]._micro_idx = micro_idx
                 if return_hidden_states:
@@ -254,6 +271,8 @@ class PipelineTransformerBlockList(torch.nn.Module):
             outputs.append(hidden_state)
             if return_hidden_states:
                 hidden_states.append(torch.stack(micro_hidden_states, dim=0))
+        if inspecting:
+            debug.clear("_inspect_pipe_micro")
 
         last_hidden = torch.cat(outputs, dim=0)
         last_hidden_shape = last_hidden.shape
@@ -0,0 +1,269 @@
+"""Step-level profiler of Blocks, collectives and optimizer phases.
+
+Examples:
+    >>> with bmt.profile(every=10, path="trace") as prof:
+    ...     for step in range(100):
+    ...         loss = model(...)
+    ...         optim_manager.backward(loss)
+    ...         optim_manager.step()
+    ...         prof.step()
+
+Every rank writes ``trace/trace_rank{rank}.json``, which can be opened in ``chrome://tracing``
+or Perfetto, and rank 0 writes and prints the summary of all ranks.
+"""
+import os
+import json
+import time
+import contextlib
+import torch
+from typing import Optional
+
+from .global_var import config
+from .utils import print_dict, ActiveInstance, NULL_CONTEXT
+
+_profiler = ActiveInstance("profile")
+
+COMPUTE = "compute"
+COMM = "comm"
+OPTIMIZER = "optimizer"
+
+
+def _stream_name(stream):
+    for name in ["calc_stream", "load_stream", "tp_comm_stream", "pp_comm_stream"]:
+        if name in config and config[name] == stream:
+            return name
+    return "stream{}".format(stream.stream_id)
+
+
+class _Span:
+    __slots__ = ("name", "cat", "stream", "tid", "start", "end", "cpu_start", "cpu_end")
+
+    def __init__(self, name, cat, stream, gpu):
+        self.name = name
+        self.cat = cat
+        self.start = self.end = self.cpu_end = None
+        if gpu:
+            self.stream = stream if stream is not None else torch.cuda.current_stream()
+            self.tid = _stream_name(self.stream)
+            self.start = torch.cuda.Event(enable_timing=True)
+            self.start.record(self.stream)
+        else:
+            self.stream = None
+            self.tid = "cpu"
+        self.cpu_start = time.perf_counter()
+
+    def finish(self):
+        if self.start is not None:
+            self.end = torch.cuda.Event(enable_timing=True)
+            self.end.record(self.stream)
+        self.cpu_end = time.perf_counter()
+
+
+class _Record:
+    __slots__ = ("prof", "name", "cat", "stream", "gpu", "span")
+
+    def __init__(self, prof, name, cat, stream, gpu):
+        self.prof = prof
+        self.name = name
+        self.cat = cat
+        self.stream = stream
+        self.gpu = gpu
+
+    def __enter__(self):
+        self.span = self.prof.start(self.name, self.cat, self.stream, self.gpu)
+
+    def __exit__(self, *args):
+        self.prof.end(self.span)
+
+
+def _union(intervals):
+    merged = []
+    for st, ed in sorted(intervals):
+        if merged and st <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], ed)
+        else:
+            merged.append([st, ed])
+    return merged
+
+
+def _length(intervals):
+    return sum(ed - st for st, ed in intervals)
+
+
+def _intersection(a, b):
+    ret, i, j = 0.0, 0, 0
+    while i < len(a) and j < len(b):
+        st, ed = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if st < ed:
+            ret += ed - st
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return ret
+
+
+class Profiler:
+    """Records the timed spans of the sampled steps, see :func:`profile`.
+
+    GPU spans are timed with CUDA events on the stream they run on, and only resolved at the
+    end of a sampled step, CPU spans with the wall clock.
+
+    Args:
+        every (int): Record every ``every``-th step.
+    """
+
+    def __init__(self, every: int = 1):
+        self.every = every
+        self.step_idx = 0
+        self._spans = []
+        self._events = []
+        self._t0 = time.perf_counter()
+        self._ref = None
+        self._ref_wall = None
+
+    @property
+    def recording(self) -> bool:
+        return self.step_idx % self.every == 0
+
+    def _begin_step(self):
+        if self.recording:
+            self._ref = torch.cuda.Event(enable_timing=True)
+            self._ref.record(config["calc_stream"])
+            self._ref_wall = time.perf_counter()
+
+    def start(self, name: str, cat: str, stream=None, gpu: bool = True) -> _Span:
+        """Starts a span on ``stream``, default the current stream, or on the CPU."""
+        return _Span(name, cat, stream, gpu)
+
+    def end(self, span: _Span):
+        """Ends a span returned by :meth:`start`."""
+        span.finish()
+        self._spans.append(span)
+
+    def step(self):
+        """Marks the end of a training step, it synchronizes the device after a sampled step."""
+        if self.recording and len(self._spans) > 0:
+            torch.cuda.synchronize()
+            base = (self._ref_wall - self._t0) * 1e6
+            for span in self._spans:
+                if span.start is not None:
+                    ts = base + self._ref.elapsed_time(span.start) * 1e3
+                    dur = span.start.elapsed_time(span.end) * 1e3
+                else:
+                    ts = base + (span.cpu_start - self._ref_wall) * 1e6
+                    dur = (span.cpu_end - span.cpu_start) * 1e6
+                self._events.append((span.name, span.cat, span.tid, ts, dur, self.step_idx))
+        self._spans = []
+        self.step_idx += 1
+        self._begin_step()
+
+    def chrome_trace(self) -> dict:
+        """The recorded spans of this rank in the Chrome trace event format."""
+        rank = config["rank"]
+        events = [
+            {"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": rank, "tid": tid, "args": {"step": step}}
+            for name, cat, tid, ts, dur, step in self._events
+        ]
+        events.append({"name": "process_name", "ph": "M", "pid": rank, "args": {"name": "rank {}".format(rank)}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def _rank_summary(self):
+        steps = {}
+        for name, cat, tid, ts, dur, step in self._events:
+            steps.setdefault(step, {}).setdefault(cat, []).append((ts, ts + dur))
+        ret = {"steps": len(steps), "step_time": 0.0, COMPUTE: 0.0, COMM: 0.0, "exposed_comm": 0.0, OPTIMIZER: 0.0}
+        for spans in steps.values():
+            everything = [it for v in spans.values() for it in v]
+            compute = _union(spans.get(COMPUTE, []))
+            comm = _union(spans.get(COMM, []))
+            ret["step_time"] += max(ed for _, ed in everything) - min(st for st, _ in everything)
+            ret[COMPUTE] += _length(compute)
+            ret[COMM] += _length(comm)
+            ret["exposed_comm"] += _length(comm) - _intersection(comm, compute)
+            ret[OPTIMIZER] += _length(_union(spans.get(OPTIMIZER, [])))
+        for key in ret:
+            if key != "steps" and len(steps) > 0:
+                # per step, in milliseconds
+                ret[key] /= len(steps) * 1e3
+        return ret
+
+    def summary(self) -> Optional[dict]:
+        """Gathers the time per step of every category on rank 0, a collective operation.
+
+        ``exposed_comm`` is the communication time that no compute overlaps, and
+        ``overlap_efficiency`` the fraction of the communication time that is hidden.
+
+        Returns:
+            dict: the mean over the ranks, and the slowest rank of every value, ``None`` on the other ranks.
+        """
+        from .distributed.object_ops import gather_objects
+
+        summaries = gather_objects(self._rank_summary())
+        if summaries is None:
+            return None
+        ret = {}
+        for key in summaries[0]:
+            values = [s[key] for s in summaries]
+            ret[key] = sum(values) / len(values)
+            if key != "steps":
+                ret["max_" + key] = max(values)
+        ret["overlap_efficiency"] = 1.0 - ret["exposed_comm"] / ret[COMM] if ret[COMM] > 0 else 1.0
+        return ret
+
+    def export(self, path: str):
+        """Writes ``trace_rank{rank}.json`` of every rank and ``summary.json`` of rank 0 to the
+        directory ``path``, a collective operation."""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "trace_rank{:05d}.json".format(config["rank"])), "w") as f:
+            json.dump(self.chrome_trace(), f)
+        summary = self.summary()
+        if summary is not None:
+            with open(os.path.join(path, "summary.json"), "w") as f:
+                json.dump(summary, f, indent=2)
+            print_dict("Profile", {k: "%.3f" % v for k, v in summary.items()})
+
+
+def record(name: str, cat: str, stream=None, gpu: bool = True):
+    """A context that records a span when profiling a sampled step, else it does nothing."""
+    prof = _profiler.value
+    if prof is None or not prof.recording:
+        return NULL_CONTEXT
+    return _Record(prof, name, cat, stream, gpu)
+
+
+def start_span(name: str, cat: str, stream=None, gpu: bool = True) -> Optional[_Span]:
+    """Starts a span that ends in another function, ``None`` when not recording."""
+    prof = _profiler.value
+    if prof is None or not prof.recording:
+        return None
+    return prof.start(name, cat, stream, gpu)
+
+
+def end_span(span: Optional[_Span]):
+    """Ends a span of :func:`start_span`."""
+    prof = _profiler.value
+    if span is not None and prof is not None:
+        prof.end(span)
+
+
+@contextlib.contextmanager
+def profile(every: int = 1, path: Optional[str] = None):
+    """Profiles the steps run in the context.
+
+    It records the parameter gathers and gradient reduce-scatters of Blocks, the forward,
+    backward and recomputation of Blocks, the tensor parallel and pipeline collectives and the
+    optimizer steps, on the stream each of them runs on. Call ``step()`` of the returned
+    :class:`Profiler` at the end of every step, only every ``every``-th step is recorded.
+
+    Args:
+        every (int): Record every ``every``-th step.
+        path (str, optional): Directory the traces and the summary are exported to when the
+            context exits, on all ranks.
+    """
+    prof = Profiler(every)
+    with _profiler.activate(prof):
+        prof._begin_step()
+        yield prof
+    if path is not None:
+        prof.export(path)
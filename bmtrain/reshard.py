@@ -0,0 +1,288 @@
+"""Offline conversion of checkpoints between parallel layouts, without GPUs.
+
+Examples::
+
+    # a sharded checkpoint for 2-way tensor parallel, in 8 files
+    python -m bmtrain.reshard ckpt/step_1000 ckpt/step_1000_tp2 --tp-size 2 --num-shards 8
+
+    # merge the tensor parallel pieces into one file of whole tensors for inference
+    python -m bmtrain.reshard ckpt/step_1000 model.bin --format full --dtype float16
+
+The source is a directory written by :func:`bmtrain.save_sharded`, incremental ones
+included, or a single file written by :func:`bmtrain.save`. Every tensor is streamed piece by piece, so the memory in use is
+bounded by the largest piece, and the shards of the target are written by a pool of
+worker processes.
+"""
+import os
+import re
+import json
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import torch
+
+from .mmap_store import MmapStateDict, MmapStateDictWriter, is_mmap_file
+from .sharded_store import (
+    INDEX_NAME,
+    _open_reader,
+    _load_entry,
+    _shard_name,
+    _write_index,
+)
+from .utils import check_torch_version
+
+
+class _FlatStateDict:
+    def __init__(self, state_dict):
+        self._state_dict = state_dict
+
+    def __getitem__(self, key):
+        return self._state_dict[key].reshape(-1)
+
+
+def _open_source(path):
+    """Returns the index of the tensors in ``path`` and a reader of its pieces."""
+    if os.path.isdir(path):
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            index = json.load(f)
+        return index["tensors"], _open_reader(path, index)
+
+    if is_mmap_file(path):
+        state_dict = MmapStateDict(path)
+    else:
+        kwargs = {"map_location": "cpu"}
+        if check_torch_version("2.1.0") >= 0:
+            kwargs["mmap"] = True
+        state_dict = torch.load(path, **kwargs)
+    # a file of whole tensors is a sharded checkpoint with one piece per tensor
+    tensors = OrderedDict()
+    for key, value in state_dict.items():
+        tensors[key] = {
+            "shape": list(value.shape),
+            "dtype": str(value.dtype),
+            "split_dim": -1,
+            "tp_size": 1,
+            "pieces": [[0, 0, 0, value.numel()]],
+        }
+    return tensors, {0: _FlatStateDict(state_dict)}
+
+
+def _numel(shape):
+    ret = 1
+    for x in shape:
+        ret *= x
+    return ret
+
+
+def _target_name(key, renames):
+    for pattern, repl in renames:
+        key = re.sub(pattern, repl, key)
+    return key
+
+
+def _target_split_dim(key, info, split_rules, tp_size):
+    split_dim = info["split_dim"]
+    for pattern, dim in split_rules:
+        if re.search(pattern, key):
+            split_dim = dim
+    if tp_size == 1 or split_dim < 0:
+        return -1
+    if info["shape"][split_dim] % tp_size != 0:
+        raise ValueError(
+            "dim {} of {} with shape {} can not be split into {} pieces".format(
+                split_dim, key, info["shape"], tp_size
+            )
+        )
+    return split_dim
+
+
+def plan_sharded(tensors, tp_size, num_shards, renames=(), split_rules=()):
+    """Returns the index of the target sharded layout, and the source key of every tensor.
+
+    The tensor parallel pieces of rank ``r`` are the ones of ``tp_rank = r % tp_size``, as in
+    :class:`bmtrain.init.topology`, and each of them is split evenly over the
+    ``num_shards // tp_size`` files of its tensor parallel rank.
+    """
+    if num_shards % tp_size != 0:
+        raise ValueError("num_shards must be a multiple of tp_size")
+    zero_size = num_shards // tp_size
+    index = {"world_size": num_shards, "tp_size": tp_size, "pipe_size": 1, "tensors": {}}
+    sources = {}
+    for key, info in tensors.items():
+        name = _target_name(key, renames)
+        split_dim = _target_split_dim(key, info, split_rules, tp_size)
+        pieces = []
+        if split_dim >= 0:
+            local = _numel(info["shape"]) // tp_size
+            for t in range(tp_size):
+                size = (local + zero_size - 1) // zero_size
+                for z in range(zero_size):
+                    st, ed = z * size, min((z + 1) * size, local)
+                    if st < ed:
+                        pieces.append([z * tp_size + t, t, st, ed])
+        else:
+            numel = _numel(info["shape"])
+            size = (numel + num_shards - 1) // num_shards
+            for r in range(num_shards):
+                st, ed = r * size, min((r + 1) * size, numel)
+                if st < ed:
+                    pieces.append([r, 0, st, ed])
+        index["tensors"][name] = {
+            "shape": info["shape"],
+            "dtype": info["dtype"],
+            "split_dim": split_dim,
+            "tp_size": tp_size if split_dim >= 0 else 1,
+            "pieces": pieces,
+        }
+        sources[name] = key
+    return index, sources
+
+
+def _write_shard(src, dst, rank, index, sources, dtype):
+    tensors, reader = _open_source(src)
+    writer = MmapStateDictWriter(os.path.join(dst, _shard_name(rank)))
+    for name, info in index["tensors"].items():
+        key = sources[name]
+        for r, tp_rank, st, ed in info["pieces"]:
+            if r != rank:
+                continue
+            it = {
+                "key": key,
+                "split_dim": info["split_dim"],
+                "tp_size": info["tp_size"],
+                "tp_rank": tp_rank,
+                "begin": st,
+                "end": ed,
+            }
+            data = _load_entry(reader, it, tensors[key])
+            writer.write(name, data.to(dtype) if dtype is not None else data)
+    writer.close()
+
+
+def reshard(
+    src: str,
+    dst: str,
+    tp_size: int = 1,
+    num_shards: int = 1,
+    renames=(),
+    split_rules=(),
+    dtype=None,
+    num_workers=None,
+):
+    """Converts the checkpoint ``src`` to a sharded checkpoint ``dst`` for ``tp_size``-way
+    tensor parallel, which :func:`bmtrain.load_sharded` loads with any ZeRO and pipeline layout.
+
+    Args:
+        src (str): A directory written by :func:`bmtrain.save_sharded`, or a file written by :func:`bmtrain.save`.
+        dst (str): The directory of the target checkpoint.
+        tp_size (int): Tensor parallel size of the target.
+        num_shards (int): Number of files of the target, a multiple of ``tp_size``.
+        renames: ``(pattern, repl)`` pairs applied to the keys with ``re.sub`` in order.
+        split_rules: ``(pattern, dim)`` pairs that set the tensor parallel split dim of matching keys, for sources without it.
+        dtype (torch.dtype, optional): Cast the tensors to this dtype.
+        num_workers (int, optional): Number of writer processes, default ``min(num_shards, cpu_count)``.
+    """
+    tensors, _ = _open_source(src)
+    index, sources = plan_sharded(tensors, tp_size, num_shards, renames, split_rules)
+    if dtype is not None:
+        for info in index["tensors"].values():
+            info["dtype"] = str(dtype)
+    os.makedirs(dst, exist_ok=True)
+    if num_workers is None:
+        num_workers = min(num_shards, os.cpu_count() or 1)
+    with ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        futures = [
+            pool.submit(_write_shard, src, dst, rank, index, sources, dtype)
+            for rank in range(num_shards)
+        ]
+        for future in futures:
+            future.result()
+    _write_index(index, dst)
+
+
+def export_full(src: str, dst: str, renames=(), dtype=None, file_format="mmap"):
+    """Merges the checkpoint ``src`` into whole tensors, written to the file ``dst``.
+
+    Args:
+        src (str): A directory written by :func:`bmtrain.save_sharded`, or a file written by :func:`bmtrain.save`.
+        dst (str): The target file.
+        renames: ``(pattern, repl)`` pairs applied to the keys with ``re.sub`` in order.
+        dtype (torch.dtype, optional): Cast the tensors to this dtype.
+        file_format (str): ``"mmap"`` streams the tensors to the layout read by :class:`bmtrain.mmap_store.MmapStateDict`, ``"torch"`` writes a ``torch.save`` file, which needs the whole model in memory.
+    """
+    tensors, reader = _open_source(src)
+    writer = MmapStateDictWriter(dst) if file_format == "mmap" else None
+    state_dict = OrderedDict()
+    for key, info in tensors.items():
+        it = {
+            "key": key,
+            "split_dim": -1,
+            "tp_size": 1,
+            "tp_rank": 0,
+            "begin": 0,
+            "end": _numel(info["shape"]),
+        }
+        data = _load_entry(reader, it, info).view(info["shape"])
+        if dtype is not None:
+            data = data.to(dtype)
+        name = _target_name(key, renames)
+        if writer is not None:
+            writer.write(name, data)
+        else:
+            state_dict[name] = data.clone()
+    if writer is not None:
+        writer.close()
+    else:
+        torch.save(state_dict, dst)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bmtrain.reshard",
+        description="Convert a BMTrain checkpoint to another parallel layout on CPU.",
+    )
+    parser.add_argument("src", help="sharded checkpoint directory or checkpoint file")
+    parser.add_argument("dst", help="target directory, or target file with --format full/torch")
+    parser.add_argument("--format", choices=["sharded", "full", "torch"], default="sharded")
+    parser.add_argument("--tp-size", type=int, default=1)
+    parser.add_argument("--num-shards", type=int, default=None, help="default: tp-size")
+    parser.add_argument(
+        "--rename", nargs=2, action="append", default=[], metavar=("PATTERN", "REPL"),
+        help="rename keys with re.sub, can be repeated",
+    )
+    parser.add_argument(
+        "--split-dim", nargs=2, action="append", default=[], metavar=("PATTERN", "DIM"),
+        help="tensor parallel split dim of matching keys, can be repeated",
+    )
+    parser.add_argument("--dtype", default=None, help="e.g. float16 or bfloat16")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    dtype = getattr(torch, args.dtype) if args.dtype is not None else None
+    renames = [tuple(it) for it in args.rename]
+    if args.format == "sharded":
+        reshard(
+            args.src,
+            args.dst,
+            tp_size=args.tp_size,
+            num_shards=args.num_shards if args.num_shards is not None else args.tp_size,
+            renames=renames,
+            split_rules=[(pattern, int(dim)) for pattern, dim in args.split_dim],
+            dtype=dtype,
+            num_workers=args.workers,
+        )
+    else:
+        export_full(
+            args.src,
+            args.dst,
+            renames=renames,
+            dtype=dtype,
+            file_format="mmap" if args.format == "full" else "torch",
+        )
+
+
+if __name__ == "__main__":
+    main()
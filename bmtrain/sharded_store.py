@@ -0,0 +1,365 @@
+import os
+import json
+import torch
+from typing import Dict, List, Optional
+
+from .global_var import config
+from .block_layer import Block
+from .pipe_layer import PipelineTransformerBlockList
+from .parameter import DistributedParameter
+from .distributed.object_ops import gather_objects
+from .utils import check_torch_version
+from .mmap_store import is_mmap_file, MmapStateDict, save_mmap_state_dict
+import bmtrain as bmt
+
+INDEX_NAME = "index.json"
+
+
+def _shard_name(rank):
+    return "model_rank{:05d}.pt".format(rank)
+
+
+class _ShardReader:
+    """Loads shard files of a checkpoint directory on demand and keeps them open."""
+
+    def __init__(self, path, shard_name):
+        self.path = path
+        self.shard_name = shard_name
+        self._cache = {}
+
+    def __getitem__(self, rank):
+        if rank not in self._cache:
+            file_name = os.path.join(self.path, self.shard_name(rank))
+            if is_mmap_file(file_name):
+                self._cache[rank] = MmapStateDict(file_name, read_ahead=False)
+                return self._cache[rank]
+            kwargs = {"map_location": "cpu"}
+            if check_torch_version("2.1.0") >= 0:
+                # only the pages of the slices that are used are read from disk
+                kwargs["mmap"] = True
+            self._cache[rank] = torch.load(file_name, **kwargs)
+        return self._cache[rank]
+
+
+def _open_reader(path, index):
+    """Returns the reader of the shards of the checkpoint ``path`` with ``index``."""
+    if "chain" in index:
+        from .incremental_store import _DeltaReader
+
+        return _DeltaReader(path, index)
+    return _ShardReader(path, _shard_name)
+
+
+def _entry(key, param, local_shape, target, begin, end):
+    tp_split = getattr(param, "_tp_mode", False) and param._tp_split_dim >= 0
+    return {
+        "key": key,
+        "shape": list(param._tp_original_shape if tp_split else local_shape),
+        "dtype": str(param.dtype),
+        "split_dim": param._tp_split_dim if tp_split else -1,
+        "tp_size": config["tp_size"] if tp_split else 1,
+        "tp_rank": config["topology"].tp_id if tp_split else 0,
+        "begin": begin,
+        "end": end,
+        "target": target,
+    }
+
+
+def _buffer_entries(module, prefix, out):
+    for name, buf in module._buffers.items():
+        if buf is not None and name not in module._non_persistent_buffers_set:
+            out.append(_entry(prefix + name, buf, buf.shape, buf.data.view(-1), 0, buf.numel()))
+
+
+def _local_entries(module, replicated, prefix="", out=None) -> List[Dict]:
+    """Returns the pieces of the model held by this rank, with their ranges in the flat
+    local (tensor parallel split) tensor and the views of the local storage they occupy.
+
+    Tensors that are not partitioned are only listed if ``replicated`` is True.
+    """
+    if out is None:
+        out = []
+    if isinstance(module, PipelineTransformerBlockList):
+        for name, sub in module._modules.items():
+            if int(name) in module.layer_ids:
+                _local_entries(sub, replicated, prefix + name + ".", out)
+        return out
+    if isinstance(module, Block):
+        for it in module._param_info:
+            kw_name = it["kw_name"]
+            storage_st = module._storage_info[kw_name]["begin"]
+            storage_end = module._storage_info[kw_name]["end"]
+            st = max(storage_st, it["offset"])
+            ed = min(storage_end, it["offset"] + it["size"])
+            if st >= ed:
+                continue
+            target = module._storage_params[kw_name].data[st - storage_st : ed - storage_st]
+            out.append(
+                _entry(
+                    prefix + it["name"],
+                    it["parameter"],
+                    it["shape"],
+                    target,
+                    st - it["offset"],
+                    ed - it["offset"],
+                )
+            )
+        if replicated:
+            for name, sub in module._module.named_modules(prefix=prefix[:-1]):
+                _buffer_entries(sub, name + "." if name else "", out)
+        return out
+
+    for name, param in module._parameters.items():
+        if param is None:
+            continue
+        if isinstance(param, DistributedParameter):
+            if param._end_partition > param._start_partition:
+                out.append(
+                    _entry(
+                        prefix + name,
+                        param,
+                        param._original_shape,
+                        param.data,
+                        param._start_partition,
+                        param._end_partition,
+                    )
+                )
+        elif replicated:
+            out.append(_entry(prefix + name, param, param.shape, param.data.view(-1), 0, param.numel()))
+    if replicated:
+        _buffer_entries(module, prefix, out)
+    for name, sub in module._modules.items():
+        if sub is not None:
+            _local_entries(sub, replicated, prefix + name + ".", out)
+    return out
+
+
+def _build_index(entries):
+    """Gathers the pieces of all ranks, returns the index on rank 0 and None elsewhere."""
+    metas = gather_objects(
+        [{k: v for k, v in it.items() if k != "target"} for it in entries]
+    )
+    if metas is None:
+        return None
+    tensors = {}
+    for rank, rank_entries in enumerate(metas):
+        for it in rank_entries:
+            info = tensors.setdefault(
+                it["key"],
+                {
+                    "shape": it["shape"],
+                    "dtype": it["dtype"],
+                    "split_dim": it["split_dim"],
+                    "tp_size": it["tp_size"],
+                    "pieces": [],
+                },
+            )
+            info["pieces"].append([rank, it["tp_rank"], it["begin"], it["end"]])
+    return {
+        "world_size": config["world_size"],
+        "tp_size": config["tp_size"],
+        "pipe_size": config["pipe_size"],
+        "tensors": tensors,
+    }
+
+
+def _write_index(index, path):
+    with open(os.path.join(path, INDEX_NAME), "w") as f:
+        json.dump(index, f)
+
+
+def save_sharded(
+    model: torch.nn.Module,
+    path: str,
+    non_blocking: bool = False,
+    incremental: bool = False,
+    compression: Optional[str] = None,
+):
+    """Saves the model to the directory ``path`` without gathering it.
+
+    Every rank writes the partitions it holds to its own file in parallel, and rank 0 writes
+    an index of the pieces that each file contains. Use :func:`load_sharded` to load it,
+    the layout of ZeRO, tensor and pipeline parallel can be different when loading.
+
+    Args:
+        model (torch.nn.Module): The model to be saved.
+        path (str): The directory of the checkpoint, created if it does not exist.
+        non_blocking (bool): Only copy the partitions to pinned host memory, and leave writing the files to a background process. See :class:`bmtrain.async_store.AsyncCheckpointer`.
+        incremental (bool): Only write the chunks that changed since the previous incremental save. See :class:`bmtrain.incremental_store.IncrementalCheckpointer`.
+        compression (Optional[str]): Write the shards in the format of :func:`bmtrain.mmap_store.save_mmap_state_dict`, compressed in chunks with this codec.
+
+    Returns:
+        Optional[concurrent.futures.Future]: with ``non_blocking``, a future that is done when the shard of this rank is written, the index is written by :meth:`bmtrain.async_store.AsyncCheckpointer.wait`.
+
+    Note:
+        A non-blocking checkpoint is only complete once its index is written by the next
+        non-blocking save, or by ``bmtrain.async_store.get_async_checkpointer().wait()``,
+        a collective operation. Call it on all ranks after the last save of a run.
+
+    Examples:
+        >>> bmtrain.save_sharded(model, "ckpt/step_1000")
+    """
+    if non_blocking and incremental:
+        raise ValueError("non_blocking and incremental saves can not be combined")
+    if incremental and compression is not None:
+        raise ValueError("incremental saves can not be compressed")
+    if incremental:
+        from .incremental_store import get_incremental_checkpointer
+
+        get_incremental_checkpointer().save(model, path)
+        return None
+    if non_blocking:
+        from .async_store import get_async_checkpointer
+
+        return get_async_checkpointer().save(model, path, compression)
+
+    torch.cuda.synchronize()
+    os.makedirs(path, exist_ok=True)
+    # tensors that are not partitioned are saved by the first rank of each pipeline stage
+    entries = _local_entries(model, config["topology"].pipe_idx == 0)
+    shard = {
+        it["key"]: it["target"].cpu() if it["target"].is_cuda else it["target"].clone()
+        for it in entries
+    }
+    if compression is not None:
+        save_mmap_state_dict(shard, os.path.join(path, _shard_name(config["rank"])), compression)
+    else:
+        torch.save(shard, os.path.join(path, _shard_name(config["rank"])))
+
+    index = _build_index(entries)
+    if index is not None:
+        _write_index(index, path)
+    bmt.synchronize()
+
+
+def _read_range(reader, key, info, tp_rank, begin, end):
+    """Reads ``[begin, end)`` of the flat local tensor of ``tp_rank`` from the old shards."""
+    pieces = sorted(
+        (p for p in info["pieces"] if info["tp_size"] == 1 or p[1] == tp_rank),
+        key=lambda p: p[2],
+    )
+    ret = []
+    cursor = begin
+    for rank, _, st, ed in pieces:
+        # replicated tensors are saved once per pipeline stage, only take what is not covered yet
+        lo, hi = max(cursor, st), min(end, ed)
+        if lo < hi:
+            ret.append(reader[rank][key][lo - st : hi - st])
+            cursor = hi
+        if cursor >= end:
+            break
+    if cursor < end:
+        raise RuntimeError(
+            "sharded checkpoint does not cover elements [{}, {}) of {}".format(cursor, end, key)
+        )
+    return torch.cat(ret) if len(ret) > 1 else ret[0]
+
+
+def _load_entry(reader, it, info):
+    shape = info["shape"]
+    if it["split_dim"] >= 0 and info["split_dim"] >= 0 and it["split_dim"] != info["split_dim"]:
+        raise RuntimeError(
+            "{} is split at dim {} in the checkpoint, but at dim {} in the model".format(
+                it["key"], info["split_dim"], it["split_dim"]
+            )
+        )
+    begin, end = it["begin"], it["end"]
+    old_tp, new_tp = info["tp_size"], it["tp_size"]
+    if old_tp == new_tp:
+        return _read_range(reader, it["key"], info, it["tp_rank"], begin, end)
+
+    # view both layouts as (outer, dim, inner) with the split dim in the middle
+    split_dim = max(it["split_dim"], info["split_dim"])
+    outer = 1
+    for x in shape[:split_dim]:
+        outer *= x
+    inner = 1
+    for x in shape[split_dim + 1 :]:
+        inner *= x
+    old_len, new_len = shape[split_dim] // old_tp, shape[split_dim] // new_tp
+    new_st = it["tp_rank"] * new_len
+
+    if outer == 1:
+        # rows of the split dim are contiguous on both sides, read the exact ranges
+        row_st, row_end = begin // inner, (end + inner - 1) // inner
+        buf = []
+        for t in range(old_tp):
+            lo = max(new_st + row_st, t * old_len)
+            hi = min(new_st + row_end, (t + 1) * old_len)
+            if lo < hi:
+                buf.append(
+                    _read_range(
+                        reader, it["key"], info, t, (lo - t * old_len) * inner, (hi - t * old_len) * inner
+                    )
+                )
+        buf = torch.cat(buf)
+        return buf[begin - row_st * inner : end - row_st * inner]
+
+    # every outer row interleaves the split dim, read the whole rows that are needed
+    row_size = new_len * inner
+    row_st, row_end = begin // row_size, (end + row_size - 1) // row_size
+    buf = None
+    for t in range(old_tp):
+        lo = max(new_st, t * old_len)
+        hi = min(new_st + new_len, (t + 1) * old_len)
+        if lo >= hi:
+            continue
+        old = _read_range(
+            reader, it["key"], info, t, row_st * old_len * inner, row_end * old_len * inner
+        ).view(row_end - row_st, old_len, inner)
+        if buf is None:
+            buf = torch.empty((row_end - row_st, new_len, inner), dtype=old.dtype)
+        buf[:, lo - new_st : hi - new_st, :] = old[:, lo - t * old_len : hi - t * old_len, :]
+    return buf.view(-1)[begin - row_st * row_size : end - row_st * row_size]
+
+
+def load_sharded(model: torch.nn.Module, path: str, strict: bool = True):
+    """Loads the model from a directory saved by :func:`save_sharded`.
+
+    Every rank reads only the pieces of the old shards that overlap its own partitions, so
+    the checkpoint can be loaded with a different ZeRO, tensor or pipeline parallel layout.
+
+    Args:
+        model (torch.nn.Module): The model to be loaded.
+        path (str): The directory of the checkpoint.
+        strict (bool): Whether to raise an error if a tensor of the model is missing in the checkpoint.
+
+    Returns:
+        List[str]: the keys of the model that are missing in the checkpoint.
+
+    Examples:
+        >>> bmtrain.load_sharded(model, "ckpt/step_1000")
+    """
+    with open(os.path.join(path, INDEX_NAME)) as f:
+        index = json.load(f)
+    reader = _open_reader(path, index)
+
+    missing_keys = []
+    error_msgs = []
+    entries = _local_entries(model, True)
+    with torch.no_grad():
+        for it in entries:
+            info = index["tensors"].get(it["key"], None)
+            if info is None:
+                missing_keys.append(it["key"])
+                continue
+            if info["shape"] != it["shape"]:
+                error_msgs.append(
+                    "size mismatch for {}: copying a param with shape {} from checkpoint, "
+                    "the shape in current model is {}.".format(it["key"], info["shape"], it["shape"])
+                )
+                continue
+            it["target"].copy_(_load_entry(reader, it, info))
+
+    if strict and len(missing_keys) > 0:
+        error_msgs.insert(
+            0, "Missing key(s) in sharded checkpoint: {}.".format(", ".join(missing_keys))
+        )
+    if len(error_msgs) > 0:
+        raise RuntimeError(
+            "Error(s) in loading sharded checkpoint for {}:\n\t{}".format(
+                model.__class__.__name__, "\n\t".join(error_msgs)
+            )
+        )
+    torch.cuda.synchronize()
+    return missing_keys
@@ -1,16 +1,19 @@
 from collections import OrderedDict
-from typing import Dict
+from typing import Dict, List, Optional
 import torch
 
 from .pipe_layer import PipelineTransformerBlockList
-from .block_layer import TransformerBlockList
 from .global_var import config
 from .block_layer import Block
+from .utils import round_up
 from . import nccl
 import io, pickle
 from typing import Mapping
 import threading
 import bmtrain as bmt
+from .mmap_store import save_mmap_state_dict, is_mmap_file, MmapStateDict, MmapStateDictWriter
+from .weight_stream import iter_layer_state_dicts
+from .distributed.object_ops import all_gather_objects, broadcast_object as _broadcast_object
 
 def _save_to_state_dict(model : torch.nn.Module, rank, destination, prefix):
     if isinstance(model, Block):
@@ -58,37 +61,43 @@ def _save_to_rank0(model : torch.nn.Module, destination=None, prefix=''):
         model._save_to_state_dict(destination, prefix, False)
     return destination
 
-def _save_to_infer_model(model : torch.nn.Module, infer_model, destination=None, prefix=''):
-    config['save_param_to_cpu'] = False
-    if destination is None:
-        destination = OrderedDict()
-        destination._metadata = OrderedDict()
-    destination._metadata[prefix[:-1]] = local_metadata = dict(version=model._version)
-    _save_to_state_dict(model, config['local_rank'], destination, prefix)
-    for name, module in model._modules.items():
-        if module is not None:
-            if isinstance(module, TransformerBlockList):
-                for local_name, local_module in module._modules.items():
-                    local_state_dict = _save_to_local_rank0(local_module, None, prefix + name + "." + local_name + '.')
-                    if config['local_rank'] == 0:
-                        infer_model.load_layer_state_dict(local_state_dict)
-            else:
-                _save_to_infer_model(module, infer_model, destination, prefix + name + '.')
-    for hook in model._state_dict_hooks.values():
-        hook_result = hook(model, destination, prefix, local_metadata)
-        if hook_result is not None:
-            destination = hook_result
+def _save_to_infer_model(model : torch.nn.Module, infer_model, prefix=''):
+    # every Block is handed off while the next one is gathered
+    for _, state_dict in iter_layer_state_dicts(model, prefix):
+        if config['local_rank'] == 0:
+            infer_model.load_layer_state_dict(state_dict)
 
-    if config['local_rank'] == 0:
-        infer_model.load_layer_state_dict(destination)
-        
+def _has_state_dict_hooks(model : torch.nn.Module):
+    return any(len(m._state_dict_hooks) > 0 for m in model.modules())
 
-def async_save_to_file(state_dict, file_path):
-    torch.save(state_dict, file_path)
+class _StreamingStateDict(OrderedDict):
+    """Destination of ``_save_to_rank0`` that writes every tensor as soon as it is gathered,
+    only the keys are kept, so it can not be used with state dict hooks."""
+
+    def __init__(self, writer : MmapStateDictWriter):
+        super().__init__()
+        self._metadata = OrderedDict()
+        self._writer = writer
+
+    def __setitem__(self, key, value):
+        self._writer.write(key, value)
+        super().__setitem__(key, None)
+
+def async_save_to_file(state_dict, file_path, mmap=False, compression=None):
+    if mmap:
+        save_mmap_state_dict(state_dict, file_path, compression)
+    else:
+        torch.save(state_dict, file_path)
     config['finish_save'] = True
     print("finish save state_dict to ", file_path) 
 
-def save(model : torch.nn.Module, file_name : str, non_blocking : bool=False):
+def save(
+    model : torch.nn.Module,
+    file_name : str,
+    non_blocking : bool=False,
+    mmap : bool=False,
+    compression : Optional[str]=None,
+):
     """Saves the model to the file.
 
     Similar to torch.save, but it used for distributed modules.
@@ -97,16 +106,35 @@ def save(model : torch.nn.Module, file_name : str, non_blocking : bool=False):
         model (torch.nn.Module): The model to be saved.
         file_name (str): The file name of the checkpoint.
         non_blocking (bool): Whether to asynchronously save state_dict to file
+        mmap (bool): Write the raw tensor bytes followed by a header of offsets instead of a torch.save file, which lets every rank map the file in `bmtrain.load` and read only its own partitions. Unless `non_blocking` is set or a module of the model has state dict hooks, the tensors are written as soon as they are gathered, so the whole model is never held in host memory.
+        compression (Optional[str]): Compress the tensors of a `mmap` checkpoint in chunks with this codec, see :class:`bmtrain.mmap_store.MmapStateDictWriter`.
 
 
     Examples:
         >>> bmtrain.save(model, "model.pt")
     """
+    if compression is not None and not mmap:
+        raise ValueError("compression is only supported with mmap=True")
     torch.cuda.synchronize()
+    if mmap and not non_blocking and not _has_state_dict_hooks(model):
+        # peak host memory is bounded by the largest gathered Block, not by the model
+        # hooks may read, replace or drop the written entries, they need the whole state dict
+        if config["rank"] == 0:
+            writer = MmapStateDictWriter(file_name, compression)
+            state_dict = _save_to_rank0(model, _StreamingStateDict(writer))
+            writer.close(state_dict._metadata)
+        else:
+            _save_to_rank0(model)
+        bmt.synchronize()
+        return
+
     state_dict = _save_to_rank0(model)
     if config["rank"] == 0:
         if non_blocking is False:
-            torch.save(state_dict, file_name)
+            if mmap:
+                save_mmap_state_dict(state_dict, file_name, compression)
+            else:
+                torch.save(state_dict, file_name)
         else:
             if 'finish_save' not in config:
                 config['finish_save'] = True
@@ -115,7 +143,7 @@ def save(model : torch.nn.Module, file_name : str, non_blocking : bool=False):
                 config['save_thread'].join()
 
             config['finish_save'] = False
-            config['save_thread'] = threading.Thread(target=async_save_to_file, args=(state_dict, file_name))
+            config['save_thread'] = threading.Thread(target=async_save_to_file, args=(state_dict, file_name, mmap, compression))
             config['save_thread'].start()
     bmt.synchronize()
 
@@ -134,82 +162,25 @@ DTYPE_LIST = [
 _pickler = pickle.Pickler
 _unpickler = pickle.Unpickler
 
+# metadata goes through the TCP store instead of NCCL, see bmtrain.distributed.object_ops
 def allgather_objects(obj):
-    if bmt.world_size() == 1:
-        return [obj]
-
-    with torch.no_grad():
-        data_bytes: bytes = pickle.dumps(obj)
-        data_length: int = len(data_bytes)
-
-        gpu_data_length = torch.tensor([data_length], device="cuda", dtype=torch.long)
-        gathered_length = bmt.distributed.all_gather(gpu_data_length).view(-1).cpu()
-        max_data_length = gathered_length.max().item()
-
-        gpu_data_bytes = torch.zeros(max_data_length, dtype=torch.uint8, device="cuda")
-        byte_storage = torch.ByteStorage.from_buffer(data_bytes)
-        gpu_data_bytes[:data_length] = torch.ByteTensor(byte_storage)
-
-        gathered_data = bmt.distributed.all_gather(gpu_data_bytes).cpu()
-
-        ret = []
-        for i in range(gathered_data.size(0)):
-            data_bytes = gathered_data[i, : gathered_length[i].item()].numpy().tobytes()
-            ret.append(pickle.loads(data_bytes))
-        return ret
+    return all_gather_objects(obj)
 
 def broadcast_object(obj, comm, src = 0):
-    if nccl.commRank(comm) == src:
-        f = io.BytesIO()
-        _pickler(f).dump(obj)
-        byte_storage = torch.ByteStorage.from_buffer(f.getvalue())
-        # Do not replace `torch.ByteTensor` or `torch.LongTensor` with torch.tensor and specifying dtype.
-        # Otherwise, it will casue 100X slowdown.
-        # See: https://github.com/pytorch/pytorch/issues/65696
-        byte_tensor = torch.ByteTensor(byte_storage).cuda()
-        local_size = torch.LongTensor([byte_tensor.numel()]).cuda()
-
-        nccl.broadcast(
-            local_size.storage(),
-            local_size.storage(),
-            src,
-            comm
-        )
-        nccl.broadcast(
-            byte_tensor.storage(),
-            byte_tensor.storage(),
-            src,
-            comm
-        )
-    else:
-        local_size = torch.LongTensor([0]).cuda()
-        nccl.broadcast(
-            local_size.storage(),
-            local_size.storage(),
-            src,
-            comm
-        )
-        byte_tensor_size = local_size[0].item()
-        byte_tensor = torch.empty(int(byte_tensor_size), dtype=torch.uint8, device="cuda")
-        nccl.broadcast(
-            byte_tensor.storage(),
-            byte_tensor.storage(),
-            src,
-            comm
-        )
-        buf = byte_tensor.cpu().numpy().tobytes()
-        obj = _unpickler(io.BytesIO(buf)).load()
-    return obj
-    
-# Must be a Mapping after pytorch 1.12.0
+    return _broadcast_object(obj, comm, src)
+
 class DistributedTensorWrapper:
-    def __init__(self, tensor, shape=None):
+    def __init__(self, tensor, shape=None, loader=None):
         self._dtype = tensor.dtype
         self._device = tensor.device
         self.shape = shape
         self.tensor = tensor
+        self._loader = loader
         
     def broadcast(self):
+        if self._loader is not None:
+            # the tensor is unpacked from a broadcasted bucket
+            return self._loader()
         output_param = torch.empty(self.shape, dtype=self._dtype, device="cuda")
         if config['rank'] == 0:
             input_param = self.tensor
@@ -247,75 +218,232 @@ class DistributedTensorWrapper:
 
             return getattr(self.tensor, name)
 
+BROADCAST_BUCKET_SIZE = 256 * 1024 * 1024
+# offsets of tensors in a bucket are aligned for every dtype
+_BUCKET_ALIGNMENT = 16
+
+def _load_order(model : torch.nn.Module):
+    """The keys ``model.load_state_dict`` requests, in order, without gathering the parameters."""
+    keys = []
+
+    def visit(module, prefix):
+        if isinstance(module, Block):
+            names = [it["name"] for it in module._param_info]
+            known = set(names)
+            inner = module._module
+            names += [name for name, _ in inner.named_parameters() if name not in known]
+            names += [name for name, _ in inner.named_buffers() if name not in known]
+            keys.extend(prefix + name for name in names)
+            return
+        for name, param in module._parameters.items():
+            if param is not None:
+                keys.append(prefix + name)
+        for name, buf in module._buffers.items():
+            if buf is not None and name not in module._non_persistent_buffers_set:
+                keys.append(prefix + name)
+        for name, child in module._modules.items():
+            if child is not None:
+                visit(child, prefix + name + ".")
+
+    visit(model, "")
+    return keys
+
+# Must be a Mapping after pytorch 1.12.0
 class DistributedStateDictWrapper(Mapping):
-    def __init__(self, state_dict : Dict) -> None:
+    """A state dict held by rank 0 that is broadcasted to all ranks while loading.
+
+    The keys, shapes and dtypes are broadcasted once. With ``bucket_size``, the tensors are
+    packed into flat buckets of about ``bucket_size`` bytes in ``key_order``, the order the
+    model requests them, which are broadcasted on the load stream one bucket ahead of the one
+    being unpacked. Keys that are not in ``key_order`` are not packed. A bucket is freed once
+    a later bucket is accessed, and a key of a freed bucket, or a key that is not packed, is
+    broadcasted on its own. Without ``bucket_size`` every tensor is broadcasted on its own.
+    """
+    def __init__(self, state_dict : Dict, bucket_size : Optional[int] = None, key_order : Optional[List[str]] = None) -> None:
         self._state_dict = state_dict
-        self._metadata = broadcast_object(getattr(state_dict, "_metadata", None), config["comm"])
-    
-    def __getitem__(self, key : str):
-        tmp_shape = torch.zeros(32, device="cuda", dtype=torch.int32)
         if config['rank'] == 0:
-            input_param : torch.Tensor = self._state_dict[key]
-            shape_list = torch.tensor(list(input_param.size()), device="cuda", dtype=torch.int32)
-            dtype_idx = DTYPE_LIST.index(input_param.dtype)
-            
-            assert dtype_idx != -1, "Unknown data type %s" % input_param.dtype
-
-            tmp_shape[0] = shape_list.size(0)
-            tmp_shape[1] = dtype_idx
-            tmp_shape[2:2 + shape_list.size(0)] = shape_list
-
-        nccl.broadcast(
-            tmp_shape.storage(),
-            tmp_shape.storage(),
-            0,
-            config['comm']
+            manifest = [(key, tuple(value.shape), value.dtype) for key, value in state_dict.items()]
+        else:
+            manifest = None
+        self._metadata, manifest = broadcast_object(
+            (getattr(state_dict, "_metadata", None), manifest), config["comm"]
         )
+        self._manifest = OrderedDict((key, (shape, dtype)) for key, shape, dtype in manifest)
+
+        self._bucket_size = bucket_size
+        if bucket_size is not None:
+            self._init_buckets(bucket_size, self._manifest.keys() if key_order is None else key_order)
+
+    def _init_buckets(self, bucket_size, key_order):
+        # key -> (bucket, offset in bytes, nbytes)
+        self._bucket_of = {}
+        self._bucket_nbytes = []
+        self._bucket_keys = []
+        size = 0
+        for key in key_order:
+            if key not in self._manifest or key in self._bucket_of:
+                continue
+            shape, dtype = self._manifest[key]
+            nbytes = torch.Size(shape).numel() * torch.tensor([], dtype=dtype).element_size()
+            if len(self._bucket_nbytes) == 0 or (size > 0 and size + nbytes > bucket_size):
+                self._bucket_nbytes.append(0)
+                self._bucket_keys.append([])
+                size = 0
+            self._bucket_of[key] = (len(self._bucket_nbytes) - 1, size, nbytes)
+            self._bucket_keys[-1].append(key)
+            size = round_up(size + nbytes, _BUCKET_ALIGNMENT)
+            self._bucket_nbytes[-1] = size
+        self._buckets = [None] * len(self._bucket_nbytes)
+        self._bucket_events = [None] * len(self._bucket_nbytes)
+        self._bucket_remaining = [len(keys) for keys in self._bucket_keys]
+        self._issued = [False] * len(self._bucket_nbytes)
+        # the buckets below are freed, or skipped
+        self._first_live = 0
+        # two pinned buffers on rank 0, one is packed while the other is copied to the device
+        self._pinned = [None, None]
+        self._pinned_events = [None, None]
+        self._num_issued = 0
+
+    def _issue_bucket(self, idx):
+        nbytes = self._bucket_nbytes[idx]
+        load_stream = config["load_stream"]
+        if config['rank'] == 0:
+            slot = self._num_issued % 2
+            if self._pinned_events[slot] is not None:
+                self._pinned_events[slot].synchronize()
+            if self._pinned[slot] is None or self._pinned[slot].numel() < nbytes:
+                self._pinned[slot] = torch.empty(nbytes, dtype=torch.uint8, pin_memory=True)
+            host = self._pinned[slot]
+            for key in self._bucket_keys[idx]:
+                _, offset, size = self._bucket_of[key]
+                value = self._state_dict[key]
+                if size > 0:
+                    host[offset : offset + size].copy_(value.detach().reshape(-1).view(torch.uint8))
+        load_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(load_stream):
+            bucket = torch.empty(nbytes, dtype=torch.uint8, device="cuda")
+            if config['rank'] == 0:
+                bucket.copy_(host[:nbytes], non_blocking=True)
+                self._pinned_events[slot] = torch.cuda.Event()
+                self._pinned_events[slot].record(load_stream)
+            nccl.broadcast(bucket.storage(), bucket.storage(), 0, config['comm'])
+            event = torch.cuda.Event()
+            event.record(load_stream)
+        self._buckets[idx] = bucket
+        self._bucket_events[idx] = event
+        self._issued[idx] = True
+        self._num_issued += 1
+
+    def _load_single(self, key):
+        # on the load stream, so it is ordered with the bucket broadcasts on every rank
+        shape, dtype = self._manifest[key]
+        load_stream = config["load_stream"]
+        current_stream = torch.cuda.current_stream()
+        load_stream.wait_stream(current_stream)
+        with torch.cuda.stream(load_stream):
+            ret = torch.empty(shape, dtype=dtype, device="cuda")
+            if config['rank'] == 0:
+                ret.copy_(self._state_dict[key])
+            nccl.broadcast(ret.storage(), ret.storage(), 0, config['comm'])
+        current_stream.wait_stream(load_stream)
+        ret.record_stream(current_stream)
+        return ret
 
-        shape_list_size = tmp_shape[0].item()
-        dtype_idx = tmp_shape[1].item()
-        shape_list = torch.Size(tmp_shape[2: 2 + shape_list_size].tolist())
+    def _load_from_bucket(self, key):
+        # every rank requests the same keys in the same order, so the collectives match
+        if key not in self._bucket_of:
+            return self._load_single(key)
+        idx, offset, nbytes = self._bucket_of[key]
+        if idx < self._first_live or (self._issued[idx] and self._buckets[idx] is None):
+            return self._load_single(key)
+        # the buckets before are not accessed any more, e.g. they hold keys the model skips
+        for i in range(self._first_live, idx):
+            self._buckets[i] = None
+        self._first_live = idx
+        if not self._issued[idx]:
+            self._issue_bucket(idx)
+        # prefetch the next bucket
+        if idx + 1 < len(self._buckets) and not self._issued[idx + 1]:
+            self._issue_bucket(idx + 1)
+        bucket = self._buckets[idx]
+        current_stream = torch.cuda.current_stream()
+        current_stream.wait_event(self._bucket_events[idx])
+        bucket.record_stream(current_stream)
+
+        shape, dtype = self._manifest[key]
+        ret = bucket[offset : offset + nbytes].view(dtype).view(shape)
+        self._bucket_remaining[idx] -= 1
+        if self._bucket_remaining[idx] == 0:
+            # the bucket is freed once the tensors unpacked from it are released
+            self._buckets[idx] = None
+        return ret
 
+    def __getitem__(self, key : str):
+        if key not in self._manifest:
+            raise KeyError(key)
+        shape, dtype = self._manifest[key]
+        loader = None
+        if self._bucket_size is not None:
+            loader = lambda: self._load_from_bucket(key)
         if config['rank'] != 0:
-            return DistributedTensorWrapper(torch.tensor([], dtype=DTYPE_LIST[dtype_idx], device="cuda"), shape=shape_list)
+            return DistributedTensorWrapper(torch.tensor([], dtype=dtype, device="cuda"), shape=torch.Size(shape), loader=loader)
         else:
-            return DistributedTensorWrapper(self._state_dict[key], shape=shape_list)
+            return DistributedTensorWrapper(self._state_dict[key], shape=torch.Size(shape), loader=loader)
 
-        
-        
     def copy(self):
         return self
 
     def __len__(self):
-        return broadcast_object(len(self._state_dict), config["comm"])
+        return len(self._manifest)
     
     def __contains__(self, key : str):
-        return broadcast_object(key in self._state_dict, config["comm"])
+        return key in self._manifest
     
     def keys(self):
-        return broadcast_object(list(self._state_dict.keys()),config["comm"])
+        return self._manifest.keys()
 
     def __iter__(self):
         # pytorch 1.12.0 updated the load_state_dict method, which needs the state_dict to be a `Mapping`.
         return iter(self.keys())
 
-def load(model : torch.nn.Module, file_name : str, strict : bool = True):
+def load(
+    model : torch.nn.Module,
+    file_name : str,
+    strict : bool = True,
+    read_ahead : bool = True,
+    bucket_size : Optional[int] = BROADCAST_BUCKET_SIZE,
+):
     """Loads the model from the file.
 
     Similar to torch.load, but it uses less memory when loading large models.
 
+    Checkpoints saved with ``mmap=True`` are memory mapped by every rank, and each rank copies only the slices of its own partitions, without going through rank 0.
+
     Args:
         model (torch.nn.Module): The model to be loaded.
         file_name (str): The file name of the checkpoint.
         strict (bool): Strict option of `load_state_dict`.
+        read_ahead (bool): Read ahead of the accessed pages of memory mapped checkpoints.
+        bucket_size (Optional[int]): Rank 0 broadcasts the tensors packed in buckets of about this many bytes. If None, every tensor is broadcasted on its own.
     
     Example:
         >>> bmtrain.load(model, "model.pt", strict=True)
     """
+    use_mmap = broadcast_object(
+        is_mmap_file(file_name) if config['rank'] == 0 else None, config["comm"]
+    )
+    if use_mmap:
+        ret = model.load_state_dict(
+            MmapStateDict(file_name, read_ahead=read_ahead),
+            strict = strict
+        )
+        torch.cuda.synchronize()
+        return ret
+
     if config['rank'] == 0:
-        state_dict = DistributedStateDictWrapper(torch.load(file_name))
+        state_dict = DistributedStateDictWrapper(torch.load(file_name), bucket_size, _load_order(model))
     else:
-        state_dict = DistributedStateDictWrapper({})
+        state_dict = DistributedStateDictWrapper({}, bucket_size, _load_order(model))
 
     ret = model.load_state_dict(
         state_dict,
@@ -0,0 +1,200 @@
+"""Attribution of the time ranks wait in collectives to the ranks that arrive late.
+
+Examples:
+    >>> with bmt.monitor_stragglers(every=100) as monitor:
+    ...     for step in range(1000):
+    ...         loss = model(...)
+    ...         optim_manager.backward(loss)
+    ...         optim_manager.step()
+    ...         monitor.step()
+
+Every ``every`` steps rank 0 prints the ranks that kept the others waiting the longest and the
+call sites that waited the longest.
+
+A collective finishes at about the same time on all members, so the time it takes on a rank
+is the time the rank waited for the last member plus the time of the transfer. The shortest
+duration among the members of a call is its transfer time, the rest of the duration of every
+member is its wait, and the difference to the longest duration is how late a member arrived.
+"""
+import array
+import socket
+import contextlib
+import torch
+from typing import Optional, Tuple
+
+from .global_var import config
+from .utils import print_block, ActiveInstance, NULL_CONTEXT
+
+_monitor = ActiveInstance("monitor_stragglers")
+
+
+class _Call:
+    __slots__ = ("monitor", "key", "stream", "start")
+
+    def __init__(self, monitor, key, stream):
+        self.monitor = monitor
+        self.key = key
+        self.stream = stream
+
+    def __enter__(self):
+        if self.stream is None:
+            self.stream = torch.cuda.current_stream()
+        self.start = torch.cuda.Event(enable_timing=True)
+        self.start.record(self.stream)
+
+    def __exit__(self, *args):
+        end = torch.cuda.Event(enable_timing=True)
+        end.record(self.stream)
+        self.monitor._calls.setdefault(self.key, []).append((self.start, end))
+
+
+def _lists(rank_reports):
+    # durations of every call of every (comm, directed pair, site), by member rank
+    ret = {}
+    for report in rank_reports:
+        for key, durations in report["calls"].items():
+            ret.setdefault(key, {})[report["rank"]] = durations
+    return ret
+
+
+class StragglerMonitor:
+    """Times the collectives of every rank and reports the stragglers, see :func:`monitor_stragglers`.
+
+    The timed call sites are the parameter gathers and gradient reduce-scatters of Blocks, the
+    collectives of :mod:`bmtrain.distributed`, which includes the tensor parallel linear
+    layers, the pipeline sends and receives and :func:`bmtrain.synchronize`.
+
+    Args:
+        every (int): Report every ``every`` steps.
+        top (int): The number of ranks and call sites in the report.
+    """
+
+    def __init__(self, every: int = 100, top: int = 10):
+        self.every = every
+        self.top = top
+        self.step_idx = 0
+        self._steps = 0
+        self._calls = {}
+        self.last_report = None
+
+    def call(self, site: str, comm, stream=None, pair: Optional[Tuple[int, int]] = None) -> _Call:
+        """A context that times a collective of ``comm``, or a send or receive of the transfer
+        from rank ``pair[0]`` to rank ``pair[1]`` of ``comm``.
+
+        Both sides of a transfer must use the same ``site``, so that the k-th send from a rank
+        to another is matched with the k-th receive of the other rank from it.
+        """
+        name = config.get("comm_names", {}).get(id(comm), None)
+        if name is None:
+            # calls are matched across the ranks by the name of the communicator
+            return NULL_CONTEXT
+        return _Call(self, (name, None if pair is None else tuple(pair), site), stream)
+
+    def step(self) -> Optional[dict]:
+        """Marks the end of a step, every ``every`` steps it is a collective operation that
+        returns the report on rank 0, see :meth:`report`."""
+        self.step_idx += 1
+        self._steps += 1
+        if self.step_idx % self.every != 0:
+            return None
+        return self.report()
+
+    def _local(self):
+        torch.cuda.synchronize()
+        calls = {}
+        for key, events in self._calls.items():
+            calls[key] = array.array("f", [start.elapsed_time(end) for start, end in events])
+        self._calls = {}
+        self._steps = 0
+        return {"rank": config["rank"], "host": socket.gethostname(), "calls": calls}
+
+    def report(self) -> Optional[dict]:
+        """Gathers the timings since the last report on rank 0 and prints the stragglers,
+        a collective operation.
+
+        Returns:
+            dict: ``ranks``, the ranks by the time the other members of their collectives
+            waited for them, and ``sites``, the call sites by the time the ranks waited in them,
+            in milliseconds, ``None`` on the other ranks.
+        """
+        from .distributed.object_ops import gather_objects
+
+        steps = self._steps
+        reports = gather_objects(self._local())
+        if reports is None:
+            return None
+        hosts = {r["rank"]: r["host"] for r in reports}
+        ranks = {r: {"rank": r, "host": hosts[r], "late": 0.0, "wait": 0.0, "sites": {}} for r in hosts}
+        sites = {}
+        for (comm_name, pair, site), members in _lists(reports).items():
+            member_ranks = sorted(members)
+            calls = min(len(members[r]) for r in member_ranks)
+            if calls == 0:
+                continue
+            durations = torch.tensor([list(members[r][:calls]) for r in member_ranks], dtype=torch.float64)
+            transfer = durations.min(dim=0).values
+            wait = (durations - transfer).sum(dim=1).tolist()
+            late = (durations.max(dim=0).values - durations).sum(dim=1).tolist()
+            site_name = site if pair is None else "{}[{}->{}]".format(site, *pair)
+            site_name = "{}@{}".format(site_name, comm_name)
+            sites[site_name] = {
+                "site": site_name,
+                "ranks": member_ranks,
+                "calls": calls,
+                "transfer": transfer.sum().item(),
+                "wait": sum(wait),
+            }
+            for r, w, l in zip(member_ranks, wait, late):
+                ranks[r]["wait"] += w
+                ranks[r]["late"] += l
+                ranks[r]["sites"][site_name] = ranks[r]["sites"].get(site_name, 0.0) + l
+
+        ranked = sorted(ranks.values(), key=lambda it: -it["late"])
+        for it in ranked:
+            it["worst_site"] = max(it.pop("sites").items(), key=lambda kv: kv[1], default=(None, 0.0))[0]
+        ret = {
+            "steps": steps,
+            "ranks": ranked,
+            "sites": sorted(sites.values(), key=lambda it: -it["wait"]),
+        }
+        self.last_report = ret
+        self._print(ret)
+        return ret
+
+    def _print(self, report):
+        lines = ["{:>6} {:<24} {:>12} {:>12}  {}".format("rank", "host", "late(ms)", "wait(ms)", "worst site")]
+        for it in report["ranks"][: self.top]:
+            lines.append("{:>6} {:<24} {:>12.3f} {:>12.3f}  {}".format(
+                it["rank"], it["host"][:24], it["late"], it["wait"], it["worst_site"]
+            ))
+        lines.append("")
+        lines.append("{:<48} {:>8} {:>12} {:>12}".format("site", "calls", "transfer(ms)", "wait(ms)"))
+        for it in report["sites"][: self.top]:
+            lines.append("{:<48} {:>8} {:>12.3f} {:>12.3f}".format(
+                it["site"][:48], it["calls"], it["transfer"], it["wait"]
+            ))
+        print_block("Stragglers of the last %d steps" % report["steps"], "\n".join(lines))
+
+
+def comm_call(site: str, comm, stream=None, pair: Optional[Tuple[int, int]] = None):
+    """A context that times a collective, or one side of the transfer ``pair``, while monitoring
+    stragglers, else it does nothing, see :meth:`StragglerMonitor.call`."""
+    monitor = _monitor.value
+    if monitor is None:
+        return NULL_CONTEXT
+    return monitor.call(site, comm, stream, pair)
+
+
+@contextlib.contextmanager
+def monitor_stragglers(every: int = 100, top: int = 10):
+    """Monitors the collectives of the steps run in the context, see :class:`StragglerMonitor`.
+
+    Call ``step()`` of the returned monitor at the end of every step, on all ranks.
+
+    Args:
+        every (int): Report every ``every`` steps, the timings are gathered on rank 0 by one
+            collective and the device is synchronized once.
+        top (int): The number of ranks and call sites in the report.
+    """
+    with _monitor.activate(StragglerMonitor(every, top)) as monitor:
+        yield monitor
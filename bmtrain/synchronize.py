@@ -1,6 +1,7 @@
 import torch
 from . import distributed, nccl
 from .global_var import config
+from .straggler import comm_call
 import warnings
 from typing import Optional
 
@@ -14,7 +15,8 @@ def synchronize():
 
     with torch.cuda.stream(config["barrier_stream"]):
         barrier = torch.cuda.FloatTensor([1])
-        nccl.allReduce(barrier.storage(), barrier.storage(), "sum", config["comm"])
+        with comm_call("synchronize", config["comm"]):
+            nccl.allReduce(barrier.storage(), barrier.storage(), "sum", config["comm"])
     config["barrier_stream"].synchronize()
 
 
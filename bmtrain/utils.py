@@ -4,6 +4,8 @@ from typing import Any, Dict, Iterable, Optional
 from .global_var import config
 import os
 import ctypes
+import importlib
+import contextlib
 
 ALIGN = 4
 ROW_WIDTH = 60
@@ -45,6 +47,64 @@ def load_nccl_pypi():
             ctypes.CDLL(os.path.join(path, file_so))
 
 
+class LazyExtension:
+    """
+    Stand-in of the compiled extension ``bmtrain.C``, imported on the first use of one of its
+    functions. If the NCCL library is not found, the one of the ``nvidia-nccl`` wheel is loaded.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError:
+                load_nccl_pypi()
+                self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        # later lookups do not go through __getattr__
+        setattr(self, attr, value)
+        return value
+
+
+C = LazyExtension("bmtrain.C")
+
+
+# returned by the hooks of the tools below when they are not active
+NULL_CONTEXT = contextlib.nullcontext()
+
+
+class ActiveInstance:
+    """The instance of a tool enabled by a context manager, e.g. the profiler of
+    ``bmt.profile()``, :attr:`value` is ``None`` outside of the context.
+
+    The hooks in the hot paths read :attr:`value` and do nothing when it is ``None``.
+
+    Args:
+        name (str): The function of ``bmtrain`` that enables the tool, for the error messages.
+    """
+
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = None
+
+    @contextlib.contextmanager
+    def activate(self, instance):
+        """Makes ``instance`` the active one in the context, which can not be nested."""
+        if self.value is not None:
+            raise RuntimeError("bmt.{}() can not be nested".format(self.name))
+        self.value = instance
+        try:
+            yield instance
+        finally:
+            self.value = None
+
+
 def round_up(x, d):
     """
     Return (x + d - 1) // d * d
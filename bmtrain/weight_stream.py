@@ -0,0 +1,275 @@
+"""Streams the gathered weights of a model layer by layer, e.g. to a co-located inference engine.
+
+On the training side, every rank iterates the layers, the ranks that hand off the weights
+pass a :class:`WeightSender`::
+
+    sender = WeightSender("/tmp/weights.sock") if bmt.config["local_rank"] == 0 else None
+    bmt.weight_stream.stream_weights(model, sender)
+
+On the serving side::
+
+    receiver = WeightReceiver("/tmp/weights.sock")
+    for name, state_dict in receiver:
+        engine.load_layer_state_dict(state_dict)
+"""
+import torch
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, Iterator, Optional, Tuple
+
+from .global_var import config
+from .block_layer import Block
+from .pipe_layer import PipelineTransformerBlockList
+from .mmap_store import _dtype_name, TENSOR_ALIGNMENT
+from .utils import round_up
+
+
+def _collect_blocks(module, prefix, blocks):
+    if isinstance(module, Block):
+        blocks.append((prefix, module))
+        return
+    if isinstance(module, PipelineTransformerBlockList):
+        # only the layers of this pipeline stage
+        for name, sub in module._modules.items():
+            if int(name) in module.layer_ids:
+                _collect_blocks(sub, prefix + name + ".", blocks)
+        return
+    for name, sub in module._modules.items():
+        if sub is not None:
+            _collect_blocks(sub, prefix + name + ".", blocks)
+
+
+def _save_rest(module, destination, prefix):
+    # as ``Module.state_dict``, without the Blocks
+    if isinstance(module, (Block, PipelineTransformerBlockList)):
+        return destination
+    destination._metadata[prefix[:-1]] = local_metadata = dict(version=module._version)
+    module._save_to_state_dict(destination, prefix, False)
+    for name, sub in module._modules.items():
+        if sub is not None:
+            _save_rest(sub, destination, prefix + name + ".")
+    for hook in module._state_dict_hooks.values():
+        hook_result = hook(module, destination, prefix, local_metadata)
+        if hook_result is not None:
+            destination = hook_result
+    return destination
+
+
+def _gather(func, *args):
+    # gathered on the GPU, the settings are restored before the caller gets the result
+    save_param_to_cpu = config["save_param_to_cpu"]
+    config["save_param_to_cpu"] = False
+    try:
+        with torch.no_grad():
+            state_dict = func(*args)
+    finally:
+        config["save_param_to_cpu"] = save_param_to_cpu
+    state_dict._ready = torch.cuda.Event()
+    state_dict._ready.record()
+    return state_dict
+
+
+def _empty_state_dict():
+    ret = OrderedDict()
+    ret._metadata = OrderedDict()
+    return ret
+
+
+def iter_layer_state_dicts(
+    model: torch.nn.Module, prefix: str = ""
+) -> Iterator[Tuple[str, OrderedDict]]:
+    """Yields the state dict of every Block of ``model`` gathered on the GPU, followed by the
+    parameters and buffers outside the Blocks under the name ``""``.
+
+    It is a collective operation, all ranks must exhaust the generator. The next Block is
+    gathered before the current one is yielded, so its communication overlaps the hand-off of
+    the current one, and at most two gathered Blocks are alive at a time. The yielded tensors
+    must not be modified. With pipeline parallel, every stage yields its own layers.
+
+    The state dicts have ``_metadata`` and went through the state dict hooks of the modules,
+    as the ones of ``Module.state_dict``.
+
+    Args:
+        model (torch.nn.Module): The model.
+        prefix (str): Prefix of the keys.
+
+    Yields:
+        Tuple[str, OrderedDict]: the prefix of the Block and its state dict.
+    """
+    blocks = []
+    _collect_blocks(model, prefix, blocks)
+    pending = None
+    for name, block in blocks:
+        state_dict = _gather(block.state_dict, _empty_state_dict(), name)
+        if pending is not None:
+            yield pending
+        pending = (name[:-1], state_dict)
+    state_dict = _gather(_save_rest, model, _empty_state_dict(), prefix)
+    if pending is not None:
+        yield pending
+    yield "", state_dict
+
+
+def _attach(name):
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = SharedMemory(name=name)
+        # the segment is owned by the sender, it must not be removed when this process exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Slot:
+    def __init__(self, nbytes):
+        self.shm = SharedMemory(create=True, size=nbytes)
+        self.buffer = torch.frombuffer(self.shm.buf, dtype=torch.uint8)
+        self.pinned = torch.cuda.cudart().cudaHostRegister(self.buffer.data_ptr(), nbytes, 0) == 0
+
+    def release(self):
+        if self.pinned:
+            torch.cuda.cudart().cudaHostUnregister(self.buffer.data_ptr())
+        del self.buffer
+        self.shm.close()
+        self.shm.unlink()
+
+
+class WeightSender:
+    """Ships layers to a :class:`WeightReceiver` through shared memory.
+
+    Every layer is copied to one of ``num_slots`` pinned shared memory buffers on a side
+    stream, and its offsets are sent over a local socket. A slot is reused once the receiver is
+    done with the layer in it, so with the default two slots the receiver consumes a layer
+    while the next one is gathered and copied.
+
+    Args:
+        address (str): The address of the :class:`WeightReceiver`, a path of a Unix socket.
+        authkey (bytes, optional): The authentication key of the connection.
+        num_slots (int): Number of shared memory buffers.
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None, num_slots: int = 2):
+        self._conn = Client(address, authkey=authkey)
+        self._slots = [None] * num_slots
+        self._in_flight = 0
+        self._stream = torch.cuda.Stream()
+
+    def _wait_ack(self):
+        self._conn.recv()
+        self._in_flight -= 1
+
+    def _get_slot(self, idx, nbytes):
+        slot = self._slots[idx]
+        if slot is None or slot.shm.size < nbytes:
+            if slot is not None:
+                slot.release()
+            slot = self._slots[idx] = _Slot(max(nbytes, 1))
+        return slot
+
+    def send(self, layers: Iterable[Tuple[str, OrderedDict]]):
+        """Sends the ``(name, state_dict)`` pairs, e.g. from :func:`iter_layer_state_dicts`."""
+        for i, (name, state_dict) in enumerate(layers):
+            idx = i % len(self._slots)
+            if self._in_flight == len(self._slots):
+                # acks come in order, the oldest one frees this slot
+                self._wait_ack()
+            metas = []
+            nbytes = 0
+            for key, value in state_dict.items():
+                size = value.numel() * value.element_size()
+                metas.append((key, _dtype_name(value.dtype), list(value.shape), nbytes, size))
+                nbytes = round_up(nbytes + size, TENSOR_ALIGNMENT)
+            slot = self._get_slot(idx, nbytes)
+
+            ready = getattr(state_dict, "_ready", None)
+            if ready is not None:
+                self._stream.wait_event(ready)
+            with torch.cuda.stream(self._stream):
+                for (_, _, _, offset, size), value in zip(metas, state_dict.values()):
+                    if size > 0:
+                        slot.buffer[offset : offset + size].view(value.dtype).view(value.shape).copy_(
+                            value, non_blocking=slot.pinned
+                        )
+            self._stream.synchronize()
+            self._conn.send(("layer", name, idx, slot.shm.name, metas))
+            self._in_flight += 1
+        while self._in_flight > 0:
+            self._wait_ack()
+        self._conn.send(("end",))
+
+    def close(self):
+        """Closes the connection and frees the shared memory."""
+        self._conn.close()
+        for slot in self._slots:
+            if slot is not None:
+                slot.release()
+        self._slots = [None] * len(self._slots)
+
+
+class WeightReceiver:
+    """Receives the layers shipped by a :class:`WeightSender`, in the serving process.
+
+    Iterating it waits for a sender, and yields ``(name, state_dict)`` of CPU tensors over the
+    shared memory until the sender has sent all layers. The tensors are only valid until the
+    next layer is requested, copy them to keep them.
+
+    Args:
+        address (str): A path of a Unix socket to listen on.
+        authkey (bytes, optional): The authentication key of the connection.
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None):
+        self._listener = Listener(address, authkey=authkey)
+        self._slots = {}
+
+    def __iter__(self) -> Iterator[Tuple[str, OrderedDict]]:
+        with self._listener.accept() as conn:
+            while True:
+                msg = conn.recv()
+                if msg[0] == "end":
+                    break
+                _, name, idx, shm_name, metas = msg
+                if idx not in self._slots or self._slots[idx].name != shm_name:
+                    if idx in self._slots:
+                        self._slots[idx].close()
+                    self._slots[idx] = _attach(shm_name)
+                buf = self._slots[idx].buf
+                state_dict = OrderedDict()
+                for key, dtype, shape, offset, size in metas:
+                    dtype = getattr(torch, dtype)
+                    if size == 0:
+                        state_dict[key] = torch.empty(shape, dtype=dtype)
+                    else:
+                        state_dict[key] = torch.frombuffer(
+                            buf, dtype=torch.uint8, count=size, offset=offset
+                        ).view(dtype).view(shape)
+                yield name, state_dict
+                del state_dict
+                conn.send("ack")
+
+    def close(self):
+        """Stops listening and detaches the shared memory."""
+        self._listener.close()
+        for shm in self._slots.values():
+            try:
+                shm.close()
+            except BufferError:
+                # tensors over the segment are still referenced
+                pass
+        self._slots = {}
+
+
+def stream_weights(model: torch.nn.Module, sender: Optional[WeightSender] = None):
+    """Gathers the layers of ``model`` and ships them with ``sender`` on the ranks that have one.
+
+    It is a collective operation, every rank must call it, with ``sender=None`` on the ranks
+    that do not hand off the weights.
+    """
+    layers = iter_layer_state_dicts(model)
+    if sender is None:
+        for _ in layers:
+            pass
+    else:
+        sender.send(layers)
@@ -14,7 +14,11 @@ def make_distributed(model: torch.nn.Module):
 
     for kw in list(model._buffers.keys()):
         if model._buffers[kw] is not None:
-            model._buffers[kw] = model._buffers[kw].cuda()
+            if model._buffers[kw].is_meta:
+                # buffers built on the meta device have no values, they are zeros until loaded
+                model._buffers[kw] = torch.zeros_like(model._buffers[kw], device="cuda")
+            else:
+                model._buffers[kw] = model._buffers[kw].cuda()
 
     for kw in list(model._modules.keys()):
         if isinstance(model, torch.nn.ModuleList):
@@ -2,6 +2,9 @@ import torch
 from . import nccl
 from .global_var import config
 from .synchronize import wait_loader
+from .profiler import record, COMM
+from .straggler import comm_call
+from .memory_tracer import get_tracer, PARAM_BUFFER, KEPT_PARAM_BUFFER, GRAD_BUFFER
 
 
 class ZeroContext:
@@ -24,6 +27,12 @@ class ZeroContext:
         self._grad_tensor = {}
         self._need_release = False
 
+    def _zero_comm(self):
+        # the storages of a block are gathered and scattered as one group
+        for val in self.block._storage_info.values():
+            return val["zero_comm"]
+        return None
+
     def enter(self, flag=0, requires_grad=False):
         """
         Gather parameters before module forward and init grad buffer before backward.
@@ -66,14 +75,23 @@ class ZeroContext:
                         .zero_()
                     )
             if flag != 2:
-                nccl.groupStart()
-                for kw, val in self.block._storage_info.items():
-                    nccl.allGather(
-                        self.block._storage_params[kw].storage(),
-                        self._param_buffer[kw],
-                        val["zero_comm"],
-                    )
-                nccl.groupEnd()
+                with record("all_gather", COMM), comm_call("zero.all_gather", self._zero_comm()):
+                    nccl.groupStart()
+                    for kw, val in self.block._storage_info.items():
+                        nccl.allGather(
+                            self.block._storage_params[kw].storage(),
+                            self._param_buffer[kw],
+                            val["zero_comm"],
+                        )
+                    nccl.groupEnd()
+
+        tracer = get_tracer()
+        if tracer is not None:
+            owner = tracer.owner(self.block)
+            for kw, buffer in self._param_buffer.items():
+                tracer.alloc((id(self.block), PARAM_BUFFER, kw), PARAM_BUFFER, buffer.size() * buffer.element_size(), owner)
+            for kw, buffer in self._grad_buffer.items():
+                tracer.alloc((id(self.block), GRAD_BUFFER, kw), GRAD_BUFFER, buffer.size() * buffer.element_size(), owner)
 
         current_stream = torch.cuda.current_stream()
         current_stream.wait_stream(config["load_stream"])
@@ -149,7 +167,9 @@ class ZeroContext:
             current_stream = torch.cuda.current_stream()
             config["load_stream"].wait_stream(current_stream)  # wait for backward
 
-            with torch.cuda.stream(config["load_stream"]):
+            with torch.cuda.stream(config["load_stream"]), record("reduce_scatter", COMM), comm_call(
+                "zero.reduce_scatter", self._zero_comm()
+            ):
                 nccl.groupStart()
                 for kw, val in self.block._storage_info.items():
                     local_param = self.block._storage_params[kw]
@@ -193,6 +213,17 @@ class ZeroContext:
         if flag == 1:
             for i in self._param_buffer:
                 self.ctx_dict[i] = self._param_buffer[i]
+        tracer = get_tracer()
+        if tracer is not None:
+            for kw in self._param_buffer:
+                key = (id(self.block), PARAM_BUFFER, kw)
+                if flag == 1:
+                    # kept for the backward until the next forward replaces it
+                    tracer.move(key, (id(self.block), KEPT_PARAM_BUFFER, kw), KEPT_PARAM_BUFFER)
+                else:
+                    tracer.free(key)
+            for kw in self._grad_buffer:
+                tracer.free((id(self.block), GRAD_BUFFER, kw))
         self._grad_tensor = {}
         self._param_tensor = {}
         self._grad_buffer = {}
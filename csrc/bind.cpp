@@ -6,10 +6,18 @@ PYBIND11_MODULE(C, m) {
     m.def("is_bf16_supported", &is_bf16_supported, "whether bf16 supported");
     m.def("has_nan_inf_fp16_launcher", &has_nan_inf_fp16_launcher, "has nan inf");
     m.def("has_nan_inf_bf16_launcher", &has_nan_inf_bf16_launcher, "has nan inf bf16");
+    m.def("multi_tensor_grad_norm_fp16_launcher", &multi_tensor_grad_norm_fp16_launcher, "grad norm and nan inf");
+    m.def("multi_tensor_grad_norm_bf16_launcher", &multi_tensor_grad_norm_bf16_launcher, "grad norm and nan inf bf16");
+    m.def("multi_tensor_grad_norm_fp32_launcher", &multi_tensor_grad_norm_fp32_launcher, "grad norm and nan inf fp32");
     m.def("adam_fp16_launcher", &adam_fp16_launcher, "adam function cpu");
     m.def("adam_bf16_launcher", &adam_bf16_launcher, "adam function cpu");
+    m.def("adam_fp32_launcher", &adam_fp32_launcher, "adam function fp32");
     m.def("adam_cpu_fp16_launcher", &adam_cpu_fp16_launcher, "adam function cpu");
     m.def("adam_cpu_bf16_launcher", &adam_cpu_bf16_launcher, "adam function cpu");
+    m.def("adam_8bit_fp16_launcher", &adam_8bit_fp16_launcher, "adam function with 8-bit states");
+    m.def("adam_8bit_bf16_launcher", &adam_8bit_bf16_launcher, "adam function with 8-bit states");
+    m.def("adam_cpu_8bit_fp16_launcher", &adam_cpu_8bit_fp16_launcher, "adam function cpu with 8-bit states");
+    m.def("adam_cpu_8bit_bf16_launcher", &adam_cpu_8bit_bf16_launcher, "adam function cpu with 8-bit states");
     m.def("cross_entropy_forward_fp16_launcher", &cross_entropy_forward_fp16_launcher, "cross entropy forward");
     m.def("cross_entropy_forward_bf16_launcher", &cross_entropy_forward_bf16_launcher, "cross entropy forward");
     m.def("cross_entropy_backward_inplace_fp16_launcher", &cross_entropy_backward_inplace_fp16_launcher, "cross entropy backward inplace");
@@ -20,6 +28,8 @@ PYBIND11_MODULE(C, m) {
     m.def("fused_softmax_inplace_bf16_launcher", &fused_softmax_inplace_bf16_launcher, "softmax inplace");
     m.def("ncclGetUniqueId", &pyNCCLGetUniqueID, "nccl get unique ID");
     m.def("ncclCommInitRank", &pyNCCLCommInitRank, "nccl init rank");
+    m.def("ncclCommSplit", &pyNCCLCommSplit, "nccl comm split");
+    m.def("ncclHasCommSplit", &pyNCCLHasCommSplit, "whether nccl comm split is supported");
     m.def("ncclCommDestroy", &pyNCCLCommDestroy, "nccl delete rank");
     m.def("ncclAllGather", &pyNCCLAllGather, "nccl all gather");
     m.def("ncclAllReduce", &pyNCCLAllReduce, "nccl all reduce");
@@ -0,0 +1,231 @@
+#include "reduce.cuh"
+#include <cstdint>
+#include <cuda.h>
+#include <cuda_fp16.h>
+#include "bfloat16.cuh"
+
+namespace {
+// elements of one quantization block, must be equal to the threads of a cuda block
+const int QUANT_BLOCK = 1024;
+
+// returns the index of the nearest value in a sorted quantization map
+__device__ uint8_t quantize_value(const float *qmap, float x) {
+    int lo = 0, hi = 255;
+    while (lo < hi) {
+        int mid = (lo + hi) >> 1;
+        if (qmap[mid] < x) lo = mid + 1;
+        else hi = mid;
+    }
+    if (lo > 0 && fabsf(x - qmap[lo - 1]) < fabsf(qmap[lo] - x)) lo -= 1;
+    return (uint8_t)lo;
+}
+
+// blocks <ceil(n / 1024)>,      threads<1024>
+template<typename T, typename ToFloat, typename FromFloat>
+__device__ void adam_8bit_step(
+    int32_t n,
+    const T *g,             // (n)
+    uint8_t *m,             // (n)
+    uint8_t *v,             // (n)
+    float *m_absmax,        // (ceil(n / 1024))
+    float *v_absmax,        // (ceil(n / 1024))
+    const float *qmap_m,    // (256) signed map
+    const float *qmap_v,    // (256) unsigned map
+    float *param,           // (n)
+    T *param_h,             // (n)
+    float beta1,
+    float beta2,
+    float eps,
+    float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    const float *skip,      // (1) or nullptr, the step is a no-op if set
+    ToFloat to_float,
+    FromFloat from_float
+) {
+    if (skip != nullptr && *skip > 0) return;
+    __shared__ float s_qmap_m[256];
+    __shared__ float s_qmap_v[256];
+    if (threadIdx.x < 256) {
+        s_qmap_m[threadIdx.x] = qmap_m[threadIdx.x];
+        s_qmap_v[threadIdx.x] = qmap_v[threadIdx.x];
+    }
+    __syncthreads();
+
+    int32_t col = blockIdx.x * blockDim.x + threadIdx.x;
+    float local_m = 0, local_v = 0;
+    if (col < n) {
+        float local_g = to_float(g[col]) / scale;                                   // real_g
+        local_m = s_qmap_m[m[col]] * m_absmax[blockIdx.x];                          // dequantize
+        local_v = s_qmap_v[v[col]] * v_absmax[blockIdx.x];
+        local_m = beta1 * local_m + (1 - beta1) * local_g;                          // real_m
+        local_v = beta2 * local_v + (1 - beta2) * local_g * local_g;                // real_v
+        float local_p = param[col];
+        local_p = local_p - lr * local_m / bias_correction1 / (sqrtf(local_v / bias_correction2) + eps) - lr * weight_decay * local_p;
+        param_h[col] = from_float(local_p);
+        param[col] = local_p;
+    }
+
+    float new_m_absmax = block_allreduce_max(fabsf(local_m));
+    __syncthreads();    // block_allreduce_max reuses its shared buffer
+    float new_v_absmax = block_allreduce_max(local_v);
+
+    if (col < n) {
+        m[col] = quantize_value(s_qmap_m, new_m_absmax > 0 ? local_m / new_m_absmax : 0);
+        v[col] = quantize_value(s_qmap_v, new_v_absmax > 0 ? local_v / new_v_absmax : 0);
+    }
+    if (threadIdx.x == 0) {
+        m_absmax[blockIdx.x] = new_m_absmax;
+        v_absmax[blockIdx.x] = new_v_absmax;
+    }
+}
+
+__device__ float half_to_float(half x) { return __half2float(x); }
+__device__ half float_to_half(float x) { return __float2half(x); }
+
+__global__ void adam_8bit_fp16(
+    int32_t n,
+    const half *g,
+    uint8_t *m,
+    uint8_t *v,
+    float *m_absmax,
+    float *v_absmax,
+    const float *qmap_m,
+    const float *qmap_v,
+    float *param,
+    half *param_h,
+    float beta1,
+    float beta2,
+    float eps,
+    float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    const float *skip
+) {
+    adam_8bit_step(
+        n, g, m, v, m_absmax, v_absmax, qmap_m, qmap_v, param, param_h,
+        beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2, skip,
+        half_to_float, float_to_half
+    );
+}
+
+#ifdef BF16_SUPPORT
+__device__ float bf16_to_float(__nv_bfloat16 x) { return __bfloat162float(x); }
+__device__ __nv_bfloat16 float_to_bf16(float x) { return __float2bfloat16(x); }
+#endif
+
+__global__ void adam_8bit_bf16(
+    int32_t n,
+    const std::uintptr_t g_ptr,
+    uint8_t *m,
+    uint8_t *v,
+    float *m_absmax,
+    float *v_absmax,
+    const float *qmap_m,
+    const float *qmap_v,
+    float *param,
+    std::uintptr_t param_h_ptr,
+    float beta1,
+    float beta2,
+    float eps,
+    float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    const float *skip
+) {
+#ifdef BF16_SUPPORT
+    const __nv_bfloat16* g = reinterpret_cast<const __nv_bfloat16*>(g_ptr);
+    __nv_bfloat16* param_h = reinterpret_cast<__nv_bfloat16*>(param_h_ptr);
+    adam_8bit_step(
+        n, g, m, v, m_absmax, v_absmax, qmap_m, qmap_v, param, param_h,
+        beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2, skip,
+        bf16_to_float, float_to_bf16
+    );
+#endif
+}
+
+}
+
+void adam_8bit_fp16_launcher(
+    int n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t param_fp16,
+    std::uintptr_t g_fp16,
+    std::uintptr_t m_uint8,
+    std::uintptr_t v_uint8,
+    std::uintptr_t m_absmax,
+    std::uintptr_t v_absmax,
+    std::uintptr_t qmap_m,
+    std::uintptr_t qmap_v,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    std::uintptr_t skip,
+    uintptr_t stream
+) {
+    if (n <= 0) return;
+    dim3 block_size = dim3(QUANT_BLOCK, 1, 1);
+    dim3 grid_size = dim3((n + QUANT_BLOCK - 1) / QUANT_BLOCK, 1, 1);
+    adam_8bit_fp16<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(
+        n,
+        reinterpret_cast<half*>(g_fp16),
+        reinterpret_cast<uint8_t*>(m_uint8),
+        reinterpret_cast<uint8_t*>(v_uint8),
+        reinterpret_cast<float*>(m_absmax),
+        reinterpret_cast<float*>(v_absmax),
+        reinterpret_cast<float*>(qmap_m),
+        reinterpret_cast<float*>(qmap_v),
+        reinterpret_cast<float*>(param_fp32),
+        reinterpret_cast<half*>(param_fp16),
+        beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2,
+        reinterpret_cast<float*>(skip)
+    );
+}
+
+void adam_8bit_bf16_launcher(
+    int n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t param_bf16,
+    std::uintptr_t g_bf16,
+    std::uintptr_t m_uint8,
+    std::uintptr_t v_uint8,
+    std::uintptr_t m_absmax,
+    std::uintptr_t v_absmax,
+    std::uintptr_t qmap_m,
+    std::uintptr_t qmap_v,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    std::uintptr_t skip,
+    uintptr_t stream
+) {
+    if (n <= 0) return;
+    dim3 block_size = dim3(QUANT_BLOCK, 1, 1);
+    dim3 grid_size = dim3((n + QUANT_BLOCK - 1) / QUANT_BLOCK, 1, 1);
+    adam_8bit_bf16<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(
+        n,
+        g_bf16,
+        reinterpret_cast<uint8_t*>(m_uint8),
+        reinterpret_cast<uint8_t*>(v_uint8),
+        reinterpret_cast<float*>(m_absmax),
+        reinterpret_cast<float*>(v_absmax),
+        reinterpret_cast<float*>(qmap_m),
+        reinterpret_cast<float*>(qmap_v),
+        reinterpret_cast<float*>(param_fp32),
+        param_bf16,
+        beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2,
+        reinterpret_cast<float*>(skip)
+    );
+}
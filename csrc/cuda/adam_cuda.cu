@@ -19,8 +19,10 @@ __global__ void adam_fp32_accum(
     float scale,
     float weight_decay,
     float bias_correction1,
-    float bias_correction2
+    float bias_correction2,
+    const float *skip       // (1) or nullptr, the step is a no-op if set
 ) {
+    if (skip != nullptr && *skip > 0) return;
     int32_t col = blockIdx.x * blockDim.x + threadIdx.x;
     if (col < n) {
         float local_g = __half2float(g[col]);                                       // real_g * scale
@@ -50,9 +52,11 @@ __global__ void adam_fp32_accum_bf16(
     float scale,
     float weight_decay,
     float bias_correction1,
-    float bias_correction2
+    float bias_correction2,
+    const float *skip       // (1) or nullptr, the step is a no-op if set
 ) {
 #ifdef BF16_SUPPORT
+    if (skip != nullptr && *skip > 0) return;
     const __nv_bfloat16* g = reinterpret_cast<const __nv_bfloat16*>(g_ptr);
     __nv_bfloat16* param_h = reinterpret_cast<__nv_bfloat16*>(param_h_ptr);
     int32_t col = blockIdx.x * blockDim.x + threadIdx.x;
@@ -71,6 +75,37 @@ __global__ void adam_fp32_accum_bf16(
 #endif
 }
 
+__global__ void adam_fp32(
+    int32_t n,
+    const float *g,        // (n)
+    float *m,        // (n)
+    float *v,        // (n)
+    float *param,   // (n)
+    float beta1,
+    float beta2,
+    float eps,
+    float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    const float *skip       // (1) or nullptr, the step is a no-op if set
+) {
+    if (skip != nullptr && *skip > 0) return;
+    int32_t col = blockIdx.x * blockDim.x + threadIdx.x;
+    if (col < n) {
+        float local_p = param[col];
+        float local_g = g[col] / scale + weight_decay * local_p; // real_g with L2 penalty, same as torch.optim.Adam
+        float local_m = beta1 * m[col] + (1 - beta1) * local_g; // real_m
+        float local_v = beta2 * v[col] + (1 - beta2) * local_g * local_g; // real_v
+        local_p = local_p - lr * local_m / bias_correction1 / (sqrtf(local_v / bias_correction2) + eps);
+
+        param[col] = local_p;
+        v[col] = local_v;
+        m[col] = local_m;
+    }
+}
+
 }
 
 void adam_fp16_launcher(
@@ -86,6 +121,7 @@ void adam_fp16_launcher(
     float weight_decay,
     float bias_correction1,
     float bias_correction2,
+    std::uintptr_t skip,
     uintptr_t stream
 ) {
     if (n <= 0) return;
@@ -97,7 +133,7 @@ void adam_fp16_launcher(
     int32_t threads = 1024;
     dim3 block_size = dim3(threads, 1, 1);
     dim3 grid_size = dim3((n + threads - 1) / threads, 1, 1);
-    adam_fp32_accum<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(n, g_ptr, m_ptr, v_fp32_ptr, param_fp32_ptr, param_h_ptr, beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2);
+    adam_fp32_accum<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(n, g_ptr, m_ptr, v_fp32_ptr, param_fp32_ptr, param_h_ptr, beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2, reinterpret_cast<float*>(skip));
 }
 
 void adam_bf16_launcher(
@@ -113,6 +149,7 @@ void adam_bf16_launcher(
     float weight_decay,
     float bias_correction1,
     float bias_correction2,
+    std::uintptr_t skip,
     uintptr_t stream
 ) {
     if (n <= 0) return;
@@ -122,5 +159,31 @@ void adam_bf16_launcher(
     int32_t threads = 1024;
     dim3 block_size = dim3(threads, 1, 1);
     dim3 grid_size = dim3((n + threads - 1) / threads, 1, 1);
-    adam_fp32_accum_bf16<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(n, g_bf16, m_ptr, v_fp32_ptr, param_fp32_ptr, param_bf16, beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2);
+    adam_fp32_accum_bf16<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(n, g_bf16, m_ptr, v_fp32_ptr, param_fp32_ptr, param_bf16, beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2, reinterpret_cast<float*>(skip));
+}
+
+void adam_fp32_launcher(
+    int n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t g_fp32,
+    std::uintptr_t m_fp32,
+    std::uintptr_t v_fp32,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    std::uintptr_t skip,
+    uintptr_t stream
+) {
+    if (n <= 0) return;
+    auto g_ptr = reinterpret_cast<float*>(g_fp32);
+    auto m_ptr = reinterpret_cast<float*>(m_fp32);
+    auto v_ptr = reinterpret_cast<float*>(v_fp32);
+    auto param_ptr = reinterpret_cast<float*>(param_fp32);
+    int32_t threads = 1024;
+    dim3 block_size = dim3(threads, 1, 1);
+    dim3 grid_size = dim3((n + threads - 1) / threads, 1, 1);
+    adam_fp32<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(n, g_ptr, m_ptr, v_ptr, param_ptr, beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2, reinterpret_cast<float*>(skip));
 }
@@ -0,0 +1,165 @@
+#include "reduce.cuh"
+#include <cstdint>
+#include <cuda.h>
+#include <cuda_fp16.h>
+#include "bfloat16.cuh"
+
+namespace {
+__device__ float load_float(const half *x, int64_t i) { return __half2float(x[i]); }
+__device__ float load_float(const float *x, int64_t i) { return x[i]; }
+#ifdef BF16_SUPPORT
+__device__ float load_float(const __nv_bfloat16 *x, int64_t i) { return __bfloat162float(x[i]); }
+#endif
+
+// grid <num_chunks>,        thread<1024>
+template<typename T>
+__device__ void multi_tensor_grad_norm(
+    const int32_t *chunk_tensor,    // (num_chunks) tensor that owns the chunk
+    const int64_t *chunk_offset,    // (num_chunks) first element of the chunk
+    const int64_t *ptrs,            // (num_tensors)
+    const int64_t *numels,          // (num_tensors)
+    int64_t chunk_size,
+    float norm_type,                // INFINITY for the max norm
+    float *partial,                 // (num_chunks)
+    float *flag                     // (1)
+) {
+    int32_t t = chunk_tensor[blockIdx.x];
+    const T *x = reinterpret_cast<const T*>(ptrs[t]);
+    int64_t st = chunk_offset[blockIdx.x];
+    int64_t ed = min(st + chunk_size, numels[t]);
+
+    float acc = 0, bad = 0;
+    for (int64_t i = st + threadIdx.x; i < ed; i += blockDim.x) {
+        float v = load_float(x, i);
+        if (!isfinite(v)) bad = 1;
+        if (isinf(norm_type)) acc = fmaxf(acc, fabsf(v));
+        else if (norm_type == 2) acc += v * v;
+        else acc += powf(fabsf(v), norm_type);
+    }
+    if (isinf(norm_type)) acc = block_reduce_max(acc);
+    else acc = block_reduce_sum(acc);
+    __syncthreads();    // block_reduce_* reuses its shared buffer
+    bad = block_reduce_max(bad);
+    if (threadIdx.x == 0) {
+        partial[blockIdx.x] = acc;
+        if (bad > 0) flag[0] = 1;
+    }
+}
+
+__global__ void multi_tensor_grad_norm_fp16(
+    const int32_t *chunk_tensor,
+    const int64_t *chunk_offset,
+    const int64_t *ptrs,
+    const int64_t *numels,
+    int64_t chunk_size,
+    float norm_type,
+    float *partial,
+    float *flag
+) {
+    multi_tensor_grad_norm<half>(chunk_tensor, chunk_offset, ptrs, numels, chunk_size, norm_type, partial, flag);
+}
+
+__global__ void multi_tensor_grad_norm_fp32(
+    const int32_t *chunk_tensor,
+    const int64_t *chunk_offset,
+    const int64_t *ptrs,
+    const int64_t *numels,
+    int64_t chunk_size,
+    float norm_type,
+    float *partial,
+    float *flag
+) {
+    multi_tensor_grad_norm<float>(chunk_tensor, chunk_offset, ptrs, numels, chunk_size, norm_type, partial, flag);
+}
+
+__global__ void multi_tensor_grad_norm_bf16(
+    const int32_t *chunk_tensor,
+    const int64_t *chunk_offset,
+    const int64_t *ptrs,
+    const int64_t *numels,
+    int64_t chunk_size,
+    float norm_type,
+    float *partial,
+    float *flag
+) {
+#ifdef BF16_SUPPORT
+    multi_tensor_grad_norm<__nv_bfloat16>(chunk_tensor, chunk_offset, ptrs, numels, chunk_size, norm_type, partial, flag);
+#endif
+}
+
+typedef void (*grad_norm_kernel)(const int32_t*, const int64_t*, const int64_t*, const int64_t*, int64_t, float, float*, float*);
+
+void launch_grad_norm(
+    grad_norm_kernel kernel,
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+) {
+    if (num_chunks <= 0) return;
+    dim3 block_size = dim3(1024, 1, 1);
+    dim3 grid_size = dim3(num_chunks, 1, 1);
+    kernel<<<grid_size, block_size, 0, reinterpret_cast<cudaStream_t>(stream)>>>(
+        reinterpret_cast<int32_t*>(chunk_tensor),
+        reinterpret_cast<int64_t*>(chunk_offset),
+        reinterpret_cast<int64_t*>(ptrs),
+        reinterpret_cast<int64_t*>(numels),
+        chunk_size,
+        norm_type,
+        reinterpret_cast<float*>(partial),
+        reinterpret_cast<float*>(flag)
+    );
+}
+
+}
+
+void multi_tensor_grad_norm_fp16_launcher(
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+) {
+    launch_grad_norm(multi_tensor_grad_norm_fp16, num_chunks, chunk_tensor, chunk_offset, ptrs, numels, chunk_size, norm_type, partial, flag, stream);
+}
+
+void multi_tensor_grad_norm_bf16_launcher(
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+) {
+    launch_grad_norm(multi_tensor_grad_norm_bf16, num_chunks, chunk_tensor, chunk_offset, ptrs, numels, chunk_size, norm_type, partial, flag, stream);
+}
+
+void multi_tensor_grad_norm_fp32_launcher(
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+) {
+    launch_grad_norm(multi_tensor_grad_norm_fp32, num_chunks, chunk_tensor, chunk_offset, ptrs, numels, chunk_size, norm_type, partial, flag, stream);
+}
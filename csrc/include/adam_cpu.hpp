@@ -555,3 +555,141 @@ void adam_cpu_bf16_launcher(
     auto g_bf16_ptr  = reinterpret_cast<uint16_t*>(g_bf16);
     adam_cpu_bf16_0(n, param_fp32_ptr, param_bf16_ptr, delta_info_ptr, g_bf16_ptr, m_fp32_ptr, v_fp32_ptr, beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2);
 }
+
+// elements of one quantization block, must be the same as the cuda kernel
+const int64_t QUANT_BLOCK = 1024;
+
+// returns the index of the nearest value in a sorted quantization map
+inline uint8_t quantize_value(const float* qmap, float x) {
+    int lo = std::lower_bound(qmap, qmap + 256, x) - qmap;
+    if (lo > 255) lo = 255;
+    if (lo > 0 && fabsf(x - qmap[lo - 1]) < fabsf(qmap[lo] - x)) lo -= 1;
+    return (uint8_t)lo;
+}
+
+template <class ToFloat, class FromFloat>
+void adam_cpu_8bit_0(
+    int64_t n,
+    float* param_fp32_ptr,
+    uint16_t* param_h_ptr,
+    uint16_t* g_h_ptr,
+    uint8_t* m_ptr,
+    uint8_t* v_ptr,
+    float* m_absmax_ptr,
+    float* v_absmax_ptr,
+    const float* qmap_m_ptr,
+    const float* qmap_v_ptr,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    const ToFloat& to_float,
+    const FromFloat& from_float
+){
+    int64_t num_blocks = (n + QUANT_BLOCK - 1) / QUANT_BLOCK;
+    parallel_for(0, num_blocks, 0, [&](int64_t start, int64_t end) {
+        float m_buf[QUANT_BLOCK];
+        float v_buf[QUANT_BLOCK];
+        for (int64_t b = start; b < end; b++) {
+            int64_t begin = b * QUANT_BLOCK;
+            int64_t size = std::min(QUANT_BLOCK, n - begin);
+            float m_absmax = m_absmax_ptr[b];
+            float v_absmax = v_absmax_ptr[b];
+            float new_m_absmax = 0;
+            float new_v_absmax = 0;
+            for (int64_t k = 0; k < size; k++) {
+                int64_t i = begin + k;
+                float g = to_float(g_h_ptr[i]) / scale;
+                float m = qmap_m_ptr[m_ptr[i]] * m_absmax;
+                float v = qmap_v_ptr[v_ptr[i]] * v_absmax;
+                float p = param_fp32_ptr[i];
+                m = beta1 * m + (1 - beta1) * g;
+                v = beta2 * v + (1 - beta2) * g * g;
+                p = p - lr * m  / bias_correction1 / (sqrtf(v / bias_correction2) + eps) - lr * weight_decay * p;
+                param_fp32_ptr[i] = p;
+                param_h_ptr[i] = from_float(p);
+                m_buf[k] = m;
+                v_buf[k] = v;
+                new_m_absmax = std::max(new_m_absmax, fabsf(m));
+                new_v_absmax = std::max(new_v_absmax, v);
+            }
+            for (int64_t k = 0; k < size; k++) {
+                int64_t i = begin + k;
+                m_ptr[i] = quantize_value(qmap_m_ptr, new_m_absmax > 0 ? m_buf[k] / new_m_absmax : 0);
+                v_ptr[i] = quantize_value(qmap_v_ptr, new_v_absmax > 0 ? v_buf[k] / new_v_absmax : 0);
+            }
+            m_absmax_ptr[b] = new_m_absmax;
+            v_absmax_ptr[b] = new_v_absmax;
+        }
+    });
+}
+
+void adam_cpu_8bit_fp16_launcher(
+    int64_t n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t param_fp16,
+    std::uintptr_t g_fp16,
+    std::uintptr_t m_uint8,
+    std::uintptr_t v_uint8,
+    std::uintptr_t m_absmax,
+    std::uintptr_t v_absmax,
+    std::uintptr_t qmap_m,
+    std::uintptr_t qmap_v,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2
+) {
+    adam_cpu_8bit_0(
+        n,
+        reinterpret_cast<float*>(param_fp32),
+        reinterpret_cast<uint16_t*>(param_fp16),
+        reinterpret_cast<uint16_t*>(g_fp16),
+        reinterpret_cast<uint8_t*>(m_uint8),
+        reinterpret_cast<uint8_t*>(v_uint8),
+        reinterpret_cast<float*>(m_absmax),
+        reinterpret_cast<float*>(v_absmax),
+        reinterpret_cast<const float*>(qmap_m),
+        reinterpret_cast<const float*>(qmap_v),
+        beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2,
+        fp16_ieee_to_fp32_value, fp16_ieee_from_fp32_value
+    );
+}
+
+void adam_cpu_8bit_bf16_launcher(
+    int64_t n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t param_bf16,
+    std::uintptr_t g_bf16,
+    std::uintptr_t m_uint8,
+    std::uintptr_t v_uint8,
+    std::uintptr_t m_absmax,
+    std::uintptr_t v_absmax,
+    std::uintptr_t qmap_m,
+    std::uintptr_t qmap_v,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2
+) {
+    adam_cpu_8bit_0(
+        n,
+        reinterpret_cast<float*>(param_fp32),
+        reinterpret_cast<uint16_t*>(param_bf16),
+        reinterpret_cast<uint16_t*>(g_bf16),
+        reinterpret_cast<uint8_t*>(m_uint8),
+        reinterpret_cast<uint8_t*>(v_uint8),
+        reinterpret_cast<float*>(m_absmax),
+        reinterpret_cast<float*>(v_absmax),
+        reinterpret_cast<const float*>(qmap_m),
+        reinterpret_cast<const float*>(qmap_v),
+        beta1, beta2, eps, lr, scale, weight_decay, bias_correction1, bias_correction2,
+        bf16_to_fp32_value, bf16_from_fp32_value
+    );
+}
@@ -92,6 +92,7 @@ void adam_fp16_launcher(
     float weight_decay,
     float bias_correction1,
     float bias_correction2,
+    std::uintptr_t skip,
     uintptr_t stream
 );
 void adam_bf16_launcher(
@@ -107,5 +108,97 @@ void adam_bf16_launcher(
     float weight_decay,
     float bias_correction1,
     float bias_correction2,
+    std::uintptr_t skip,
     uintptr_t stream
 );
+void adam_fp32_launcher(
+    int n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t g_fp32,
+    std::uintptr_t m_fp32,
+    std::uintptr_t v_fp32,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    std::uintptr_t skip,
+    uintptr_t stream
+);
+void adam_8bit_fp16_launcher(
+    int n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t param_fp16,
+    std::uintptr_t g_fp16,
+    std::uintptr_t m_uint8,
+    std::uintptr_t v_uint8,
+    std::uintptr_t m_absmax,
+    std::uintptr_t v_absmax,
+    std::uintptr_t qmap_m,
+    std::uintptr_t qmap_v,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    std::uintptr_t skip,
+    uintptr_t stream
+);
+void adam_8bit_bf16_launcher(
+    int n,
+    std::uintptr_t param_fp32,
+    std::uintptr_t param_bf16,
+    std::uintptr_t g_bf16,
+    std::uintptr_t m_uint8,
+    std::uintptr_t v_uint8,
+    std::uintptr_t m_absmax,
+    std::uintptr_t v_absmax,
+    std::uintptr_t qmap_m,
+    std::uintptr_t qmap_v,
+    float beta1, float beta2,
+    float eps, float lr,
+    float scale,
+    float weight_decay,
+    float bias_correction1,
+    float bias_correction2,
+    std::uintptr_t skip,
+    uintptr_t stream
+);
+void multi_tensor_grad_norm_fp16_launcher(
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+);
+void multi_tensor_grad_norm_bf16_launcher(
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+);
+void multi_tensor_grad_norm_fp32_launcher(
+    int32_t num_chunks,
+    std::uintptr_t chunk_tensor,
+    std::uintptr_t chunk_offset,
+    std::uintptr_t ptrs,
+    std::uintptr_t numels,
+    int64_t chunk_size,
+    float norm_type,
+    std::uintptr_t partial,
+    std::uintptr_t flag,
+    std::uintptr_t stream
+);
@@ -27,6 +27,24 @@ std::uintptr_t pyNCCLCommInitRank(py::bytes byteUniqueID, int world_size, int ra
     return reinterpret_cast<std::uintptr_t>(comm);
 }
 
+bool pyNCCLHasCommSplit() {
+#if defined(NCCL_VERSION_CODE) && NCCL_VERSION_CODE >= NCCL_VERSION(2, 18, 0)
+    return true;
+#else
+    return false;
+#endif
+}
+
+std::uintptr_t pyNCCLCommSplit(std::uintptr_t ptrcomm, int color, int key) {
+#if defined(NCCL_VERSION_CODE) && NCCL_VERSION_CODE >= NCCL_VERSION(2, 18, 0)
+    ncclComm_t comm;
+    checkNCCLStatus(ncclCommSplit(reinterpret_cast<ncclComm_t>(ptrcomm), color, key, &comm, NULL));
+    return reinterpret_cast<std::uintptr_t>(comm);
+#else
+    throw std::logic_error("ncclCommSplit requires NCCL 2.18 or later");
+#endif
+}
+
 void pyNCCLCommDestroy(std::uintptr_t ptrcomm) {
     ncclComm_t comm = reinterpret_cast<ncclComm_t>(ptrcomm);
     checkNCCLStatus(ncclCommDestroy(comm));
@@ -6,6 +6,10 @@ def main():
     bmt.benchmark.all_gather()
     bmt.print_rank("===== Reduce Scatter =====")
     bmt.benchmark.reduce_scatter()
+    bmt.print_rank("===== Checkpoint I/O =====")
+    bmt.benchmark.checkpoint_io()
+    bmt.print_rank("====== Import Time =======")
+    bmt.benchmark.import_time()
     
 
 if __name__ == '__main__':
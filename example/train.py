@@ -65,6 +65,16 @@ def main():
     optim_manager = optim.OptimManager(loss_scale=2**20)
     optim_manager.add_optimizer(optimizer, lr_scheduler)
 
+    # throughput, MFU, loss scale and memory of every step, written in the background
+    metrics = bmt.metrics.MetricsExporter(
+        "metrics",
+        model,
+        tokens_per_step=batch_size * seq_len,
+        seq_len=seq_len,
+        attn_dim=32 * 80 // config["tp_size"],
+        optim_manager=optim_manager,
+    )
+
     bmt.synchronize()
     
     avg_time_recorder = bmt.utils.AverageRecorder()
@@ -109,6 +119,7 @@ def main():
             )
 
         optim_manager.step()
+        metrics.step(loss, lr=lr_scheduler.current_lr)
 
         # record time and loss
         iteration_time = time.time() - st
@@ -132,6 +143,7 @@ def main():
         if iteration % 1000 == 0:
             bmt.save(model, "ckpt-%d.pt" % iteration)
     
+    metrics.close()
     bmt.save(model, "checkpoint.pt")
 
 if __name__ == '__main__':
@@ -107,6 +107,9 @@ setup(
         "nvidia-nccl-cu11>=2.14.3"
     ],
     ext_modules=ext_modules,
+    entry_points={
+        'console_scripts': ['bmtrain-reshard=bmtrain.reshard:main']
+    },
     cmdclass={
         'build_ext': CMakeBuild
     })
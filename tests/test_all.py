@@ -4,11 +4,24 @@ from tqdm import tqdm
 
 tq = tqdm([
     ("different_output_shape", 1),
-    ("load_ckpt", 1),
+    ("lazy_import", 1),
+    ("load_ckpt", 2),
+    ("load_sharded", 2),
+    ("weight_stream", 2),
     ("init_parameters", 1),
     ("synchronize", 4),
+    ("object_ops", 4),
     ("init_parameters_multi_gpu", 4),
+    ("meta_init", 2),
+    ("partition_init", 2),
+    ("profiler", 2),
+    ("memory_tracer", 2),
+    ("straggler", 2),
+    ("metrics", 2),
+    ("inspect_model", 2),
+    ("inspect_tensor_streaming", 2),
     ("optim_state", 4),
+    ("optim_sharded", 2),
 
     ("requires_grad", 1),
     ("requires_grad_multi_gpu", 2),
@@ -17,6 +30,9 @@ tq = tqdm([
     ("loss_func", 1),
 
     ("optim", 1),
+    ("optim_8bit", 1),
+    ("optim_adafactor", 1),
+    ("loss_scale", 1),
 
     ("multi_return", 2),
     ("middle_hidden", 4),
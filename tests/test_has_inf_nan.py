@@ -28,10 +28,32 @@ def test_main(dtype):
         check(x, 1)
     print("That's right")
 
+def test_grad_norm(dtype):
+    for sizes in [[1], [100, 1000], [65536, 65537, 3], [1000000, 7, 200000]]:
+        xs = [torch.randn((i,)).to(dtype).cuda() for i in sizes]
+        ref = torch.cat([x.float() for x in xs])
+        for norm_type in [2, 1, float("inf")]:
+            out = torch.zeros(2, dtype=torch.float32, device="cuda")
+            F.multi_tensor_grad_norm(xs, norm_type, out)
+            if norm_type == float("inf"):
+                assert_lt(abs(out[0].item() - ref.abs().max().item()), 1e-6)
+            else:
+                expected = ref.abs().pow(norm_type).sum().item()
+                assert_lt(abs(out[0].item() - expected) / expected, 1e-4)
+            assert_eq(out[1].item(), 0)
+        xs[-1][random.randint(0, sizes[-1]-1)] = float("nan")
+        out = torch.zeros(2, dtype=torch.float32, device="cuda")
+        F.multi_tensor_grad_norm(xs, 2, out)
+        assert_eq(out[1].item(), 1)
+    print("That's right")
+
 if __name__ == "__main__":
     test_main(torch.float16)
+    for dtype in [torch.float16, torch.float32]:
+        test_grad_norm(dtype)
     print("==============================================================================")
     try:
         test_main(torch.bfloat16)
+        test_grad_norm(torch.bfloat16)
     except NotImplementedError: 
         pass
@@ -0,0 +1,51 @@
+from utils import *
+import torch
+import bmtrain as bmt
+
+class Layer(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.w = bmt.DistributedParameter(torch.empty(333, 17), init_method=torch.nn.init.normal_)
+        self.b = bmt.DistributedParameter(torch.empty(17), init_method=torch.nn.init.uniform_)
+
+    def forward(self, x):
+        return x @ self.w + self.b
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.scale = bmt.DistributedParameter(torch.empty(1001), init_method=torch.nn.init.normal_)
+        self.layers = bmt.TransformerBlockList([bmt.Block(Layer()) for _ in range(3)])
+
+    def forward(self, x):
+        return self.layers(x).sum() + self.scale.sum()
+
+def test_inspect_model():
+    model = Model()
+    bmt.init_parameters(model)
+    loss = model(torch.randn(4, 333, device="cuda"))
+    loss.backward()
+
+    ret = bmt.inspect.inspect_model(model, "*")
+    state = model.state_dict()
+    assert_eq([it["name"] for it in ret], list(state.keys()))
+    for it in ret:
+        p = state[it["name"]].float()
+        assert_eq(it["shape"], tuple(p.shape))
+        assert abs(it["mean"] - p.mean().item()) < 1e-5
+        assert abs(it["std"] - p.std().item()) < 1e-5
+        assert_eq(it["max"], p.max().item())
+        assert_eq(it["min"], p.min().item())
+
+    # the gradient of the bias is the batch size
+    bias = [it for it in bmt.inspect.inspect_model(model, "layers.*.b")]
+    assert_eq(len(bias), 3)
+    for it in bias:
+        assert abs(it["grad_mean"] - 4) < 1e-5
+        assert abs(it["grad_std"]) < 1e-5
+    bmt.print_rank("inspect_model test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_inspect_model()
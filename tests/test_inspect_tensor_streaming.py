@@ -0,0 +1,66 @@
+from utils import *
+import torch
+import bmtrain as bmt
+from bmtrain import inspect
+from bmtrain.inspect.tensor import InspectTensorManager
+
+class Layer(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.w = bmt.DistributedParameter(torch.empty(64, 64), init_method=torch.nn.init.xavier_normal_)
+
+    def forward(self, x):
+        x = x @ self.w
+        inspect.record_tensor(x, "hidden")
+        return x
+
+def make_model():
+    torch.manual_seed(1)
+    model = bmt.TransformerBlockList([bmt.Block(Layer(), use_checkpoint=False) for _ in range(3)])
+    bmt.init_parameters(model)
+    return model
+
+def run(model, **kwargs):
+    torch.manual_seed(2)
+    x = torch.randn(8, 64, device="cuda", requires_grad=True)
+    weight = torch.randn(8, 64, device="cuda")
+    with inspect.inspect_tensor(**kwargs) as inspector:
+        loss = (model(x) * weight).sum()
+        loss.backward()
+    return inspector
+
+def test_streaming():
+    model = make_model()
+    # the same input on every rank, so the statistics of all ranks are the local ones
+    kept = run(model)
+    summary = run(model, streaming=True, hist_bins=16).get_summary()
+    assert_eq([it["name"] for it in summary], ["0.hidden", "1.hidden", "2.hidden"])
+    for it, ref in zip(summary, kept.summary):
+        x = ref["tensor"].double()
+        assert_eq(it["shape"], (x.size(0) * bmt.world_size(),) + tuple(x.shape[1:]))
+        assert abs(it["mean"] - x.mean().item()) < 1e-5
+        assert abs(it["std"] - x.std().item()) < 1e-5
+        assert abs(it["max"] - x.max().item()) < 1e-5
+        assert abs(it["min"] - x.min().item()) < 1e-5
+        g = ref["tensor"].grad.double()
+        assert abs(it["grad_mean"] - g.mean().item()) < 1e-5
+        assert abs(it["grad_std"] - g.std().item()) < 1e-5
+        inside = ((x >= -10) & (x <= 10)).sum().item()
+        assert_eq(round(sum(it["hist"])), inside * bmt.world_size())
+    bmt.print_rank("streaming test passed")
+
+def test_sampling():
+    model = make_model()
+    first = InspectTensorManager._streaming_steps
+    for step in range(first, first + 4):
+        inspector = run(model, streaming=True, sample_rate=0.5)
+        sampled = int((step + 1) * 0.5) > int(step * 0.5)
+        assert_eq(inspector.sampled, sampled)
+        assert_eq(len(inspector.get_summary()), 3 if sampled else 0)
+    bmt.print_rank("sampling test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_streaming()
+    test_sampling()
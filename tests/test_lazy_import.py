@@ -0,0 +1,39 @@
+from utils import *
+import sys
+import subprocess
+import bmtrain as bmt
+
+HEAVY = ["bmtrain.C", "bmtrain.nn", "bmtrain.optim", "bmtrain.loss", "bmtrain.inspect", "bmtrain.lr_scheduler", "bmtrain.store"]
+
+def loaded_modules(statement):
+    code = "import sys\n{}\nprint(' '.join(sorted(m for m in sys.modules if m.startswith('bmtrain'))))".format(statement)
+    ret = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True, check=True)
+    return set(ret.stdout.split())
+
+def test_lazy_import():
+    modules = loaded_modules("import bmtrain")
+    for name in HEAVY:
+        assert_eq(name in modules, False)
+
+    # subpackages and functions are loaded on first access
+    modules = loaded_modules("import bmtrain as bmt\nbmt.optim.AdamOptimizer\nfrom bmtrain import save")
+    assert_eq("bmtrain.optim" in modules, True)
+    assert_eq("bmtrain.store" in modules, True)
+    assert_eq("bmtrain.nn" in modules, False)
+    bmt.print_rank("lazy import test passed")
+
+def test_attributes():
+    assert_eq(callable(bmt.save) and callable(bmt.load_sharded), True)
+    assert_eq("nn" in dir(bmt), True)
+    try:
+        bmt.not_a_module
+        assert False
+    except AttributeError:
+        pass
+    bmt.print_rank("lazy attributes test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_lazy_import()
+    test_attributes()
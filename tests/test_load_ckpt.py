@@ -3,6 +3,9 @@ import torch
 import torch.nn.functional as F
 import bmtrain as bmt
 import os
+from collections import OrderedDict
+from bmtrain.mmap_store import MmapStateDict
+from bmtrain.store import DistributedStateDictWrapper, _load_order
 
 class Linear_Normal(torch.nn.Module):
     def __init__(self, in_features : int, out_features: int, bias: bool = True, dtype = None) -> None:
@@ -72,7 +75,144 @@ def test_main():
         assert (m.state_dict()[key] == m4.state_dict()[key].cuda()).all(), "wrong param in bmtrain model"
     print("bmt.distributedmodule load_state_dict and state_dict test passed")
 
+def test_mmap():
+    ckpt_path = "test_ckpt_mmap.pt"
+    m = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(2)])
+    bmt.init_parameters(m)
+    bmt.save(m, ckpt_path, mmap=True)
+
+    m2 = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(2)])
+    bmt.load(m2, ckpt_path)
+    state, state2 = m.state_dict(), m2.state_dict()
+    for key in state:
+        assert (state[key] == state2[key]).all(), "wrong param in memory mapped checkpoint"
+
+    # the same file can also be read without bmtrain
+    dic = MmapStateDict(ckpt_path)
+    for key in state:
+        assert (dic[key] == state[key].cpu()).all(), "wrong tensor in memory mapped checkpoint"
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        os.remove(ckpt_path)
+    print("memory mapped checkpoint test passed")
+
+def test_mmap_hooks():
+    ckpt_path = "test_ckpt_mmap_hooks.pt"
+    m = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(2)])
+    bmt.init_parameters(m)
+
+    def cast(module, state_dict, prefix, local_metadata):
+        # returns a new dict, with the values changed
+        return OrderedDict((k, v.float()) for k, v in state_dict.items())
+    m._register_state_dict_hook(cast)
+    bmt.save(m, ckpt_path, mmap=True)
+
+    state = m.state_dict()
+    dic = MmapStateDict(ckpt_path)
+    assert_eq(sorted(dic.keys()), sorted(state.keys()))
+    for key in state:
+        assert_eq(dic[key].dtype, torch.float32)
+        assert (dic[key] == state[key].cpu()).all(), "wrong tensor in memory mapped checkpoint with hooks"
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        os.remove(ckpt_path)
+    print("memory mapped checkpoint with hooks test passed")
+
+def test_bucket_load():
+    ckpt_path = "test_ckpt_bucket.pt"
+    m = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(3)])
+    bmt.init_parameters(m)
+    bmt.save(m, ckpt_path)
+    state = m.state_dict()
+
+    # tiny buckets, a tensor larger than the bucket and the per tensor broadcast
+    for bucket_size in [4096, 1024, None]:
+        m2 = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(3)])
+        bmt.load(m2, ckpt_path, bucket_size=bucket_size)
+        state2 = m2.state_dict()
+        for key in state:
+            assert (state[key] == state2[key]).all(), "wrong param loaded with bucket size {}".format(bucket_size)
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        os.remove(ckpt_path)
+    print("bucketed broadcast load test passed")
+
+def test_bucket_unexpected_and_out_of_order():
+    ckpt_path = "test_ckpt_bucket_extra.pt"
+    m = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(3)])
+    bmt.init_parameters(m)
+    state = m.state_dict()
+    if bmt.rank() == 0:
+        # a key the model does not have, first in the file
+        extra = {"extra.weight": torch.randn(1024, 1024).half()}
+        extra.update(state)
+        torch.save(extra, ckpt_path)
+    bmt.synchronize()
+
+    m2 = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(3)])
+    ret = bmt.load(m2, ckpt_path, strict=False, bucket_size=4096)
+    assert_eq(list(ret.unexpected_keys), ["extra.weight"])
+    state2 = m2.state_dict()
+    for key in state:
+        assert (state[key] == state2[key]).all(), "wrong param loaded next to an unexpected key"
+
+    # the unexpected key is never packed, the buckets follow the order of the model
+    loaded = torch.load(ckpt_path) if bmt.rank() == 0 else {}
+    order = _load_order(m2)
+    wrapper = DistributedStateDictWrapper(loaded, 4096, order)
+    # every rank plans the buckets from the broadcasted manifest, not only the one holding the file
+    assert "extra.weight" not in wrapper._bucket_of
+    assert_eq([k for keys in wrapper._bucket_keys for k in keys], order)
+
+    # out of order: only the accessed bucket and the next one are live, skipped buckets are
+    # freed, and their keys are broadcasted on their own
+    access = order[len(order) // 2:] + order[:len(order) // 2]
+    for key in access:
+        value = wrapper[key].broadcast()
+        assert (value.cpu() == state[key].cpu()).all(), "wrong tensor loaded out of order"
+        assert sum(b is not None for b in wrapper._buckets) <= 2
+    assert_eq(sum(wrapper._issued), len(wrapper._buckets) - wrapper._bucket_of[access[0]][0])
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        os.remove(ckpt_path)
+    print("bucketed load with unexpected keys and out of order access test passed")
+
+def test_compressed():
+    ckpt_path = "test_ckpt_compressed.pt"
+    m = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(2)])
+    bmt.init_parameters(m)
+    bmt.save(m, ckpt_path, mmap=True, compression="zlib")
+
+    m2 = bmt.TransformerBlockList([bmt.Block(Linear_BMT(256, 256, dtype=torch.half)) for _ in range(2)])
+    bmt.load(m2, ckpt_path)
+    state, state2 = m.state_dict(), m2.state_dict()
+    for key in state:
+        assert (state[key] == state2[key]).all(), "wrong param in compressed checkpoint"
+    bmt.synchronize()
+
+    if bmt.rank() == 0:
+        # a flipped byte of a chunk must be detected
+        with open(ckpt_path, "r+b") as f:
+            f.seek(4096 + 16)
+            byte = f.read(1)
+            f.seek(4096 + 16)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        dic = MmapStateDict(ckpt_path)
+        try:
+            for key in dic:
+                dic[key]
+            assert False, "corrupted chunk is not detected"
+        except RuntimeError:
+            pass
+        os.remove(ckpt_path)
+    print("compressed checkpoint test passed")
+
 if __name__ == "__main__":
     bmt.init_distributed()
 
     test_main()
+    test_mmap()
+    test_mmap_hooks()
+    test_bucket_load()
+    test_bucket_unexpected_and_out_of_order()
+    test_compressed()
@@ -0,0 +1,203 @@
+from utils import *
+import torch
+import bmtrain as bmt
+import os
+import shutil
+from bmtrain.sharded_store import _load_entry
+from bmtrain.reshard import reshard, export_full
+from bmtrain.mmap_store import MmapStateDict
+from bmtrain.incremental_store import IncrementalCheckpointer
+from bmtrain.async_store import get_async_checkpointer, AsyncCheckpointer
+
+class TestSubModule(bmt.DistributedModule):
+    def __init__(self):
+        super(TestSubModule, self).__init__()
+        self.fc1 = bmt.BMTrainModelWrapper(torch.nn.Linear(256, 512))
+        self.fc2 = bmt.BMTrainModelWrapper(torch.nn.Linear(512, 256))
+        self.param = bmt.DistributedParameter(torch.zeros(1237), init_method=torch.nn.init.normal_)
+        self.register_buffer("step", torch.zeros(1))
+
+    def forward(self, x):
+        return self.fc2(self.fc1(x)) + self.param[:256]
+
+class TestModule(torch.nn.Module):
+    def __init__(self):
+        super(TestModule, self).__init__()
+        self.layer1 = TestSubModule()
+        self.layers = bmt.TransformerBlockList([bmt.Block(TestSubModule()) for _ in range(2)])
+
+    def forward(self, x):
+        return self.layers(self.layer1(x))
+
+def split(x, split_dim, tp_size, zero_size):
+    """Pieces of ``x`` saved by ``tp_size * zero_size`` ranks."""
+    pieces, shards = [], {}
+    for t, local in enumerate(x.chunk(tp_size, dim=split_dim)):
+        local = local.contiguous().view(-1)
+        size = (local.numel() + zero_size - 1) // zero_size
+        for z in range(zero_size):
+            rank = t * zero_size + z
+            st, ed = z * size, min((z + 1) * size, local.numel())
+            pieces.append([rank, t, st, ed])
+            shards[rank] = {"w": local[st:ed].clone()}
+    info = {"shape": list(x.shape), "split_dim": split_dim if tp_size > 1 else -1, "tp_size": tp_size, "pieces": pieces}
+    return info, shards
+
+def test_reshard():
+    for shape, split_dim in [((6, 8), 1), ((8, 6), 0)]:
+        x = torch.randn(shape)
+        for old_tp, old_zero, new_tp, new_zero in [(2, 2, 1, 3), (2, 3, 4, 1), (1, 4, 2, 3), (4, 1, 2, 2)]:
+            info, shards = split(x, split_dim, old_tp, old_zero)
+            for t, local in enumerate(x.chunk(new_tp, dim=split_dim)):
+                local = local.contiguous().view(-1)
+                size = (local.numel() + new_zero - 1) // new_zero
+                for z in range(new_zero):
+                    st, ed = z * size, min((z + 1) * size, local.numel())
+                    it = {
+                        "key": "w",
+                        "split_dim": split_dim if new_tp > 1 else -1,
+                        "tp_size": new_tp,
+                        "tp_rank": t,
+                        "begin": st,
+                        "end": ed,
+                    }
+                    assert_eq((_load_entry(shards, it, info) == local[st:ed]).all().item(), True)
+    bmt.print_rank("reshard test passed")
+
+def test_main():
+    model1 = TestModule()
+    model2 = TestModule()
+    bmt.init_parameters(model1)
+    for layer in model1.layers:
+        layer.step.fill_(3)
+
+    bmt.save_sharded(model1, "test_load_sharded_ckpt")
+    assert os.path.exists(os.path.join("test_load_sharded_ckpt", "index.json"))
+    bmt.load_sharded(model2, "test_load_sharded_ckpt")
+
+    # the sharded checkpoint must load the same model as the gathered one
+    state1, state2 = model1.state_dict(), model2.state_dict()
+    assert_eq(list(state1.keys()), list(state2.keys()))
+    for key in state1:
+        assert_eq((state1[key] == state2[key]).all().item(), True)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        shutil.rmtree("test_load_sharded_ckpt")
+    bmt.print_rank("save_sharded and load_sharded test passed")
+
+def test_non_blocking():
+    model1 = TestModule()
+    model2 = TestModule()
+    bmt.init_parameters(model1)
+    state1 = {k: v.clone() for k, v in model1.state_dict().items()}
+
+    future = bmt.save_sharded(model1, "test_load_sharded_async", non_blocking=True)
+    # the snapshot is taken when save_sharded returns
+    with torch.no_grad():
+        for p in model1.parameters():
+            p.zero_()
+    future.result()
+    bmt.synchronize()
+    # the index is only written once the shards of all ranks are written
+    assert_eq(os.path.exists(os.path.join("test_load_sharded_async", "index.json")), False)
+    get_async_checkpointer().wait()
+    assert_eq(os.path.exists(os.path.join("test_load_sharded_async", "index.json")), True)
+
+    bmt.load_sharded(model2, "test_load_sharded_async")
+    state2 = model2.state_dict()
+    for key in state1:
+        assert_eq((state1[key] == state2[key]).all().item(), True)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        shutil.rmtree("test_load_sharded_async")
+    bmt.print_rank("non-blocking save_sharded test passed")
+
+def test_writer_died():
+    model = TestModule()
+    bmt.init_parameters(model)
+    checkpointer = AsyncCheckpointer()
+    # e.g. killed by the OOM killer
+    checkpointer._process.kill()
+    checkpointer._process.join()
+
+    future = checkpointer.save(model, "test_load_sharded_died")
+    try:
+        checkpointer.wait()
+        assert False, "a dead writer must fail the checkpoint"
+    except RuntimeError:
+        pass
+    assert_eq(future.done(), True)
+    checkpointer.close()
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        assert_eq(os.path.exists(os.path.join("test_load_sharded_died", "index.json")), False)
+        shutil.rmtree("test_load_sharded_died", ignore_errors=True)
+    bmt.print_rank("dead async writer test passed")
+
+def test_convert():
+    model1 = TestModule()
+    model2 = TestModule()
+    bmt.init_parameters(model1)
+    state1 = model1.state_dict()
+
+    bmt.save_sharded(model1, "test_convert_src")
+    if bmt.rank() == 0:
+        reshard("test_convert_src", "test_convert_dst", tp_size=2, num_shards=6,
+                split_rules=[(r"fc1\.weight$", 0)], num_workers=2)
+        export_full("test_convert_dst", "test_convert_full.bin")
+    bmt.synchronize()
+
+    bmt.load_sharded(model2, "test_convert_dst")
+    state2 = model2.state_dict()
+    full = MmapStateDict("test_convert_full.bin")
+    assert_eq(list(state1.keys()), list(full.keys()))
+    for key in state1:
+        assert_eq((state1[key] == state2[key]).all().item(), True)
+        assert_eq((state1[key] == full[key]).all().item(), True)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        shutil.rmtree("test_convert_src")
+        shutil.rmtree("test_convert_dst")
+        os.remove("test_convert_full.bin")
+    bmt.print_rank("offline reshard test passed")
+
+def test_incremental():
+    model1 = TestModule()
+    model2 = TestModule()
+    bmt.init_parameters(model1)
+    ckpt = IncrementalCheckpointer(chunk_size=1024, compact_every=1)
+
+    assert_eq(ckpt.save(model1, "test_incremental_0"), True)
+    with torch.no_grad():
+        model1.layer1.param.add_(1)
+    assert_eq(ckpt.save(model1, "test_incremental_1"), False)
+    # only the changed parameter is in the delta
+    delta = torch.load(os.path.join("test_incremental_1", "model_rank{:05d}.delta.pt".format(bmt.rank())))
+    assert_eq(set(delta.keys()) <= {"layer1.param"}, True)
+
+    bmt.load_sharded(model2, "test_incremental_1")
+    state1, state2 = model1.state_dict(), model2.state_dict()
+    for key in state1:
+        assert_eq((state1[key] == state2[key]).all().item(), True)
+    # the next save after compact_every deltas is a full base
+    assert_eq(ckpt.save(model1, "test_incremental_2"), True)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        for i in range(3):
+            shutil.rmtree("test_incremental_{}".format(i))
+    bmt.print_rank("incremental save_sharded test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_reshard()
+    test_main()
+    test_non_blocking()
+    test_writer_died()
+    test_convert()
+    test_incremental()
@@ -0,0 +1,55 @@
+from utils import *
+import torch
+import bmtrain as bmt
+
+class TestModule(torch.nn.Module):
+    def __init__(self):
+        super(TestModule, self).__init__()
+        self.fc1 = torch.nn.Linear(128, 128, bias=False)
+        self.fc2 = torch.nn.Linear(128, 128)
+        self.param = torch.nn.Parameter(torch.empty(1237))
+
+def main(dtype):
+    models = [TestModule() for _ in range(4)]
+    state_dict = models[0].state_dict()
+    for kw in state_dict.keys():
+        state_dict[kw] = torch.randn_like(state_dict[kw])
+    for model in models:
+        model.load_state_dict(state_dict)
+    models = [model.cuda().to(dtype) for model in models]
+
+    managers = [
+        bmt.optim.OptimManager(loss_scale=1024, loss_scale_steps=5),
+        bmt.optim.OptimManager(loss_scale=1024, loss_scale_steps=5, device_loss_scale=True),
+    ]
+    for i, manager in enumerate(managers):
+        manager.add_optimizer(bmt.optim.AdamOptimizer(models[2 * i].parameters(), lr=1e-2))
+        manager.add_optimizer(bmt.optim.AdamOffloadOptimizer(models[2 * i + 1].parameters(), lr=1e-2))
+
+    for it in range(40):
+        for manager in managers:
+            manager.zero_grad()
+        for ps in zip(*[model.parameters() for model in models]):
+            grad = torch.randn_like(ps[0]) * managers[0].loss_scale
+            if it % 7 == 3:
+                grad[0] = float("inf")
+            for p in ps:
+                p.grad = grad.to(dtype)
+        for manager in managers:
+            manager.step()
+
+    # the host copy of the device scale lags by one step
+    managers[1].state_dict()
+    assert_eq(managers[0].loss_scale, managers[1].loss_scale)
+    assert_eq(managers[0].steps_since_last_scale, managers[1].steps_since_last_scale)
+    for p0, p1, p2, p3 in zip(*[model.parameters() for model in models]):
+        assert_lt(torch.abs(p0 - p2).max().item(), 1e-2)
+        assert_lt(torch.abs(p1 - p3).max().item(), 1e-2)
+    for opt0, opt1 in zip(managers[0].optimizers, managers[1].optimizers):
+        for p0, p1 in zip(opt0.state.keys(), opt1.state.keys()):
+            assert_eq(opt0.state[p0]["step"], opt1.state[p1]["step"])
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+    main(torch.float16)
+    main(torch.float32)
@@ -0,0 +1,54 @@
+from utils import *
+import os
+import json
+import shutil
+import torch
+import bmtrain as bmt
+
+class Layer(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.fc = bmt.nn.Linear(256, 256)
+
+    def forward(self, x):
+        return torch.relu(self.fc(x))
+
+def run(model, optim_manager):
+    x = torch.randn(32, 256, device="cuda", dtype=torch.half)
+    loss = model(x).float().sum()
+    optim_manager.zero_grad()
+    optim_manager.backward(loss)
+    optim_manager.step()
+
+def test_trace_memory():
+    model = bmt.TransformerBlockList([bmt.Block(Layer()) for _ in range(3)])
+    bmt.init_parameters(model)
+    optim_manager = bmt.optim.OptimManager()
+    optim_manager.add_optimizer(bmt.optim.AdamOptimizer(model.parameters()))
+    run(model, optim_manager)
+
+    with bmt.trace_memory(model, path="test_trace_memory") as tracer:
+        run(model, optim_manager)
+
+    peak = tracer.peak()
+    assert_eq("param_buffer" in peak and "other" in peak, True)
+    # everything tagged in the step is released by its end
+    assert_eq(all(v == 0 for v in tracer._by_category.values()), True)
+    assert_eq(tracer.owner(model[1]), "1")
+    bmt.synchronize()
+
+    with open(os.path.join("test_trace_memory", "memory_rank{:05d}.json".format(bmt.rank()))) as f:
+        trace = json.load(f)
+    assert_eq(len(trace["timeline"]), len(tracer.events))
+    assert_eq(sum(e[3] for e in trace["timeline"]), 0)
+    assert_eq(set(trace["categories"]) >= {"param_buffer", "grad_buffer", "activations"}, True)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        shutil.rmtree("test_trace_memory")
+    bmt.print_rank("trace_memory test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_trace_memory()
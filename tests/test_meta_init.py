@@ -0,0 +1,114 @@
+from utils import *
+import torch
+import bmtrain as bmt
+from bmtrain import block_layer
+from bmtrain.block_layer import OpAllGather
+from bmtrain.partition_init import NormalInit
+from bmtrain.utils import round_up
+
+class Mixed(torch.nn.Module):
+    def __init__(self, device):
+        super().__init__()
+        self.w = bmt.DistributedParameter(
+            torch.empty(256, 64, device=device), init_method=torch.nn.init.xavier_normal_
+        )
+        self.b = bmt.DistributedParameter(
+            torch.empty(256, device=device), init_method=NormalInit(std=0.02)
+        )
+
+    def forward(self, x):
+        return x @ self.w.t() + self.b
+
+class CountingGather:
+    calls = 0
+
+    @staticmethod
+    def apply(param):
+        CountingGather.calls += 1
+        return OpAllGather.apply(param)
+
+def build_blocks(device):
+    CountingGather.calls = 0
+    block_layer.OpAllGather = CountingGather
+    try:
+        model = bmt.TransformerBlockList([bmt.Block(Mixed(device)) for _ in range(2)])
+    finally:
+        block_layer.OpAllGather = OpAllGather
+    return model, CountingGather.calls
+
+class Feedforward(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.w_in = torch.nn.Linear(64, 256)
+        self.w_out = torch.nn.Linear(256, 64)
+
+    def forward(self, x):
+        return self.w_out(torch.relu(self.w_in(x)))
+
+def test_init_parameters():
+    # bmt.nn modules only allocate the partitions of their parameters
+    torch.manual_seed(1234)
+    m1 = bmt.TransformerBlockList([bmt.Block(bmt.nn.Linear(64, 64)) for _ in range(2)])
+    bmt.init_parameters(m1)
+    torch.manual_seed(1234)
+    m2 = bmt.TransformerBlockList([bmt.Block(bmt.nn.Linear(64, 64)) for _ in range(2)])
+    bmt.init_parameters(m2)
+    s1, s2 = m1.state_dict(), m2.state_dict()
+    for key in s1:
+        assert_eq((s1[key] == s2[key]).all().item(), True)
+    bmt.print_rank("meta bmt.nn init test passed")
+
+def test_meta_partition():
+    # a meta parameter only allocates the partition of this rank
+    p = bmt.DistributedParameter(torch.empty(1000, 64, device="meta"))
+    assert_eq(p._from_meta, True)
+    assert_eq(p.storage().size(), round_up(1000 * 64, bmt.world_size()) // bmt.world_size())
+
+    meta, meta_gathers = build_blocks("meta")
+    materialized, gathers = build_blocks("cpu")
+    # parameters built on the meta device are not gathered into the Block storage
+    assert_eq(meta_gathers, 0)
+    assert_eq(gathers, 4)
+    for meta_block, block in zip(meta, materialized):
+        for kw, storage in meta_block._storage_params.items():
+            info = meta_block._storage_info[kw]
+            assert_eq(storage.storage().size(), info["partition_size"])
+            assert_eq(info["partition_size"], round_up(info["total"], bmt.world_size()) // bmt.world_size())
+            assert_eq(storage.numel(), block._storage_params[kw].numel())
+
+    # the same values as building the parameters first and initializing them afterwards
+    torch.manual_seed(1234)
+    bmt.init_parameters(meta)
+    torch.manual_seed(1234)
+    bmt.init_parameters(materialized)
+    s1, s2 = meta.state_dict(), materialized.state_dict()
+    assert_eq(sorted(s1.keys()), sorted(s2.keys()))
+    for key in s1:
+        assert_eq((s1[key] == s2[key]).all().item(), True)
+    bmt.print_rank("meta partition test passed")
+
+def test_wrapper():
+    ref = torch.nn.ModuleList([Feedforward() for _ in range(2)]).cuda()
+    with torch.device("meta"):
+        model = torch.nn.ModuleList([Feedforward() for _ in range(2)])
+    model = bmt.BMTrainModelWrapper(model)
+    for block in model:
+        for it in block._param_info:
+            assert_eq(it["parameter"].device.type, "cuda")
+    model.load_state_dict(ref.state_dict())
+
+    x = torch.randn(4, 64, device="cuda")
+    y1, y2 = x, x
+    for layer in ref:
+        y1 = layer(y1)
+    for layer in model:
+        y2 = layer(y2)
+    assert_all_eq(y1, y2)
+    bmt.print_rank("meta wrapper test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_init_parameters()
+    test_meta_partition()
+    test_wrapper()
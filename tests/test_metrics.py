@@ -0,0 +1,79 @@
+from utils import *
+import os
+import json
+import tempfile
+import torch
+import bmtrain as bmt
+from bmtrain.metrics import MetricsExporter, model_flops
+
+class Layer(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.w = bmt.DistributedParameter(torch.empty(128, 64), init_method=torch.nn.init.xavier_normal_)
+        self.b = bmt.DistributedParameter(torch.empty(64), init_method=torch.nn.init.zeros_)
+
+    def forward(self, x):
+        return x @ self.w + self.b
+
+def make_model():
+    model = bmt.TransformerBlockList([bmt.Block(Layer()) for _ in range(3)])
+    bmt.init_parameters(model)
+    return model
+
+def test_model_flops():
+    model = make_model()
+    # the biases are not linear weights
+    assert_eq(model_flops(model, 16), 3 * 3 * 2 * 16 * 128 * 64)
+    assert_eq(model_flops(model, 16, seq_len=8, attn_dim=32), 3 * 3 * (2 * 16 * 128 * 64 + 4 * 16 * 8 * 32))
+    bmt.print_rank("model_flops test passed")
+
+def run(path, **kwargs):
+    model = make_model()
+    optimizer = bmt.optim.AdamOptimizer(model.parameters())
+    optim_manager = bmt.optim.OptimManager(loss_scale=1024)
+    optim_manager.add_optimizer(optimizer)
+    losses = []
+    with MetricsExporter(path, model, tokens_per_step=16, optim_manager=optim_manager, peak_tflops=100.0, **kwargs) as metrics:
+        for step in range(4):
+            x = torch.randn(16, 64, device="cuda").repeat(1, 2)
+            loss = model(x).pow(2).mean()
+            optim_manager.zero_grad()
+            optim_manager.backward(loss)
+            optim_manager.step()
+            losses.append(loss.item())
+            metrics.step(loss, lr=0.1)
+    return metrics.file, losses
+
+def test_jsonl():
+    with tempfile.TemporaryDirectory() as path:
+        file, losses = run(path)
+        with open(file) as f:
+            records = [json.loads(line) for line in f]
+    assert_eq([r["step"] for r in records], [1, 2, 3, 4])
+    for r, loss in zip(records, losses):
+        assert abs(r["loss"] - loss) < 1e-6
+        assert_eq(r["lr"], 0.1)
+        assert_eq(r["loss_scale"], 1024.0)
+        assert r["step_time"] > 0
+        assert abs(r["mfu"] - r["tflops"] / 100.0) < 1e-9
+        if bmt.world_size() > 1:
+            # the parameters are gathered and the gradients scattered
+            assert r["comm_bytes"] > 0
+    bmt.print_rank("jsonl test passed")
+
+def test_prometheus():
+    with tempfile.TemporaryDirectory() as path:
+        file, _ = run(path, format="prometheus", every=2)
+        assert_eq(os.path.basename(file), "metrics_rank{:05d}.prom".format(bmt.rank()))
+        with open(file) as f:
+            text = f.read()
+    assert 'bmtrain_step{rank="%d"} 4' % bmt.rank() in text
+    assert "bmtrain_tokens_per_sec" in text
+    bmt.print_rank("prometheus test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_model_flops()
+    test_jsonl()
+    test_prometheus()
@@ -0,0 +1,66 @@
+from utils import *
+import bmtrain as bmt
+from bmtrain.global_var import config
+from bmtrain.distributed import all_gather_objects, broadcast_object, gather_objects
+from bmtrain.distributed import object_ops
+
+def test_all_gather():
+    for i in range(10):
+        ret = all_gather_objects({"rank": bmt.rank(), "step": i})
+        assert_eq(ret, [{"rank": r, "step": i} for r in range(bmt.world_size())])
+    bmt.print_rank("all_gather_objects test passed")
+
+def test_broadcast():
+    for src in range(bmt.world_size()):
+        obj = ["hello", src] if bmt.rank() == src else None
+        assert_eq(broadcast_object(obj, config["comm"], src), ["hello", src])
+    # the stages of a pipeline only talk to each other
+    ret = all_gather_objects(config["topology"].stage_id, config["pipe_comm"])
+    assert_eq(ret, list(range(config["pipe_size"])))
+    bmt.print_rank("broadcast_object test passed")
+
+def test_gather():
+    for dst in range(bmt.world_size()):
+        ret = gather_objects(bmt.rank() * 2, config["comm"], dst)
+        if bmt.rank() == dst:
+            assert_eq(ret, [r * 2 for r in range(bmt.world_size())])
+        else:
+            assert_eq(ret, None)
+    bmt.print_rank("gather_objects test passed")
+
+def test_init_time():
+    # the sub-communicators rank like the topology, whether split or bootstrapped
+    assert_eq(bmt.nccl.commRank(config["pipe_comm"]), config["topology"].stage_id)
+    assert_eq(bmt.nccl.commRank(config["pp_zero_comm"]), config["topology"].pp_zero_id)
+    for phase in ["rendezvous", "setup", "comm", "sub_comms", "report", "total"]:
+        assert_eq(phase in config["init_time"], True)
+    bmt.print_rank("init time test passed")
+
+def test_cleanup():
+    store = config["store"]
+    bmt.synchronize()
+    num_keys = store.num_keys()
+    first = object_ops._seq.get("world", 0)
+    for i in range(5):
+        all_gather_objects(i)
+        broadcast_object(i, config["comm"], 0)
+        gather_objects(i, config["comm"], 1)
+    last = object_ops._seq["world"]
+    bmt.synchronize()
+    # the keys of finished collectives are removed from the store
+    assert_eq(store.num_keys(), num_keys)
+    for seq in range(first, last):
+        key = "obj/world/{}".format(seq)
+        keys = [key, key + "/done"] + ["{}/{}".format(key, r) for r in range(bmt.world_size())]
+        for k in keys:
+            assert_eq(store.check([k]), False)
+    bmt.print_rank("object collectives cleanup test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed(pipe_size=2)
+
+    test_all_gather()
+    test_broadcast()
+    test_gather()
+    test_init_time()
+    test_cleanup()
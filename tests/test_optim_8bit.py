@@ -0,0 +1,82 @@
+from utils import *
+import torch
+import bmtrain as bmt
+from bmtrain.optim import _function as F
+
+class TestModule(torch.nn.Module):
+    def __init__(self):
+        super(TestModule, self).__init__()
+        self.fc1 = torch.nn.Linear(128, 128, bias=False)
+        self.fc2 = torch.nn.Linear(128, 128)
+        self.param = torch.nn.Parameter(torch.empty(5237))
+
+    def forward(self, x):
+        return self.fc2(self.fc1(x))
+
+def test_quantize_roundtrip():
+    for signed in [True, False]:
+        x = torch.randn(10000).cuda()
+        if not signed:
+            x = x.abs()
+        codes, absmax = F.quantize_blockwise(x, signed)
+        assert_eq(codes.dtype, torch.uint8)
+        assert_eq(absmax.numel(), (x.numel() + F.QUANT_BLOCK_SIZE - 1) // F.QUANT_BLOCK_SIZE)
+        y = F.dequantize_blockwise(codes, absmax, signed)
+        assert_lt((x - y).abs().max().item(), 0.05 * x.abs().max().item())
+
+def main(dtype):
+    models = [TestModule() for _ in range(4)]
+    state_dict = models[0].state_dict()
+    for kw in state_dict.keys():
+        state_dict[kw] = torch.randn_like(state_dict[kw])
+    for model in models:
+        model.load_state_dict(state_dict)
+    models = [model.cuda().to(dtype) for model in models]
+
+    opts = [
+        bmt.optim.AdamOptimizer(models[0].parameters(), lr=1e-2),
+        bmt.optim.AdamOptimizer(models[1].parameters(), lr=1e-2, quantized_state=True, min_quantized_size=1),
+        bmt.optim.AdamOffloadOptimizer(models[2].parameters(), lr=1e-2),
+        bmt.optim.AdamOffloadOptimizer(models[3].parameters(), lr=1e-2, quantized_state=True, min_quantized_size=1),
+    ]
+    optim_manager = bmt.optim.OptimManager(loss_scale=4)
+    for opt in opts:
+        optim_manager.add_optimizer(opt)
+
+    for _ in range(50):
+        optim_manager.zero_grad()
+        for ps in zip(*[model.parameters() for model in models]):
+            grad = torch.randn_like(ps[0])
+            for p in ps:
+                p.grad = grad.to(dtype)
+        optim_manager.step()
+    torch.cuda.synchronize()
+
+    for opt in [opts[1], opts[3]]:
+        for state in opt.state.values():
+            assert_eq(state["exp_avg"].dtype, torch.uint8)
+            assert_eq(state["exp_avg_sq"].dtype, torch.uint8)
+
+    for p0, p1, p2, p3 in zip(*[model.parameters() for model in models]):
+        assert_lt(torch.abs(p0 - p1).max().item(), 0.1)
+        assert_lt(torch.abs(p2 - p3).max().item(), 0.1)
+
+    # the compact format must round trip
+    for opt, model in [(opts[1], models[1]), (opts[3], models[3])]:
+        state = opt.state_dict()
+        new_opt = type(opt)(model.parameters(), lr=1e-2, quantized_state=True, min_quantized_size=1)
+        new_opt.load_state_dict(state)
+        for p in model.parameters():
+            for name in ["exp_avg", "exp_avg_sq", "exp_avg_absmax", "exp_avg_sq_absmax"]:
+                assert_eq(new_opt.state[p][name].dtype, opt.state[p][name].dtype)
+                assert_all_eq(new_opt.state[p][name].cpu(), opt.state[p][name].cpu())
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+    test_quantize_roundtrip()
+    main(torch.float16)
+    print("==============================================================================")
+    try:
+        main(torch.bfloat16)
+    except NotImplementedError:
+        pass
@@ -0,0 +1,111 @@
+from utils import *
+import torch
+import math
+import os
+import bmtrain as bmt
+from bmtrain import optim
+
+class TestSubModule(bmt.DistributedModule):
+    def __init__(self):
+        super(TestSubModule, self).__init__()
+        self.fc1 = bmt.BMTrainModelWrapper(torch.nn.Linear(256, 512))
+        self.fc2 = bmt.BMTrainModelWrapper(torch.nn.Linear(512, 256))
+        self.param = bmt.DistributedParameter(torch.zeros(1237))
+
+    def forward(self, x):
+        return self.fc2(self.fc1(x)) + self.param[:256]
+
+class TestModule(torch.nn.Module):
+    def __init__(self):
+        super(TestModule, self).__init__()
+        self.layer = bmt.Block(TestSubModule())
+
+    def forward(self, x):
+        return self.layer(x)
+
+def reference_step(p, grad, state, lr, eps=1e-30, clip_threshold=1.0, decay_rate=-0.8):
+    state["step"] = state.get("step", 0) + 1
+    beta2t = 1.0 - math.pow(state["step"], decay_rate)
+    g_sq = grad * grad + eps
+    if p.dim() == 2:
+        if "row" not in state:
+            state["row"] = torch.zeros(p.size(0), device=p.device)
+            state["col"] = torch.zeros(p.size(1), device=p.device)
+        state["row"].mul_(beta2t).add_(g_sq.mean(1), alpha=1.0 - beta2t)
+        state["col"].mul_(beta2t).add_(g_sq.mean(0), alpha=1.0 - beta2t)
+        v = torch.outer(state["row"], state["col"]) / state["row"].mean()
+    else:
+        if "v" not in state:
+            state["v"] = torch.zeros_like(p)
+        state["v"].mul_(beta2t).add_(g_sq, alpha=1.0 - beta2t)
+        v = state["v"]
+    u = grad * v.rsqrt()
+    u.div_(max(1.0, u.pow(2).mean().sqrt().item() / clip_threshold))
+    p.add_(u, alpha=-lr)
+
+def test_reference():
+    p1 = torch.nn.Parameter(torch.randn(256, 128).cuda())
+    p2 = torch.nn.Parameter(torch.randn(300).cuda())
+    ref = [p1.detach().clone(), p2.detach().clone()]
+    ref_states = [{}, {}]
+    opt = optim.AdafactorOptimizer([p1, p2], lr=1e-2)
+    for _ in range(20):
+        for p, r, s in zip([p1, p2], ref, ref_states):
+            grad = torch.randn_like(p)
+            p.grad = grad * 4
+            reference_step(r, grad, s, lr=1e-2)
+        opt.step(scale=4)
+    assert_lt((p1 - ref[0]).abs().max().item(), 1e-4)
+    assert_lt((p2 - ref[1]).abs().max().item(), 1e-4)
+    assert_eq(opt.state[p1]["exp_avg_sq_row"].numel(), 256)
+    assert_eq(opt.state[p1]["exp_avg_sq_col"].numel(), 128)
+    assert_eq(opt.state[p2]["exp_avg_sq"].numel(), 300)
+
+def main():
+    model1 = TestModule()
+    model2 = TestModule()
+    bmt.init_parameters(model1)
+    bmt.save(model1, "test_optim_adafactor.pt")
+    bmt.load(model2, "test_optim_adafactor.pt")
+
+    # per-parameter slices and the flat storage of the Block must be stepped identically
+    opt1 = optim.AdafactorOptimizer(model1.parameters(), lr=1e-2, min_dim_size_to_factor=64)
+    opt2 = optim.AdafactorOptimizer(
+        [p for _, params in bmt.grouped_parameters(model2) for p in params],
+        lr=1e-2,
+        min_dim_size_to_factor=64,
+    )
+    optim_manager = optim.OptimManager(loss_scale=256)
+    optim_manager.add_optimizer(opt1)
+    optim_manager.add_optimizer(opt2)
+
+    x = torch.randn((4, 256)).cuda()
+    for _ in range(10):
+        optim_manager.zero_grad()
+        y1, y2 = model1(x), model2(x)
+        w = torch.randn_like(y1)
+        optim_manager.backward((y1 * w).sum() + (y2 * w).sum())
+        optim_manager.step()
+
+    for p1, p2 in zip(model1.parameters(), model2.parameters()):
+        assert_lt((p1 - p2).abs().max().item(), 1e-5)
+
+    # the gathered state is expanded per element and factored again on load
+    state = opt1.state_dict(gather=True)
+    assert state["is_whole"]
+    new_opt = optim.AdafactorOptimizer(model1.parameters(), lr=1e-2, min_dim_size_to_factor=64)
+    new_opt.load_state_dict(state)
+    for p in model1.parameters():
+        if p not in opt1.state or p.numel() == 0:
+            continue
+        v_old = opt1._dense_exp_avg_sq(p, opt1.state[p])
+        v_new = new_opt._dense_exp_avg_sq(p, new_opt.state[p])
+        assert_lt(((v_new - v_old).abs() / v_old).max().item(), 1e-4)
+
+    if bmt.rank() == 0:
+        os.remove("test_optim_adafactor.pt")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+    test_reference()
+    main()
@@ -0,0 +1,152 @@
+from utils import *
+import torch
+import bmtrain as bmt
+import os
+import json
+import shutil
+from bmtrain import optim, lr_scheduler
+
+class TestSubModule(bmt.DistributedModule):
+    def __init__(self):
+        super(TestSubModule, self).__init__()
+        self.fc1 = bmt.BMTrainModelWrapper(torch.nn.Linear(768, 1024))
+        self.fc2 = bmt.BMTrainModelWrapper(torch.nn.Linear(1024, 768))
+        self.param = bmt.DistributedParameter(torch.zeros(1237))
+
+    def forward(self, x):
+        return self.fc2(self.fc1(x)) + self.param[:768]
+
+class TestModule(torch.nn.Module):
+    def __init__(self):
+        super(TestModule, self).__init__()
+        self.layer1 = TestSubModule()
+        self.layer2 = bmt.Block(TestSubModule())
+
+    def forward(self, x):
+        return self.layer2(self.layer1(x))
+
+def build(ckpt):
+    models = [TestModule() for _ in range(3)]
+    for model in models:
+        bmt.load(model, ckpt)
+    opts = [
+        optim.AdamOptimizer(models[0].parameters(), weight_decay=1e-3),
+        optim.AdamOffloadOptimizer(models[1].parameters(), weight_decay=1e-3),
+        optim.AdafactorOptimizer(
+            [p for _, params in bmt.grouped_parameters(models[2]) for p in params],
+            lr=1e-2,
+        ),
+    ]
+    optim_manager = optim.OptimManager(loss_scale=256)
+    for opt in opts:
+        optim_manager.add_optimizer(
+            opt, lr_scheduler.Noam(opt, start_lr=1e-2, warmup_iter=0, end_iter=300, num_iter=1)
+        )
+    return models, optim_manager
+
+def train(models, optim_manager):
+    torch.manual_seed(33)
+    x = torch.randn((4, 768)).cuda()
+    for _ in range(5):
+        optim_manager.zero_grad()
+        ys = [model(x) for model in models]
+        w = torch.randn_like(ys[0])
+        optim_manager.backward(sum((y * w).sum() for y in ys))
+        optim_manager.step()
+    return [[p.detach().clone() for p in model.parameters()] for model in models]
+
+def gather_state(value, numel):
+    # partitions are contiguous and of the same size, but the last one
+    n = (numel + bmt.world_size() - 1) // bmt.world_size()
+    local = torch.zeros(n, dtype=torch.float32, device="cuda")
+    local[: value.numel()] = value.view(-1).float().cuda()
+    return bmt.distributed.all_gather(local).view(-1)[:numel]
+
+def zero_reshard(ckpt):
+    ckpt_dir = "test_optim_sharded_zero_ckpt"
+    # without ZeRO: every rank holds whole parameters and optimizer states
+    zero_comm = bmt.config["zero_comm"]
+    bmt.config["zero_comm"] = bmt.nccl.commInitRank(bmt.nccl.getUniqueId(), 1, 0)
+    try:
+        old_models, old_manager = build(ckpt)
+        train(old_models, old_manager)
+        old_manager.save_sharded(ckpt_dir)
+    finally:
+        bmt.config["zero_comm"] = zero_comm
+
+    models, optim_manager = build(ckpt)
+    optim_manager.load_sharded(ckpt_dir)
+    # adafactor refactors second moments of rows cut by a partition, only adam is exact
+    for i in range(2):
+        old_opt, opt = old_manager.optimizers[i], optim_manager.optimizers[i]
+        old_params = [p for group in old_opt.param_groups for p in group["params"]]
+        params = [p for group in opt.param_groups for p in group["params"]]
+        assert_eq(len(old_params), len(params))
+        for old_p, p in zip(old_params, params):
+            old_state, state = old_opt.state[old_p], opt.state[p]
+            assert_eq(sorted(old_state.keys()), sorted(state.keys()))
+            for key, old_v in old_state.items():
+                v = state[key]
+                if isinstance(old_v, torch.Tensor) and old_v.numel() == old_p.numel():
+                    gathered = gather_state(v, old_v.numel())
+                    assert_lt((gathered - old_v.view(-1).float().cuda()).abs().max().item(), 1e-6)
+                else:
+                    assert_eq(v, old_v)
+    bmt.print_rank("zero reshard passed")
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        shutil.rmtree(ckpt_dir)
+
+def main():
+    ckpt = "test_optim_sharded.pt"
+    ckpt_dir = "test_optim_sharded_ckpt"
+    bmt.save(TestModule(), ckpt)
+
+    models, optim_manager = build(ckpt)
+    train(models, optim_manager)
+    for i, model in enumerate(models):
+        bmt.save(model, f"test_optim_sharded_model{i}.pt")
+    optim_manager.save_sharded(ckpt_dir)
+    ref = train(models, optim_manager)
+
+    assert os.path.exists(os.path.join(ckpt_dir, "optim_rank{:05d}.pt".format(bmt.rank())))
+
+    def check(kind, num_exact):
+        models, optim_manager = build(ckpt)
+        for i, model in enumerate(models):
+            bmt.load(model, f"test_optim_sharded_model{i}.pt")
+        optim_manager.load_sharded(ckpt_dir)
+        assert_eq(optim_manager.loss_scale, 256)
+        chk = train(models, optim_manager)
+        for ref_params, chk_params in zip(ref[:num_exact], chk[:num_exact]):
+            for rp, p in zip(ref_params, chk_params):
+                assert_lt((rp - p).abs().max().item(), 1e-5)
+        bmt.print_rank(f"{kind} passed")
+
+    check("same layout", 3)
+
+    # a different world size in the manifest makes every rank read the overlapping pieces
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        with open(os.path.join(ckpt_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        manifest["world_size"] = -1
+        with open(os.path.join(ckpt_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+    bmt.synchronize()
+    # adafactor refactors second moments of rows cut by a partition, only adam is exact
+    check("reshard", 2)
+
+    zero_reshard(ckpt)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        os.remove(ckpt)
+        for i in range(3):
+            os.remove(f"test_optim_sharded_model{i}.pt")
+        shutil.rmtree(ckpt_dir)
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+    main()
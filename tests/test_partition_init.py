@@ -0,0 +1,92 @@
+from utils import *
+import torch
+import bmtrain as bmt
+from bmtrain.param_init import init_distributed_parameter
+from bmtrain.partition_init import NormalInit, UniformInit, zeros_init, scaled_normal_init
+
+class Layer(bmt.DistributedModule):
+    def __init__(self):
+        super().__init__()
+        self.w = bmt.DistributedParameter(torch.empty(123, 77, device="meta"), init_method=NormalInit(std=0.02))
+        self.u = bmt.DistributedParameter(torch.empty(1001, device="meta"), init_method=UniformInit(-1, 1))
+        self.z = bmt.DistributedParameter(torch.empty(64, device="meta"), init_method=zeros_init())
+        self.o = bmt.DistributedParameter(torch.empty(77, 123, device="meta"), init_method=scaled_normal_init(0.02, 4))
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = Layer()
+        self.layers = bmt.TransformerBlockList([bmt.Block(Layer()) for _ in range(2)])
+
+def reference(model):
+    # what a single rank computes for the full parameters
+    ret = {}
+    for name, param in model.named_parameters():
+        full = torch.empty(param._original_shape, dtype=param.dtype, device="cuda")
+        param._init_method.fill_(full.view(-1), name)
+        ret[name] = full
+    return ret
+
+def test_partition_init():
+    model = Model()
+    bmt.init_parameters(model)
+    state = model.state_dict()
+    ref = reference(model)
+    assert_eq(set(state.keys()), set(ref.keys()))
+    for key in state:
+        assert_eq((state[key].cuda() == ref[key]).all().item(), True)
+
+    # different names give different values
+    assert_eq((state["layers.0.w"] == state["layers.1.w"]).all().item(), False)
+    w = state["embed.w"].float()
+    assert abs(w.mean().item()) < 2e-3
+    assert abs(w.std().item() - 0.02) < 2e-3
+    u = state["embed.u"]
+    assert_eq(((u > -1) & (u < 1)).all().item(), True)
+    assert_eq((state["embed.z"] == 0).all().item(), True)
+    bmt.print_rank("partition init test passed")
+
+def test_block_init():
+    m1, m2 = Model(), Model()
+    bmt.init_parameters(m1)
+    for name, module in m2.named_modules():
+        if isinstance(module, bmt.Block):
+            module.init_parameters(name + ".")
+        elif name == "embed":
+            init_distributed_parameter(
+                [p for _, p in module.named_parameters()],
+                [name + "." + n for n, _ in module.named_parameters()],
+            )
+    # initializing the blocks one by one gives the values of initializing the model
+    s1, s2 = m1.state_dict(), m2.state_dict()
+    for key in s1:
+        assert_eq((s1[key] == s2[key]).all().item(), True)
+
+    # the values depend on the name in the model, it can not be guessed by a block
+    try:
+        m2.layers[0].init_parameters()
+        assert False, "a block with partition_init parameters requires its prefix"
+    except ValueError:
+        pass
+    bmt.print_rank("block init test passed")
+
+def test_tensor_parallel():
+    if bmt.config["tp_size"] == 1:
+        return
+    # the local part of a (16, 15 * tp_size) parameter split on dim 1
+    p = bmt.DistributedParameter(
+        torch.empty(16, 15, device="meta"), init_method=NormalInit(), tp_mode=True, tp_split_dim=1,
+    )
+    init_distributed_parameter([p], ["p"])
+    full = torch.empty(16, 15 * bmt.config["tp_size"], device="cuda")
+    NormalInit().fill_(full.view(-1), "p")
+    local = full.chunk(bmt.config["tp_size"], dim=1)[bmt.config["topology"].tp_id].contiguous().view(-1)
+    assert_eq((local[p._start_partition : p._end_partition] == p.data).all().item(), True)
+    bmt.print_rank("tensor parallel partition init test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed(tp_size=2)
+
+    test_partition_init()
+    test_block_init()
+    test_tensor_parallel()
@@ -0,0 +1,61 @@
+from utils import *
+import os
+import json
+import shutil
+import torch
+import bmtrain as bmt
+from bmtrain.profiler import _union, _intersection
+
+class Layer(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.fc = bmt.nn.Linear(128, 128)
+
+    def forward(self, x):
+        return torch.relu(self.fc(x))
+
+def test_overlap():
+    comm = _union([(0, 4), (2, 6), (10, 12)])
+    assert_eq(comm, [[0, 6], [10, 12]])
+    assert_eq(_intersection(comm, _union([(5, 11)])), 2)
+    bmt.print_rank("overlap test passed")
+
+def test_profile():
+    model = bmt.TransformerBlockList([bmt.Block(Layer()) for _ in range(4)])
+    bmt.init_parameters(model)
+    optimizer = bmt.optim.AdamOptimizer(model.parameters())
+    optim_manager = bmt.optim.OptimManager()
+    optim_manager.add_optimizer(optimizer)
+
+    with bmt.profile(every=2, path="test_profile") as prof:
+        for _ in range(4):
+            x = torch.randn(16, 128, device="cuda", dtype=torch.half)
+            loss = model(x).float().sum()
+            optim_manager.zero_grad()
+            optim_manager.backward(loss)
+            optim_manager.step()
+            prof.step()
+
+    with open(os.path.join("test_profile", "trace_rank{:05d}.json".format(bmt.rank()))) as f:
+        events = [e for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+    # only the sampled steps
+    assert_eq(sorted(set(e["args"]["step"] for e in events)), [0, 2])
+    names = set(e["name"] for e in events)
+    for name in ["Layer.forward", "Layer.backward", "all_gather", "reduce_scatter", "AdamOptimizer.step"]:
+        assert_eq(name in names, True)
+    assert_eq(all(e["dur"] >= 0 for e in events), True)
+
+    bmt.synchronize()
+    if bmt.rank() == 0:
+        with open(os.path.join("test_profile", "summary.json")) as f:
+            summary = json.load(f)
+        assert_eq(summary["steps"], 2)
+        assert_eq(0 <= summary["overlap_efficiency"] <= 1, True)
+        shutil.rmtree("test_profile")
+    bmt.print_rank("profile test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_overlap()
+    test_profile()
@@ -0,0 +1,81 @@
+from utils import *
+import torch
+import bmtrain as bmt
+from bmtrain.global_var import config
+
+class Layer(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.w = bmt.DistributedParameter(torch.empty(64, 64), init_method=torch.nn.init.xavier_normal_)
+
+    def forward(self, x):
+        return x @ self.w
+
+def test_straggler():
+    x = torch.ones(1024, device="cuda")
+    with bmt.monitor_stragglers(every=3) as monitor:
+        for step in range(3):
+            if bmt.rank() == bmt.world_size() - 1:
+                # the last rank arrives late at every collective
+                torch.cuda._sleep(50000000)
+            bmt.distributed.all_reduce(x, "sum")
+            report = monitor.step()
+
+    if bmt.rank() != 0:
+        assert_eq(report, None)
+        return
+    assert_eq(report["steps"], 3)
+    assert_eq(report["ranks"][0]["rank"], bmt.world_size() - 1)
+    assert_eq(report["ranks"][0]["worst_site"], "all_reduce@world")
+    waits = {it["rank"]: it["wait"] for it in report["ranks"]}
+    assert waits[0] > waits[bmt.world_size() - 1]
+    sites = {it["site"]: it for it in report["sites"]}
+    assert_eq(sites["all_reduce@world"]["calls"], 3)
+    bmt.print_rank("straggler test passed")
+
+def test_pipeline():
+    model = bmt.PipelineTransformerBlockList([bmt.Block(Layer()) for _ in range(2)])
+    bmt.init_parameters(model)
+    stage_id = config["topology"].stage_id
+    x = torch.randn(4 * config["micros"], 64, device="cuda")
+    with bmt.monitor_stragglers(every=1) as monitor:
+        if stage_id == 1:
+            # the receives of the forward are posted late, the sends of stage 0 wait for them
+            torch.cuda._sleep(50000000)
+        model(x).sum().backward()
+        report = monitor.step()
+
+    if bmt.rank() != 0:
+        return
+    sites = {it["site"]: it for it in report["sites"]}
+    forward, backward = sites["pipe.p2p[0->1]@pipe0"], sites["pipe.p2p[1->0]@pipe0"]
+    # every send is matched with the receive of the same transfer, on the other stage
+    assert_eq(forward["ranks"], [0, 1])
+    assert_eq(forward["calls"], config["micros"])
+    assert_eq(backward["ranks"], [0, 1])
+    assert_eq(backward["calls"], config["micros"])
+    assert "pipe.send" not in str(sites) and "pipe.recv" not in str(sites)
+    ranks = {it["rank"]: it for it in report["ranks"]}
+    assert_eq(ranks[1]["worst_site"], "pipe.p2p[0->1]@pipe0")
+    assert ranks[0]["wait"] > ranks[1]["wait"]
+    bmt.print_rank("straggler pipeline test passed")
+
+def test_nested():
+    with bmt.monitor_stragglers() as monitor:
+        try:
+            with bmt.monitor_stragglers():
+                pass
+            assert False, "nested monitors must raise"
+        except RuntimeError as e:
+            assert_eq(str(e), "bmt.monitor_stragglers() can not be nested")
+        assert bmt.straggler.comm_call("test", config["comm"]) is not bmt.utils.NULL_CONTEXT
+    # the failed nested call does not deactivate the outer monitor, the exit of the outer one does
+    assert bmt.straggler.comm_call("test", config["comm"]) is bmt.utils.NULL_CONTEXT
+    bmt.print_rank("straggler nested test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed(pipe_size=2)
+
+    test_straggler()
+    test_pipeline()
+    test_nested()
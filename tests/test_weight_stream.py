@@ -0,0 +1,101 @@
+from utils import *
+import os
+import torch
+import torch.multiprocessing as mp
+import bmtrain as bmt
+from bmtrain.weight_stream import iter_layer_state_dicts, stream_weights, WeightSender, WeightReceiver
+
+class TestSubModule(bmt.DistributedModule):
+    def __init__(self):
+        super(TestSubModule, self).__init__()
+        self.fc1 = bmt.BMTrainModelWrapper(torch.nn.Linear(128, 256))
+        self.fc2 = bmt.BMTrainModelWrapper(torch.nn.Linear(256, 128))
+
+    def forward(self, x):
+        return self.fc2(self.fc1(x))
+
+class TestModule(bmt.DistributedModule):
+    def __init__(self):
+        super(TestModule, self).__init__()
+        self.embed = bmt.DistributedParameter(torch.zeros(100, 128), init_method=torch.nn.init.normal_)
+        self.layers = bmt.TransformerBlockList([bmt.Block(TestSubModule()) for _ in range(3)])
+
+def receive(address, queue):
+    receiver = WeightReceiver(address)
+    queue.put("ready")
+    state = {}
+    for _, state_dict in receiver:
+        for key, value in state_dict.items():
+            state[key] = value.clone()
+    receiver.close()
+    queue.put(state)
+
+def test_iter():
+    model = TestModule()
+    bmt.init_parameters(model)
+    state = model.state_dict()
+
+    names = []
+    streamed = {}
+    for name, state_dict in iter_layer_state_dicts(model):
+        names.append(name)
+        for key, value in state_dict.items():
+            streamed[key] = value.cpu()
+    assert_eq(names, ["layers.0", "layers.1", "layers.2", ""])
+    assert_eq(sorted(streamed.keys()), sorted(state.keys()))
+    for key in state:
+        assert_eq((streamed[key] == state[key]).all().item(), True)
+    bmt.print_rank("iter_layer_state_dicts test passed")
+
+def test_iter_state():
+    model = TestModule()
+    bmt.init_parameters(model)
+
+    def hook(module, state_dict, prefix, local_metadata):
+        state_dict[prefix + "hooked"] = torch.ones(1)
+    model._register_state_dict_hook(hook)
+
+    save_param_to_cpu = bmt.config["save_param_to_cpu"]
+    for name, state_dict in iter_layer_state_dicts(model):
+        # the settings of the gather are not leaked to the consumer
+        assert_eq(bmt.config["save_param_to_cpu"], save_param_to_cpu)
+        assert_eq(torch.is_grad_enabled(), True)
+        if name == "":
+            assert_eq("hooked" in state_dict, True)
+            assert_eq(state_dict._metadata[""]["version"], model._version)
+        else:
+            assert_eq("hooked" in state_dict, False)
+            assert_eq(name in state_dict._metadata, True)
+    assert_eq(bmt.config["save_param_to_cpu"], save_param_to_cpu)
+    bmt.print_rank("iter_layer_state_dicts state test passed")
+
+def test_sender():
+    model = TestModule()
+    bmt.init_parameters(model)
+    state = model.state_dict()
+
+    address = "/tmp/bmt_test_weight_stream_{}.sock".format(bmt.rank())
+    if os.path.exists(address):
+        os.remove(address)
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=receive, args=(address, queue))
+    proc.start()
+    assert_eq(queue.get(), "ready")
+
+    sender = WeightSender(address)
+    stream_weights(model, sender)
+    received = queue.get()
+    sender.close()
+    proc.join()
+
+    for key in state:
+        assert_eq((received[key] == state[key].cpu()).all().item(), True)
+    bmt.print_rank("weight sender test passed")
+
+if __name__ == "__main__":
+    bmt.init_distributed()
+
+    test_iter()
+    test_iter_state()
+    test_sender()